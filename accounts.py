@@ -1,55 +1,94 @@
-from typing import Optional
+from typing import Generator, Optional
 from colorama import Style
 
 import inputs
+from background import BackgroundTask
 from menu import color, error_incorrect_input, print_hint
-from util import JSONDatabase, check_password
+from util import JSONDatabase, Storage, check_password
 
 
 class AccountsDatabase(JSONDatabase):
 
-    def __init__(self):
-        super().__init__("accounts.json", [])
+    def __init__(self, storage: Storage):
+        super().__init__("accounts.json", [], storage=storage)
 
     def get_account(self, username: str) -> Optional[dict]:
-        for account in self.data:
-            if username and account["username"] == username:
-                return account
+        with self.lock.read():
+            for account in self.data:
+                if username and account["username"] == username:
+                    return account
         return None
 
     def get_usernames(self) -> list[str]:
-        return [account["username"] for account in self.data]
+        with self.lock.read():
+            return [account["username"] for account in self.data]
 
     def add_account(self, username: str, password_hash: str):
         normalised_username = username.lower()
-        if self.get_account(normalised_username):
-            raise ValueError(f"Username {normalised_username} already exists")
+        with self.lock.write():
+            if self.get_account(normalised_username):
+                raise ValueError(f"Username {normalised_username} already exists")
 
-        new_account = {"username": normalised_username, "password_hash": password_hash}
-        self.data.append(new_account)
-        self.save()
+            new_account = {
+                "username": normalised_username,
+                "password_hash": password_hash,
+            }
+            self.data.append(new_account)
+            self.save()
 
-    def authenticate_user(self, username: str, suppress_hints=False) -> bool:
+    def add_accounts(self, accounts: list[tuple[str, str]]):
+        """Adds lots of (username, password hash) accounts at once, saving the database
+        once at the end
+
+        - If any of the usernames already exist (or appear twice), raises ValueError
+          without adding any accounts
+        """
+        normalised_accounts = [
+            (username.lower(), password_hash) for username, password_hash in accounts
+        ]
+        with self.lock.write():
+            taken_usernames = {account["username"] for account in self.data}
+            for username, _ in normalised_accounts:
+                if username in taken_usernames:
+                    raise ValueError(f"Username {username} already exists")
+                taken_usernames.add(username)
+
+            self.data.extend(
+                {"username": username, "password_hash": password_hash}
+                for username, password_hash in normalised_accounts
+            )
+            self.save()
+
+    def authenticate_user(
+        self, username: str, suppress_hints=False
+    ) -> Generator[BackgroundTask, bool, bool]:
         """Prompts the user to enter their password, in order to log in with the provided username.
         Keeps prompting for a password until it's correctly entered or the user cancels.
         Returns True if authentication was successful, and False if it wasn't.
         Warning: The user has not been authenticated if the function returns False. Ensure this case is handled accordingly.
+        Checking a password is slow (on purpose), so this is a page generator that does
+        it in the background, e.g.
+        `is_authenticated = yield from accounts_database.authenticate_user(username)`
         """
         user = self.get_account(username)
         if not user:
             raise LookupError(f"User doesn't exist: {username}")
         correct_password_hash = user["password_hash"]
 
-        try:
-            attempt = inputs.password("Password: ")
-        except KeyboardInterrupt:
-            return False
+        while True:
+            try:
+                attempt = inputs.password("Password: ")
+            except KeyboardInterrupt:
+                return False
 
-        is_authenticated = check_password(attempt, correct_password_hash)
-        if is_authenticated: return True
+            is_authenticated = yield BackgroundTask(
+                "Checking your password", check_password, attempt, correct_password_hash
+            )
+            if is_authenticated:
+                return True
 
-        error_incorrect_input("Incorrect password")
-        if not suppress_hints:
-            # Let the user know how to give up entering their password
-            print_hint("Tip: Try again or press Ctrl+C to cancel")
-        return self.authenticate_user(username, suppress_hints=True)
+            error_incorrect_input("Incorrect password")
+            if not suppress_hints:
+                # Let the user know how to give up entering their password
+                print_hint("Tip: Try again or press Ctrl+C to cancel")
+                suppress_hints = True
@@ -0,0 +1,148 @@
+"""Statistics about whole cohorts of students, e.g. how many students are in each year
+group
+
+- The students' details are copied into NumPy arrays (one per column), so the statistics
+  are worked out with vectorised operations rather than a Python loop over every student
+- NumPy is an optional dependency (install it with `poetry install --extras analytics`).
+  If it isn't installed, numpy_available() returns False and the analytics reports are
+  hidden.
+"""
+from __future__ import annotations
+
+import datetime
+import threading
+from typing import TYPE_CHECKING, Optional
+
+import regex as re
+
+from inputs import TUTOR_GROUP_REGEX
+from metrics import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if TYPE_CHECKING:
+    from students import StudentsDatabase
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+class CohortColumns:
+    """The students' details that the statistics are worked out from, stored as NumPy
+    arrays
+    """
+
+    def __init__(self, students: list[dict]):
+        self.size = len(students)
+        self.birth_dates = np.array(
+            [student["birthday"] for student in students], dtype="datetime64[D]"
+        )
+
+        # Tutor groups are stored as codes, which are positions in the sorted list of
+        # tutor group names
+        tutor_group_names, tutor_group_codes = np.unique(
+            np.array([student["tutor_group"] for student in students], dtype=str),
+            return_inverse=True,
+        )
+        self.tutor_group_names: list[str] = tutor_group_names.tolist()
+        self.tutor_group_codes = tutor_group_codes.astype(np.int32)
+
+        # The year group is the number at the start of the tutor group, e.g. 9 for 9A
+        year_group_of_each_code = np.array(
+            [
+                int(re.match(TUTOR_GROUP_REGEX, name)[1])
+                for name in self.tutor_group_names
+            ],
+            dtype=np.int32,
+        )
+        self.year_groups = year_group_of_each_code[self.tutor_group_codes]
+
+        # Months are numbered from 0 (January), and days from 1
+        months_since_1970 = self.birth_dates.astype("datetime64[M]")
+        self.birth_years = (
+            months_since_1970.astype("datetime64[Y]").astype(np.int32) + 1970
+        )
+        self.birth_months = months_since_1970.astype(np.int32) % 12
+        self.birth_days = (self.birth_dates - months_since_1970).astype(np.int32) + 1
+
+    def ages(self, today: datetime.date):
+        """Returns an array of every student's age on the provided date"""
+        birthday_not_reached = (
+            self.birth_months + 1
+        ) * 100 + self.birth_days > today.month * 100 + today.day
+        return today.year - self.birth_years - birthday_not_reached
+
+
+class CohortAnalytics:
+    """Works out statistics about all of the students in a database
+
+    - The columns are only built again when the database has changed (i.e. its version
+      has changed)
+    """
+
+    def __init__(self, students_database: StudentsDatabase):
+        self.students_database = students_database
+        self._columns: Optional[CohortColumns] = None
+        self._columns_version: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def columns(self) -> CohortColumns:
+        with self.lock:
+            # Read the version and the data together, so the columns can't be labelled
+            # with the wrong version
+            with self.students_database.lock.read():
+                version = self.students_database.version
+                if self._columns is None or self._columns_version != version:
+                    with metrics.timer("analytics.build_columns"):
+                        self._columns = CohortColumns(self.students_database.data)
+                    self._columns_version = version
+            return self._columns
+
+    def age_distribution_by_tutor_group(
+        self, today: Optional[datetime.date] = None
+    ) -> dict[str, dict[int, int]]:
+        """Returns how many students of each age are in each tutor group, e.g. {"9A":
+        {13: 20, 14: 8}}
+        """
+        columns = self.columns()
+        if not columns.size:
+            return {}
+        ages = columns.ages(today or datetime.date.today())
+        youngest = int(ages.min())
+        age_count = int(ages.max()) - youngest + 1
+
+        # Count every (tutor group, age) combination at once, by giving each combination
+        # its own number
+        combinations = columns.tutor_group_codes * age_count + (ages - youngest)
+        counts = np.bincount(
+            combinations, minlength=len(columns.tutor_group_names) * age_count
+        )
+        counts = counts.reshape(len(columns.tutor_group_names), age_count)
+
+        return {
+            tutor_group: {
+                youngest + age_offset: int(count)
+                for age_offset, count in enumerate(counts[code])
+                if count
+            }
+            for code, tutor_group in enumerate(columns.tutor_group_names)
+        }
+
+    def birthday_month_histogram(self) -> list[int]:
+        """Returns how many students have a birthday in each month, starting with
+        January
+        """
+        columns = self.columns()
+        return np.bincount(columns.birth_months, minlength=12).tolist()
+
+    def year_group_sizes(self) -> dict[int, int]:
+        """Returns how many students are in each year group, e.g. {7: 180, 8: 175}"""
+        year_groups, counts = np.unique(self.columns().year_groups, return_counts=True)
+        return {
+            int(year_group): int(count)
+            for year_group, count in zip(year_groups, counts)
+        }
@@ -0,0 +1,544 @@
+"""An HTTP/JSON API for the pupil management system, e.g. for a tablet front-end at
+reception
+
+- The server is built on asyncio streams from the standard library, so it doesn't need
+  any extra libraries
+- Slow, blocking work (checking passwords with bcrypt and saving databases to disk) runs
+  in a thread pool, so the event loop can keep answering other clients in the meantime
+- Clients log in with POST /login, then send the token they get back in an
+  "Authorization: Bearer ..." header. Tokens expire after SESSION_SECONDS.
+- Handlers never touch the databases on the event loop, since a registration in another
+  thread can hold a database's write lock while it's saved
+- A server can serve several schools (tenants) from an AppPool, in which case every path
+  starts with the school's name, e.g. /schools/tree-road/students/42. Tokens only work
+  for the school they were issued by.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import secrets
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import phonenumbers
+import regex as re
+from phonenumbers.phonenumberutil import NumberParseException
+
+import reports
+from change_log import ChangesCompacted
+from inputs import TUTOR_GROUP_REGEX, VALID_NAME_REGEX
+from util import check_password
+
+if TYPE_CHECKING:
+    from app import App, AppPool
+
+# When serving several tenants, the tenant's name comes before the rest of the path
+TENANT_PATH_REGEX = re.compile(r"^/schools/(?P<tenant>[^/]+)(?P<path>/.*)$")
+
+# Requests with bigger bodies than this are rejected, to stop a client using up all the
+# memory
+MAX_BODY_SIZE = 64 * 1024
+# How long a login token lasts
+SESSION_SECONDS = 8 * 60 * 60
+
+
+class HTTPError(Exception):
+    """Raised by request handlers to send an error response to the client"""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: dict[str, str], body: bytes):
+        self.method = method
+        split_target = urlsplit(target)
+        self.path = split_target.path
+        # Only the first value of each query parameter is used
+        self.query = {
+            key: values[0] for key, values in parse_qs(split_target.query).items()
+        }
+        self.headers = headers
+        self.body = body
+        # Filled in from the path by the router, e.g. the student ID in /students/42
+        self.path_parameters: dict[str, str] = {}
+        # The app that the request is for, and the name of its tenant (if the server has
+        # more than one)
+        self.app: Optional[App] = None
+        self.tenant: Optional[str] = None
+
+    def json(self) -> dict:
+        """Parses the body of the request as a JSON object"""
+        try:
+            parsed_body = json.loads(self.body or b"{}")
+        except ValueError as error:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "Request body must be valid JSON"
+            ) from error
+        if not isinstance(parsed_body, dict):
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "Request body must be a JSON object"
+            )
+        return parsed_body
+
+    def wants_to_close(self) -> bool:
+        return self.headers.get("connection", "").lower() == "close"
+
+
+def public_student_info(student: dict) -> dict:
+    """Picks out the fields of a student that are returned by the API"""
+    return {
+        "id": student["id"],
+        "surname": student["surname"],
+        "forename": student["forename"],
+        "full_name": student["full_name"],
+        "birthday": student["birthday"],
+        "tutor_group": student["tutor_group"],
+        "home_address": student["home_address"],
+        "home_phone": student["home_phone"],
+        "school_email": student["school_email"],
+    }
+
+
+def required_text(body: dict, field: str) -> str:
+    value = body.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Missing field: {field}")
+    return value.strip()
+
+
+def parse_new_student(body: dict) -> dict:
+    """Validates the details of a new student, using the same rules as the terminal UI's
+    inputs
+
+    - Returns keyword arguments for StudentsDatabase.add_student()
+    """
+    surname = required_text(body, "surname")
+    forename = required_text(body, "forename")
+    for field, name in (("surname", surname), ("forename", forename)):
+        if not re.match(VALID_NAME_REGEX, name):
+            raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, f"Invalid {field}")
+
+    try:
+        birthday = datetime.date.fromisoformat(required_text(body, "birthday"))
+    except ValueError as error:
+        raise HTTPError(
+            HTTPStatus.UNPROCESSABLE_ENTITY, "Birthday must be in the format YYYY-MM-DD"
+        ) from error
+    if birthday > datetime.date.today():
+        raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "Birthday must be in the past")
+
+    tutor_group = required_text(body, "tutor_group").upper()
+    if not re.match(TUTOR_GROUP_REGEX, tutor_group):
+        raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid tutor group")
+
+    try:
+        phone_number = phonenumbers.parse(required_text(body, "home_phone"), "GB")
+    except NumberParseException as error:
+        raise HTTPError(
+            HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid phone number"
+        ) from error
+    if not phonenumbers.is_possible_number(phone_number):
+        raise HTTPError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid phone number")
+
+    return {
+        "surname": surname.title(),
+        "forename": forename.title(),
+        "birthday": birthday,
+        "home_address": required_text(body, "home_address"),
+        "home_phone": phonenumbers.format_number(
+            phone_number, phonenumbers.PhoneNumberFormat.INTERNATIONAL
+        ),
+        "tutor_group": tutor_group,
+    }
+
+
+def view_student(app: App, account: dict, **lookup) -> Optional[dict]:
+    """Finds a student (see StudentsDatabase.get_student) and records that the account
+    viewed them. This blocks, so it runs in the thread pool.
+    """
+    student = app.students_database.get_student(**lookup)
+    if student:
+        app.audit_log.record("view", student["id"], account)
+    return student
+
+
+Handler = Callable[[Request], Awaitable[object]]
+
+
+class ApiServer:
+    def __init__(
+        self,
+        app: Optional[App] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+        pool: Optional[AppPool] = None,
+        session_seconds: float = SESSION_SECONDS,
+    ):
+        """Serves either a single app, or every tenant in a pool (provide one or the
+        other)
+        """
+        if (app is None) == (pool is None):
+            raise ValueError("Provide either an app or a pool of apps to serve")
+        self.app = app
+        self.pool = pool
+        self.executor = executor or ThreadPoolExecutor(thread_name_prefix="api-worker")
+        self.session_seconds = session_seconds
+        # Maps each login token to the tenant and account it belongs to, and when it
+        # expires
+        self.sessions: dict[str, tuple[Optional[str], dict, float]] = {}
+
+        self.routes: list[tuple[str, re.Pattern, Handler]] = [
+            ("POST", re.compile(r"^/login$"), self.log_in),
+            ("POST", re.compile(r"^/logout$"), self.log_out),
+            ("GET", re.compile(r"^/students$"), self.find_student),
+            ("GET", re.compile(r"^/students/(?P<id>\d+)$"), self.get_student),
+            ("POST", re.compile(r"^/students$"), self.register_student),
+            (
+                "GET",
+                re.compile(r"^/reports/upcoming-birthdays$"),
+                self.upcoming_birthdays,
+            ),
+            ("GET", re.compile(r"^/reports/surnames$"), self.surnames_starting_with),
+            ("GET", re.compile(r"^/reports/forenames$"), self.forenames_starting_with),
+            ("GET", re.compile(r"^/changes$"), self.changes_since),
+        ]
+
+    async def run_blocking(self, function: Callable, *args, **kwargs):
+        """Runs a blocking function in the thread pool, so the event loop carries on"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, lambda: function(*args, **kwargs)
+        )
+
+    def authenticate(self, request: Request) -> dict:
+        """Returns the account that the request was made by, or raises an error if it
+        isn't logged in
+        """
+        authorization = request.headers.get("authorization", "")
+        token = (
+            authorization[len("Bearer ") :]
+            if authorization.startswith("Bearer ")
+            else ""
+        )
+        tenant, account, expires_at = self.sessions.get(token, (None, None, 0))
+        if account and expires_at <= time.monotonic():
+            del self.sessions[token]
+            account = None
+        if not account or tenant != request.tenant:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Log in to access this endpoint")
+        return account
+
+    def remove_expired_sessions(self):
+        """Forgets tokens that have expired, so logins don't build up forever"""
+        now = time.monotonic()
+        for token, (_tenant, _account, expires_at) in list(self.sessions.items()):
+            if expires_at <= now:
+                del self.sessions[token]
+
+    async def log_in(self, request: Request):
+        body = request.json()
+        username = str(body.get("username", "")).lower()
+        password = str(body.get("password", ""))
+
+        account = await self.run_blocking(
+            request.app.accounts_database.get_account, username
+        )
+        is_authenticated = account is not None and await self.run_blocking(
+            check_password, password, account["password_hash"]
+        )
+        if not account or not is_authenticated:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Incorrect username or password")
+
+        self.remove_expired_sessions()
+        token = secrets.token_urlsafe(32)
+        self.sessions[token] = (
+            request.tenant,
+            account,
+            time.monotonic() + self.session_seconds,
+        )
+        return {"token": token, "username": account["username"]}
+
+    async def log_out(self, request: Request):
+        self.authenticate(request)
+        token = request.headers["authorization"][len("Bearer ") :]
+        del self.sessions[token]
+        return {"logged_out": True}
+
+    async def get_student(self, request: Request):
+        account = self.authenticate(request)
+        student = await self.run_blocking(
+            view_student, request.app, account, id=int(request.path_parameters["id"])
+        )
+        if not student:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No student with that ID")
+        return public_student_info(student)
+
+    async def find_student(self, request: Request):
+        account = self.authenticate(request)
+        email_address = request.query.get("email")
+        if not email_address:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "Provide an email address to search for"
+            )
+        student = await self.run_blocking(
+            view_student, request.app, account, email_address=email_address
+        )
+        if not student:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No student with that email address")
+        return public_student_info(student)
+
+    async def register_student(self, request: Request):
+        account = self.authenticate(request)
+        new_student = parse_new_student(request.json())
+
+        def register():
+            student = request.app.students_database.add_student(**new_student)
+            request.app.audit_log.record("register", student["id"], account)
+            return student
+
+        # Adding a student saves the whole database to disk, so do it off the event loop
+        student = await self.run_blocking(register)
+        return public_student_info(student)
+
+    async def upcoming_birthdays(self, request: Request):
+        account = self.authenticate(request)
+        query = reports.upcoming_birthdays_query(
+            request.app.students_database, account
+        )
+        students = await self.run_blocking(query.run)
+        return {"students": [public_student_info(student) for student in students]}
+
+    async def surnames_starting_with(self, request: Request):
+        account = self.authenticate(request)
+        prefix = request.query.get("prefix", "")
+        query = reports.surnames_starting_with_query(
+            request.app.students_database, prefix, account
+        )
+        students = await self.run_blocking(query.run)
+        return {"students": [public_student_info(student) for student in students]}
+
+    async def forenames_starting_with(self, request: Request):
+        account = self.authenticate(request)
+        prefix = request.query.get("prefix", "")
+        query = reports.forenames_starting_with_query(
+            request.app.students_database, prefix, account
+        )
+        students = await self.run_blocking(query.run)
+        return {"students": [public_student_info(student) for student in students]}
+
+    async def changes_since(self, request: Request):
+        """Lists the changes to the students since the `since` sequence number, or a
+        full snapshot if `since` is missing
+        """
+        self.authenticate(request)
+        if "since" not in request.query:
+            seq, students = await self.run_blocking(
+                request.app.students_database.snapshot
+            )
+            return {
+                "seq": seq,
+                "students": [public_student_info(student) for student in students],
+            }
+
+        try:
+            since = int(request.query["since"])
+        except ValueError as error:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "since must be a sequence number"
+            ) from error
+        try:
+            changes = await self.run_blocking(
+                request.app.students_database.changes_since, since
+            )
+        except ChangesCompacted as error:
+            raise HTTPError(HTTPStatus.GONE, str(error)) from error
+        return {"changes": changes}
+
+    async def find_app(self, request: Request):
+        """Works out which app the request is for, removing the tenant from the start of
+        the path
+        """
+        if self.pool is None:
+            request.app = self.app
+            return
+
+        match = TENANT_PATH_REGEX.match(request.path)
+        if not match:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found")
+        tenant = match["tenant"]
+
+        # Loading a tenant reads its databases from disk, so only do it off the event
+        # loop if it's needed. The app is leased so it can't be evicted during the
+        # request (dispatch() releases it).
+        app = self.pool.get_if_loaded(tenant, lease=True)
+        if app is None:
+            try:
+                app = await self.run_blocking(self.pool.get, tenant, lease=True)
+            except LookupError as error:
+                raise HTTPError(
+                    HTTPStatus.NOT_FOUND, f"No school called {tenant}"
+                ) from error
+
+        request.app = app
+        request.tenant = tenant
+        request.path = match["path"]
+
+    async def dispatch(self, request: Request) -> tuple[HTTPStatus, object]:
+        """Finds the handler for a request and runs it, converting errors into responses
+
+        - Unexpected errors are printed and sent to the client as a 500, rather than
+          dropping the connection
+        """
+        try:
+            return await self.route(request)
+        except HTTPError as error:
+            return error.status, {"error": error.message}
+        except Exception:
+            traceback.print_exc()
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+        finally:
+            if self.pool is not None and request.tenant is not None:
+                # Releasing can evict other tenants, which writes out their audit events
+                await self.run_blocking(self.pool.release, request.tenant)
+
+    async def route(self, request: Request) -> tuple[HTTPStatus, object]:
+        await self.find_app(request)
+
+        path_matched = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            path_matched = True
+            if method != request.method:
+                continue
+
+            request.path_parameters = match.groupdict()
+            return HTTPStatus.OK, await handler(request)
+
+        if path_matched:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Method not allowed"}
+        return HTTPStatus.NOT_FOUND, {"error": "Not found"}
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        """Reads one HTTP/1.1 request from the connection, returning None if the client
+        has disconnected
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        try:
+            method, target, _version = request_line.decode("latin-1").split()
+        except ValueError as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line") from error
+
+        headers = {}
+        while True:
+            header_line = await reader.readline()
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header_line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", 0) or 0)
+        except ValueError as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length") from error
+        if content_length < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if content_length > MAX_BODY_SIZE:
+            raise HTTPError(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large"
+            )
+        body = await reader.readexactly(content_length) if content_length else b""
+
+        return Request(method.upper(), target, headers, body)
+
+    def write_response(
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        payload: object,
+        close: bool,
+    ):
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            + "Content-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n"
+            + f"Connection: {'close' if close else 'keep-alive'}\r\n"
+            + "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Serves requests from one client until it disconnects (connections are kept
+        alive between requests)
+        """
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as error:
+                    self.write_response(
+                        writer, error.status, {"error": error.message}, close=True
+                    )
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+
+                status, payload = await self.dispatch(request)
+                self.write_response(
+                    writer, status, payload, close=request.wants_to_close()
+                )
+                await writer.drain()
+                if request.wants_to_close():
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The client went away mid-request
+            return
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8080) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def serve_forever(self, host="127.0.0.1", port=8080):
+        """Runs the server until the process is interrupted (e.g. with Ctrl+C)"""
+
+        async def evict_idle_tenants():
+            while True:
+                await asyncio.sleep(60)
+                self.pool.evict_idle()
+
+        async def run():
+            server = await self.start(host, port)
+            print(f"Serving the API on http://{host}:{port} (press Ctrl+C to stop)")
+            if self.pool is not None and self.pool.idle_seconds is not None:
+                # Keep a reference to the task, so it isn't garbage collected
+                self.eviction_task = asyncio.create_task(evict_idle_tenants())
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown()
+            if self.pool is not None:
+                # Apps that are still loaded may have audit events that haven't been
+                # written yet
+                self.pool.flush_all()
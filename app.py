@@ -1,10 +1,21 @@
 """Manages the global context for the app, serving as a back-end for database access etc."""
+from __future__ import annotations
 
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
+from typing import Callable, Optional
+
+import regex as re
+import integrity
+import migrations
 from accounts import AccountsDatabase
+from audit import AuditLog
+from metadata import MetadataDatabase
 from settings import SettingsDatabase
 from students import StudentsDatabase
-from util import JSONDatabase
+from util import FileStorage, Storage
 
 
 class Brand:
@@ -16,20 +27,239 @@ class Brand:
 class App:
     """A running instance of the application"""
 
-    def __init__(self, data_directory=Path(".", "data")) -> None:
+    def __init__(
+        self,
+        data_directory=Path(".", "data"),
+        storage: Optional[Storage] = None,
+        verify_on_load=False,
+    ) -> None:
+        """Creates an instance of the app, loading its databases from storage
+
+        - By default, all database files are stored in the data directory
+        - Alternatively, a storage backend can be provided (e.g. MemoryStorage for
+          tests), in which case data_directory= is ignored
+        - With verify_on_load=True, the files are checked before they're loaded
+          (skipping files that haven't changed since they were last checked), raising
+          integrity.IntegrityError if any of them have problems
+        """
         self.brand = Brand
 
-        # Store all database files in the data directory
-        JSONDatabase.base_path = data_directory
+        # Each instance has its own storage, so multiple instances can be used at once
+        self.storage = storage if storage is not None else FileStorage(data_directory)
 
         # Initialise the JSON databases
-        self.settings_database = SettingsDatabase()
-        self.accounts_database = AccountsDatabase()
-        self.students_database = StudentsDatabase(app=self)
+        self.metadata_database = MetadataDatabase(storage=self.storage)
+        # Bring the other database files up to date before they're loaded
+        self.applied_migrations = migrations.run_pending(
+            self.storage, self.metadata_database
+        )
+        if verify_on_load:
+            integrity.check_on_load(self.storage, self.metadata_database)
+        self.settings_database = SettingsDatabase(storage=self.storage)
+        self.accounts_database = AccountsDatabase(storage=self.storage)
+        self.students_database = StudentsDatabase(app=self, storage=self.storage)
+        # Records who viewed or changed each student
+        self.audit_log = AuditLog(storage=self.storage)
 
         # Store the account that is currently signed in
-        self.current_account = None
+        self._current_account = None
+        # Incremented every time someone logs in or out
+        self.session_version = 0
+
+    @property
+    def current_account(self) -> Optional[dict]:
+        return self._current_account
+
+    @current_account.setter
+    def current_account(self, account: Optional[dict]):
+        self._current_account = account
+        self.session_version += 1
+
+    def state_version(self) -> tuple[int, ...]:
+        """Returns a value that changes whenever the state of the app changes, i.e. when
+        someone logs in/out or a database is changed. Used to tell when cached results
+        (like which menu options to show) need to be worked out again."""
+        return (
+            self.session_version,
+            self.settings_database.version,
+            self.accounts_database.version,
+            self.students_database.version,
+        )
 
     def signed_in(self):
         """Checks if the user is signed in with an account"""
         return self.current_account is not None
+
+
+# Tenant names are used as directory names, so they're kept simple
+VALID_TENANT_REGEX = r"^[a-z0-9][a-z0-9_\-]{0,63}$"
+
+
+class AppPool:
+    """Keeps an App loaded for each tenant (e.g. each school in a trust) that is being
+    used
+
+    - Loading a tenant's databases is slow, so recently-used tenants are kept in memory
+    - When more than max_loaded tenants are loaded, the least recently used one is
+      evicted. Tenants that haven't been used for idle_seconds can also be evicted with
+      evict_idle().
+    - Every change is saved as soon as it's made (and audit events are written when the
+      tenant is evicted), so evicting a tenant doesn't lose anything
+    """
+
+    def __init__(
+        self,
+        storage_for_tenant: Callable[[str], Storage],
+        max_loaded: int = 8,
+        idle_seconds: Optional[float] = None,
+    ):
+        """storage_for_tenant= returns the storage backend for a tenant,
+        or raises a LookupError if there's no tenant with that name"""
+        self.storage_for_tenant = storage_for_tenant
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        # Maps each loaded tenant to its app and when it was last used, with the least
+        # recently used first
+        self.apps: OrderedDict[str, tuple[App, float]] = OrderedDict()
+        self.lock = threading.Lock()
+        # Stops two threads loading the same tenant at once
+        self.loading_locks: dict[str, threading.Lock] = {}
+        # How many times each tenant is currently leased (see get()), so it isn't
+        # evicted while it's being used
+        self.leases: dict[str, int] = {}
+
+    @classmethod
+    def for_directory(cls, tenants_directory: Path, **options) -> AppPool:
+        """Creates a pool with a tenant for each subdirectory of tenants_directory"""
+
+        def storage_for_tenant(tenant: str) -> Storage:
+            tenant_directory = tenants_directory / tenant
+            if not tenant_directory.is_dir():
+                raise LookupError(f"No tenant called {tenant}")
+            return FileStorage(tenant_directory)
+
+        return cls(storage_for_tenant, **options)
+
+    def get(self, tenant: str, lease: bool = False) -> App:
+        """Returns the app for a tenant, loading it if it isn't already loaded
+
+        - Raises a LookupError if the tenant doesn't exist
+        - With lease=True, the app won't be evicted until it's handed back with
+          release(), e.g. while a request is using it
+        """
+        if not re.match(VALID_TENANT_REGEX, tenant):
+            raise LookupError(f"Invalid tenant name: {tenant}")
+
+        with self.lock:
+            if tenant in self.apps:
+                return self.mark_used(tenant, lease)
+            loading_lock = self.loading_locks.setdefault(tenant, threading.Lock())
+
+        # Load the tenant without holding self.lock, so other tenants can still be used
+        # in the meantime
+        with loading_lock:
+            with self.lock:
+                if tenant in self.apps:
+                    return self.mark_used(tenant, lease)
+
+            try:
+                app = App(storage=self.storage_for_tenant(tenant))
+            except BaseException:
+                with self.lock:
+                    self.loading_locks.pop(tenant, None)
+                raise
+
+            with self.lock:
+                self.apps[tenant] = (app, time.monotonic())
+                if lease:
+                    self.leases[tenant] = self.leases.get(tenant, 0) + 1
+                self.loading_locks.pop(tenant, None)
+                evicted_apps = self.evict_over_capacity()
+        self.flush(evicted_apps)
+        return app
+
+    def get_if_loaded(self, tenant: str, lease: bool = False) -> Optional[App]:
+        """Returns the app for a tenant if it's already loaded (which is quick),
+        otherwise None
+        """
+        with self.lock:
+            if tenant in self.apps:
+                return self.mark_used(tenant, lease)
+        return None
+
+    def release(self, tenant: str):
+        """Hands back an app that was leased with get(..., lease=True), so it can be
+        evicted again
+        """
+        with self.lock:
+            self.leases[tenant] -= 1
+            if not self.leases[tenant]:
+                del self.leases[tenant]
+            evicted_apps = self.evict_over_capacity()
+        self.flush(evicted_apps)
+
+    def mark_used(self, tenant: str, lease: bool = False) -> App:
+        """Marks a loaded tenant as the most recently used (self.lock must be held)"""
+        app, _last_used = self.apps[tenant]
+        self.apps[tenant] = (app, time.monotonic())
+        self.apps.move_to_end(tenant)
+        if lease:
+            self.leases[tenant] = self.leases.get(tenant, 0) + 1
+        return app
+
+    def evict_over_capacity(self) -> list[App]:
+        """Evicts the least recently used tenants until no more than max_loaded are
+        loaded (self.lock must be held)
+
+        - Leased tenants are skipped, so there can be more than max_loaded while they're
+          in use
+        - Returns the evicted apps, which should be flushed (without holding self.lock)
+        """
+        evicted_apps = []
+        unleased_tenants = [tenant for tenant in self.apps if tenant not in self.leases]
+        for tenant in unleased_tenants[: max(0, len(self.apps) - self.max_loaded)]:
+            app, _last_used = self.apps.pop(tenant)
+            evicted_apps.append(app)
+        return evicted_apps
+
+    def flush(self, apps: list[App]):
+        """Writes out the audit events that evicted apps are still holding in memory"""
+        for app in apps:
+            app.audit_log.flush()
+
+    def flush_all(self):
+        """Writes out the audit events of every loaded app, e.g. when the server is
+        stopping
+        """
+        with self.lock:
+            apps = [app for app, _last_used in self.apps.values()]
+        self.flush(apps)
+
+    def evict_idle(self, now: Optional[float] = None) -> list[str]:
+        """Evicts the tenants that haven't been used for idle_seconds (unless they're
+        leased), returning their names
+        """
+        if self.idle_seconds is None:
+            return []
+        cutoff = (now if now is not None else time.monotonic()) - self.idle_seconds
+
+        evicted = []
+        evicted_apps = []
+        with self.lock:
+            # The least recently used tenants are first, so stop at the first one that's
+            # been used recently
+            for tenant, (app, last_used) in list(self.apps.items()):
+                if last_used >= cutoff:
+                    break
+                if tenant in self.leases:
+                    continue
+                del self.apps[tenant]
+                evicted_apps.append(app)
+                evicted.append(tenant)
+        self.flush(evicted_apps)
+        return evicted
+
+    def loaded_tenants(self) -> list[str]:
+        """Returns the names of the loaded tenants, from least to most recently used"""
+        with self.lock:
+            return list(self.apps)
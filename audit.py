@@ -0,0 +1,217 @@
+"""An audit trail of which account viewed, registered or changed each student, for
+safeguarding
+
+- Each event is a fixed-width binary record (see RECORD), added to the end of audit.log
+- Events are collected in memory and written in groups (at most COMMIT_INTERVAL seconds
+  after the first one in the group), so recording an event doesn't have to touch the
+  disk. Call flush() to write them straight away.
+- Accounts are stored as numbers, which are positions in a list of usernames
+  (audit-accounts.json)
+- Finding every event for a student uses an index of where each student's events are in
+  the log, which is built the first time it's needed and then kept up to date
+"""
+from __future__ import annotations
+
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Iterator, Optional
+
+from metrics import metrics
+from util import JSONDatabase, Storage
+
+# The start of the file, so other files can't be mistaken for an audit log
+HEADER = b"PMSAUDIT"
+# Timestamp (milliseconds since 1970), student ID, account number, action, and a byte of
+# padding
+RECORD = struct.Struct("<QIHBx")
+
+# Actions are stored as numbers. New actions must be added to the end, so the numbers of
+# old actions stay the same
+ACTIONS = ["view", "register", "update", "archive", "purge"]
+ACTION_NUMBERS = {action: number for number, action in enumerate(ACTIONS)}
+
+# Account number 0 means nobody was signed in
+NO_ACCOUNT = 0
+COMMIT_INTERVAL = 1.0
+# How many events can be waiting to be written before they're written without waiting
+# for the interval
+MAX_PENDING_EVENTS = 4096
+READ_BLOCK_SIZE = RECORD.size * 65536
+
+
+class AuditLog:
+    def __init__(
+        self,
+        storage: Storage,
+        filename="audit.log",
+        commit_interval: float = COMMIT_INTERVAL,
+    ):
+        self.storage = storage
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.accounts = JSONDatabase("audit-accounts.json", [], storage=storage)
+        self.account_numbers = {
+            username: number + 1 for number, username in enumerate(self.accounts.data)
+        }
+        # Re-entrant, so the index can be built (which reads the whole log) without
+        # letting events in part-way through
+        self.lock = threading.RLock()
+
+        # Events that haven't been written yet, and a timer that will write them
+        self.pending = bytearray()
+        self.commit_timer: Optional[threading.Timer] = None
+        self.written_count = self.count_written_events()
+        # Maps each student ID to the positions of their events in the log (including
+        # pending events)
+        self._student_index: Optional[dict[int, array]] = None
+
+    def count_written_events(self) -> int:
+        """Works out how many events are in the file, creating the file if it doesn't
+        exist
+        """
+        try:
+            with self.storage.open_for_reading(self.filename) as file:
+                header = file.read(len(HEADER))
+                size = file.seek(0, 2)
+        except FileNotFoundError:
+            self.storage.write_bytes(self.filename, HEADER)
+            return 0
+        if header != HEADER:
+            raise ValueError(f"{self.filename} isn't an audit log")
+
+        count, partial_bytes = divmod(size - len(HEADER), RECORD.size)
+        if partial_bytes:
+            # The program stopped part-way through writing an event, so remove the
+            # half-written event
+            self.storage.truncate(self.filename, len(HEADER) + count * RECORD.size)
+        return count
+
+    def account_number(self, account: Optional[dict]) -> int:
+        if account is None:
+            return NO_ACCOUNT
+        username = account["username"]
+        number = self.account_numbers.get(username)
+        if number is None:
+            with self.accounts.lock.write():
+                # Another thread might have added the account while this one was waiting
+                # for the lock
+                number = self.account_numbers.get(username)
+                if number is None:
+                    self.accounts.data.append(username)
+                    self.accounts.save()
+                    number = self.account_numbers[username] = len(self.accounts.data)
+        return number
+
+    def record(
+        self,
+        action: str,
+        student_id: int,
+        account: Optional[dict],
+        timestamp: Optional[float] = None,
+    ):
+        """Adds an event to the log (it's saved within the commit interval)"""
+        account_number = self.account_number(account)
+        milliseconds = round(
+            (timestamp if timestamp is not None else time.time()) * 1000
+        )
+        with self.lock:
+            position = self.written_count + len(self.pending) // RECORD.size
+            self.pending += RECORD.pack(
+                milliseconds, student_id, account_number, ACTION_NUMBERS[action]
+            )
+            if self._student_index is not None:
+                self._student_index.setdefault(student_id, array("Q")).append(position)
+
+            if len(self.pending) >= MAX_PENDING_EVENTS * RECORD.size:
+                self._write_pending()
+            elif self.commit_timer is None:
+                # This is the first event in a new group, so make sure the group is
+                # written soon
+                self.commit_timer = threading.Timer(self.commit_interval, self.flush)
+                self.commit_timer.daemon = True
+                self.commit_timer.start()
+        metrics.increment("audit.events")
+
+    def _write_pending(self):
+        """Writes the pending events to storage (the lock must be held)"""
+        if self.commit_timer is not None:
+            self.commit_timer.cancel()
+            self.commit_timer = None
+        if not self.pending:
+            return
+        self.storage.append_bytes(self.filename, bytes(self.pending))
+        self.written_count += len(self.pending) // RECORD.size
+        self.pending.clear()
+
+    def flush(self):
+        """Writes any events that are waiting to be written"""
+        with self.lock:
+            self._write_pending()
+
+    def event_from_record(self, record: bytes) -> dict:
+        milliseconds, student_id, account_number, action_number = RECORD.unpack(record)
+        return {
+            "timestamp": datetime.fromtimestamp(milliseconds / 1000),
+            "student_id": student_id,
+            "username": self.accounts.data[account_number - 1]
+            if account_number != NO_ACCOUNT
+            else None,
+            "action": ACTIONS[action_number],
+        }
+
+    def iter_blocks(self) -> Iterator[bytes]:
+        """Yields the records of every event, oldest first, in blocks of many records"""
+        with self.lock:
+            written_count = self.written_count
+            pending = bytes(self.pending)
+        with self.storage.open_for_reading(self.filename) as file:
+            file.seek(len(HEADER))
+            remaining_bytes = written_count * RECORD.size
+            while remaining_bytes:
+                block = file.read(min(READ_BLOCK_SIZE, remaining_bytes))
+                remaining_bytes -= len(block)
+                yield block
+        if pending:
+            yield pending
+
+    def events(self) -> Iterator[dict]:
+        """Yields every event in the log, oldest first"""
+        for block in self.iter_blocks():
+            for offset in range(0, len(block), RECORD.size):
+                yield self.event_from_record(block[offset : offset + RECORD.size])
+
+    @metrics.timed("audit.build_index")
+    def build_student_index(self) -> dict[int, array]:
+        student_index: dict[int, array] = {}
+        position = 0
+        for block in self.iter_blocks():
+            for _, student_id, _, _ in RECORD.iter_unpack(block):
+                positions = student_index.get(student_id)
+                if positions is None:
+                    positions = student_index[student_id] = array("Q")
+                positions.append(position)
+                position += 1
+        return student_index
+
+    def events_for_student(self, student_id: int) -> list[dict]:
+        """Returns every event for a student, oldest first"""
+        with self.lock:
+            if self._student_index is None:
+                self._student_index = self.build_student_index()
+            positions = list(self._student_index.get(student_id, ()))
+            written_count = self.written_count
+            pending = bytes(self.pending)
+
+        records = []
+        with self.storage.open_for_reading(self.filename) as file:
+            for position in positions:
+                if position < written_count:
+                    file.seek(len(HEADER) + position * RECORD.size)
+                    records.append(file.read(RECORD.size))
+                else:
+                    offset = (position - written_count) * RECORD.size
+                    records.append(pending[offset : offset + RECORD.size])
+        return [self.event_from_record(record) for record in records]
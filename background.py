@@ -0,0 +1,164 @@
+"""Runs slow work (e.g. checking passwords or saving a large database) in the background
+while the terminal UI shows a spinner, so the UI doesn't look frozen and Ctrl+C still
+works straight away
+
+- A page hands over slow work by yielding a BackgroundTask, and gets the result back
+  from the yield:
+      student = yield BackgroundTask("Saving", students_database.add_student, ...)
+  Pages that don't yield anything work the same as before.
+- Exceptions raised by the task are raised again at the yield, as if the work had been
+  done there
+- If the user presses Ctrl+C, the page stops straight away. Work that has already
+  started is left to finish, so a database is never left half-saved.
+"""
+from __future__ import annotations
+
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from types import GeneratorType
+from typing import Any, Callable, Optional
+
+from colorama import Style
+
+from metrics import metrics
+
+SPINNER_FRAMES = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+# How often the spinner moves, and how long to wait before showing it (so quick tasks
+# don't make it flicker)
+SPINNER_INTERVAL = 0.08
+SPINNER_DELAY = 0.15
+
+
+class BackgroundTask:
+    """Some slow work for a page to hand over to the background, see the module
+    docstring
+    """
+
+    def __init__(self, message: str, function: Callable, *args, **kwargs):
+        self.message = message
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self) -> Any:
+        return self.function(*self.args, **self.kwargs)
+
+
+class Spinner:
+    """An animation on the current line of the terminal, which is removed when it's
+    cleared
+
+    - Nothing is shown if the output isn't a terminal (e.g. when the output is being
+      captured)
+    """
+
+    def __init__(self, message: str):
+        self.message = message
+        self.enabled = sys.stdout.isatty()
+        self.frame_number = 0
+        self.shown = False
+
+    def tick(self):
+        if not self.enabled:
+            return
+        frame = SPINNER_FRAMES[self.frame_number % len(SPINNER_FRAMES)]
+        sys.stdout.write(f"\r{frame} {self.message}{Style.DIM}...{Style.RESET_ALL}")
+        sys.stdout.flush()
+        self.frame_number += 1
+        self.shown = True
+
+    def clear(self):
+        if self.shown:
+            # Move back to the start of the line and clear it, so the page carries on
+            # where the spinner was
+            sys.stdout.write("\r\033[K")
+            sys.stdout.flush()
+            self.shown = False
+
+
+class BackgroundWorker:
+    """Runs the background tasks yielded by pages, one at a time and in order"""
+
+    def __init__(self, inline: bool = False):
+        """inline=True runs the tasks in the calling thread instead, without a spinner
+        (e.g. while profiling)
+        """
+        self.inline = inline
+        # One thread, so tasks (like two saves) happen in the order they were yielded
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="background"
+        )
+
+    def wait_for(self, task: BackgroundTask) -> Any:
+        """Runs a task in the background and waits for its result, showing a spinner if
+        it takes a while
+        """
+        if self.inline:
+            return task.run()
+        future: Future = self.executor.submit(task.run)
+        spinner = Spinner(task.message)
+        started_at = time.monotonic()
+        try:
+            with metrics.timer("background.wait"):
+                while True:
+                    try:
+                        # Waiting with a timeout means Ctrl+C is noticed between checks
+                        return future.result(timeout=SPINNER_INTERVAL)
+                    except FutureTimeoutError:
+                        if time.monotonic() - started_at >= SPINNER_DELAY:
+                            spinner.tick()
+        except KeyboardInterrupt:
+            # Stop the task if it hasn't started yet (if it has, it's left to finish in
+            # the background)
+            future.cancel()
+            raise
+        finally:
+            spinner.clear()
+
+    def run_page(self, callback: Callable[[], Any]) -> Any:
+        """Runs a page callback, doing the work for each task it yields in the
+        background
+
+        - Returns whatever the callback returns
+        """
+        return drive(callback(), self.wait_for)
+
+
+def drive(page: Any, run_task: Callable[[BackgroundTask], Any]) -> Any:
+    """Runs a page until it finishes, sending it the result of each task it yields, and
+    returns its result
+
+    - page= is what the page's callback returned, which is only a generator if the page
+      yields tasks
+    """
+    if not isinstance(page, GeneratorType):
+        return page
+
+    value_to_send: Any = None
+    error_to_throw: Optional[BaseException] = None
+    while True:
+        try:
+            if error_to_throw is not None:
+                task = page.throw(error_to_throw)
+            else:
+                task = page.send(value_to_send)
+        except StopIteration as stop:
+            return stop.value
+        value_to_send, error_to_throw = None, None
+
+        try:
+            value_to_send = run_task(task)
+        except KeyboardInterrupt:
+            page.close()
+            raise
+        except Exception as error:
+            error_to_throw = error
+
+
+def run_now(page: Any) -> Any:
+    """Runs a page's tasks straight away in the current thread (without a spinner), e.g.
+    for benchmarks and tests
+    """
+    return drive(page, BackgroundTask.run)
@@ -0,0 +1,243 @@
+"""Incremental backups of the databases, which only store the parts of each file that
+have changed
+
+- Each file is split into chunks at points chosen by its content, so a change to one
+  student only changes the chunks around it, and the chunks before and after it stay the
+  same. See split_into_chunks()
+- Chunks are named by their SHA-256 hash, so a chunk that's already in the backup store
+  is never written again
+- A snapshot records which chunks make up each file at the time it was taken,
+  so the databases can be restored to how they were at any snapshot
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, Optional
+
+from metrics import metrics
+from util import Storage
+
+# The files that are backed up (if they exist)
+DATABASE_FILES = [
+    "students.json",
+    "students-archive.json",
+    "students-changes.jsonl",
+    "accounts.json",
+    "settings.json",
+    "metadata.json",
+    "audit.log",
+    "audit-accounts.json",
+]
+# The audit trail is only ever added to, so it's backed up but never restored. Otherwise
+# restoring an older snapshot would erase the record of who viewed or changed each
+# student since then.
+APPEND_ONLY_FILES = {"audit.log", "audit-accounts.json"}
+
+MIN_CHUNK_SIZE = 512
+MAX_CHUNK_SIZE = 64 * 1024
+# Chunks can end after a "}" (the end of a JSON object, e.g. a student), if a hash of
+# the bytes before it ends in three zero bits. Students are about 280 bytes long, so
+# chunks are about 2.5 KiB on average. Smaller chunks mean less is written when a few
+# students change, but a longer list of chunks for each file
+CUT_AFTER = b"}"
+HASH_WINDOW = 48
+CUT_MASK = 0b111
+
+SNAPSHOTS_FILENAME = "snapshots.jsonl"
+# The hashes of every chunk in the store, one after another
+CHUNK_INDEX_FILENAME = "chunks.idx"
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+class SnapshotNotFound(LookupError):
+    pass
+
+
+def split_into_chunks(contents: bytes) -> Iterator[bytes]:
+    """Splits a file into chunks, cutting at points that only depend on the bytes just
+    before them
+
+    - Adding or removing bytes only moves the cut points next to the change, so the rest
+      of the chunks are the same as in the last backup (unlike cutting every N bytes,
+      which would move every cut point after the change)
+    - This is a rolling hash that's only checked at possible cut points (after a "}"),
+      rather than after every byte, since updating a rolling hash for every byte is very
+      slow in Python
+    """
+    start = 0
+    length = len(contents)
+    while start < length:
+        end = min(start + MAX_CHUNK_SIZE, length)
+        cut = end
+        position = start + MIN_CHUNK_SIZE
+        while position < end:
+            position = contents.find(CUT_AFTER, position, end)
+            if position == -1:
+                break
+            position += 1
+            if not zlib.crc32(contents[position - HASH_WINDOW : position]) & CUT_MASK:
+                cut = position
+                break
+        yield contents[start:cut]
+        start = cut
+
+
+class BackupStore:
+    """A collection of snapshots of the databases, kept in its own storage (e.g. a
+    FileStorage for data/backups)
+
+    - Chunks are compressed and kept in files named after their hash, e.g.
+      chunk-9f86d08...
+    - The list of chunks that make up a file is stored as a chunk too, so an unchanged
+      file takes up no extra space
+    - Snapshots are added to the end of snapshots.jsonl
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        try:
+            chunk_index = self.storage.read_bytes(CHUNK_INDEX_FILENAME)
+        except FileNotFoundError:
+            chunk_index = b""
+        self.known_chunks = {
+            chunk_index[offset : offset + DIGEST_SIZE]
+            for offset in range(0, len(chunk_index) - DIGEST_SIZE + 1, DIGEST_SIZE)
+        }
+
+    def snapshots(self) -> list[dict]:
+        """Returns every snapshot, oldest first"""
+        try:
+            contents = self.storage.read_bytes(SNAPSHOTS_FILENAME)
+        except FileNotFoundError:
+            return []
+        return [
+            json.loads(line) for line in contents.decode("utf-8").splitlines() if line
+        ]
+
+    def find_snapshot(
+        self, snapshot_id: Optional[int] = None, at: Optional[datetime] = None
+    ) -> dict:
+        """Finds a snapshot by its ID, or the latest snapshot taken at or before a time
+        (or the latest of all)
+        """
+        snapshots = self.snapshots()
+        if snapshot_id is not None:
+            snapshots = [
+                snapshot for snapshot in snapshots if snapshot["id"] == snapshot_id
+            ]
+        if at is not None:
+            snapshots = [
+                snapshot
+                for snapshot in snapshots
+                if datetime.fromisoformat(snapshot["created"]) <= at
+            ]
+        if not snapshots:
+            raise SnapshotNotFound("No matching snapshot found")
+        return snapshots[-1]
+
+    def put_chunk(self, chunk: bytes) -> tuple[bytes, int]:
+        """Stores a chunk if it isn't already stored, returning its hash and how many
+        bytes were written
+        """
+        digest = hashlib.sha256(chunk).digest()
+        if digest in self.known_chunks:
+            return digest, 0
+        compressed = zlib.compress(chunk)
+        self.storage.write_bytes(f"chunk-{digest.hex()}", compressed)
+        self.known_chunks.add(digest)
+        return digest, len(compressed)
+
+    def get_chunk(self, digest: bytes) -> bytes:
+        try:
+            chunk = zlib.decompress(self.storage.read_bytes(f"chunk-{digest.hex()}"))
+        except zlib.error as error:
+            raise ValueError(f"Chunk {digest.hex()} is corrupted") from error
+        if hashlib.sha256(chunk).digest() != digest:
+            raise ValueError(f"Chunk {digest.hex()} is corrupted")
+        return chunk
+
+    @metrics.timed("backup.backup")
+    def backup(self, source: Storage, filenames: list[str] = DATABASE_FILES) -> dict:
+        """Takes a snapshot of the files in the source storage, returning it
+
+        - The snapshot includes "bytes_written", the number of bytes added to the store
+          by this backup
+        """
+        new_chunks = []
+        bytes_written = 0
+        files = {}
+
+        def put(chunk: bytes) -> bytes:
+            nonlocal bytes_written
+            digest, written = self.put_chunk(chunk)
+            if written:
+                new_chunks.append(digest)
+                bytes_written += written
+            return digest
+
+        for filename in filenames:
+            try:
+                contents = source.read_bytes(filename)
+            except FileNotFoundError:
+                continue
+            chunk_list = b"".join(put(chunk) for chunk in split_into_chunks(contents))
+            files[filename] = {
+                "size": len(contents),
+                "sha256": hashlib.sha256(contents).hexdigest(),
+                "chunk_list": put(chunk_list).hex(),
+            }
+
+        # The chunks are recorded before the snapshot, so a snapshot never refers to
+        # chunks that weren't saved
+        if new_chunks:
+            self.storage.append_bytes(CHUNK_INDEX_FILENAME, b"".join(new_chunks))
+        previous_snapshots = self.snapshots()
+        snapshot = {
+            "id": previous_snapshots[-1]["id"] + 1 if previous_snapshots else 1,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "files": files,
+            "bytes_written": bytes_written,
+        }
+        self.storage.append_bytes(
+            SNAPSHOTS_FILENAME, (json.dumps(snapshot) + "\n").encode("utf-8")
+        )
+        metrics.increment("backup.bytes_written", bytes_written)
+        return snapshot
+
+    def read_file(self, snapshot: dict, filename: str) -> bytes:
+        """Puts a file from a snapshot back together from its chunks, checking it
+        matches the original file
+        """
+        file_info = snapshot["files"][filename]
+        chunk_list = self.get_chunk(bytes.fromhex(file_info["chunk_list"]))
+        contents = b"".join(
+            self.get_chunk(chunk_list[offset : offset + DIGEST_SIZE])
+            for offset in range(0, len(chunk_list), DIGEST_SIZE)
+        )
+        if hashlib.sha256(contents).hexdigest() != file_info["sha256"]:
+            raise ValueError(
+                f"The backup of {filename} in snapshot {snapshot['id']} is corrupted"
+            )
+        return contents
+
+    @metrics.timed("backup.restore")
+    def restore(self, snapshot: dict, target: Storage) -> list[str]:
+        """Replaces the files in the target storage with the copies in a snapshot,
+        returning their names
+
+        - Every file is read and checked before any of them are replaced, so a corrupted
+          backup changes nothing
+        - The audit trail (APPEND_ONLY_FILES) is left as it is, since it's only ever
+          added to. Its backed up copies can still be read with read_file().
+        """
+        restored_files = {
+            filename: self.read_file(snapshot, filename)
+            for filename in snapshot["files"]
+            if filename not in APPEND_ONLY_FILES
+        }
+        for filename, contents in restored_files.items():
+            target.write_bytes(filename, contents)
+        return list(restored_files)
@@ -0,0 +1,263 @@
+"""Generates lots of reports at once, e.g. every report for every tutor group at the end
+of term
+
+- Each job is a dictionary with the name of a report and its parameters,
+  e.g. {"report": "surnames", "tutor_group": "9A", "prefix": "S"}
+- The jobs are shared out between worker processes, so every CPU core can be used
+- The students are written to a read-only snapshot file once (see the snapshot module).
+  Each worker memory-maps the same file when it starts, so the students are shared
+  between the workers rather than copied into each one.
+- Each report is written to its own file in the output directory
+"""
+from __future__ import annotations
+
+import json
+import locale
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import regex as re
+
+import reports
+from duplicates import DuplicateIndex
+from headless import strip_ansi
+from metrics import metrics
+from query import Query
+from snapshot import SNAPSHOT_FILENAME, SnapshotStudentsDatabase, write_snapshot
+from students import StudentsDatabase
+from util import FileStorage
+
+# Reports are generated by the batch runner, rather than by someone who has logged in
+BATCH_ACCOUNT = {"username": "batch"}
+
+# The report to run for each report name. They're given the database, the tutor group
+# (or None for the whole school) and the prefix, and return the students (or pairs of
+# students) to include in the report
+REPORTS: dict[str, Callable[[StudentsDatabase, Optional[str], str], list]] = {}
+# How each report's results are written as text
+REPORT_LINES: dict[str, Callable[[StudentsDatabase, list], Iterable[str]]] = {}
+
+
+def batch_report(name: str, lines: Callable[[StudentsDatabase, list], Iterable[str]]):
+    """Registers a report that can be used in batch jobs"""
+
+    def decorator(find_results: Callable[[StudentsDatabase, Optional[str], str], list]):
+        REPORTS[name] = find_results
+        REPORT_LINES[name] = lines
+        return find_results
+
+    return decorator
+
+
+def in_tutor_group(query: Query, tutor_group: Optional[str]) -> Query:
+    return query.where_tutor_group(tutor_group) if tutor_group else query
+
+
+@batch_report(
+    "birthdays",
+    lambda students_database, results: reports.upcoming_birthday_lines(
+        results, students_database.get_derived_fields
+    ),
+)
+def batch_upcoming_birthdays(students_database, tutor_group, _prefix):
+    return in_tutor_group(
+        reports.upcoming_birthdays_query(students_database, BATCH_ACCOUNT), tutor_group
+    ).run()
+
+
+@batch_report(
+    "surnames", lambda _students_database, results: reports.surname_lines(results)
+)
+def batch_surnames(students_database, tutor_group, prefix):
+    query = reports.surnames_starting_with_query(
+        students_database, prefix, BATCH_ACCOUNT
+    )
+    return in_tutor_group(query, tutor_group).run()
+
+
+@batch_report(
+    "forenames", lambda _students_database, results: reports.forename_lines(results)
+)
+def batch_forenames(students_database, tutor_group, prefix):
+    query = reports.forenames_starting_with_query(
+        students_database, prefix, BATCH_ACCOUNT
+    )
+    return in_tutor_group(query, tutor_group).run()
+
+
+@batch_report(
+    "duplicates", lambda _students_database, results: reports.duplicate_lines(results)
+)
+def batch_duplicates(students_database, tutor_group, _prefix):
+    students = in_tutor_group(
+        Query(students_database, BATCH_ACCOUNT), tutor_group
+    ).run()
+    return DuplicateIndex(students).find_all_duplicates()
+
+
+def validate_job(job: dict):
+    """Raises ValueError if a job can't be run, so mistakes are found before any workers
+    are started
+    """
+    if not isinstance(job, dict):
+        raise ValueError(f"Each job should be a JSON object, not {job!r}")
+    if job.get("report") not in REPORTS:
+        raise ValueError(
+            f"Unknown report {job.get('report')!r} (expected one of "
+            + f"{', '.join(REPORTS)})"
+        )
+    unknown_parameters = set(job) - {"report", "tutor_group", "prefix"}
+    if unknown_parameters:
+        raise ValueError(
+            f"Unknown parameters for the {job['report']} report: "
+            + f"{', '.join(sorted(unknown_parameters))}"
+        )
+    for parameter in ("tutor_group", "prefix"):
+        if parameter in job and not isinstance(job[parameter], str):
+            raise ValueError(
+                f"The {parameter} for the {job['report']} report should be a string, "
+                + f"not {job[parameter]!r}"
+            )
+
+
+def every_tutor_group_jobs(students_database: StudentsDatabase) -> list[dict]:
+    """Returns a job for every report, for every tutor group (with the name reports
+    listing the whole group)
+    """
+    with students_database.lock.read():
+        tutor_groups = sorted(students_database.students_by_tutor_group)
+    return [
+        {"report": report_name, "tutor_group": tutor_group}
+        for tutor_group in tutor_groups
+        for report_name in REPORTS
+    ]
+
+
+def safe_filename_part(text: str) -> str:
+    """Only keeps the characters that are safe in a filename, e.g. so a tutor group of
+    "../x" can't write outside the output directory
+    """
+    return re.sub(r"[^\p{L}\p{N}_\-]", "_", text)
+
+
+def output_filename(job: dict, output_format: str) -> str:
+    """Returns a filename for a job's report, e.g. "surnames-9A-S.txt" """
+    # Tutor groups and prefixes come from the jobs file, so they're made safe first
+    parts = [job["report"], safe_filename_part(job.get("tutor_group") or "all")]
+    if job.get("prefix"):
+        parts.append(safe_filename_part(job["prefix"]))
+    extension = "json" if output_format == "json" else "txt"
+    return f"{'-'.join(parts)}.{extension}"
+
+
+def write_report(
+    students_database: StudentsDatabase,
+    job: dict,
+    output_directory: Path,
+    output_format: str,
+) -> Path:
+    """Runs one job, writing the report to a file in the output directory, and returns
+    the file's path
+    """
+    report_name = job["report"]
+    results = REPORTS[report_name](
+        students_database, job.get("tutor_group"), job.get("prefix", "")
+    )
+
+    if output_format == "json":
+        if report_name == "duplicates":
+            results = [
+                {"students": [student, other_student], "matching": matching_details}
+                for student, other_student, matching_details in results
+            ]
+        contents = json.dumps(results)
+    else:
+        contents = "".join(
+            strip_ansi(line) + "\n"
+            for line in REPORT_LINES[report_name](students_database, results)
+        )
+
+    output_path = Path(output_directory, output_filename(job, output_format))
+    output_path.write_text(contents, encoding="utf-8")
+    return output_path
+
+
+# Each worker process reads the students from the snapshot, which is opened by
+# start_worker()
+_worker_students_database: Optional[StudentsDatabase] = None
+
+
+def start_worker(snapshot_directory: Path, time_locale: str):
+    global _worker_students_database
+    # Dates should be formatted the same way as in the main process
+    locale.setlocale(locale.LC_TIME, time_locale)
+    # Every job is run with BATCH_ACCOUNT, so the workers don't need an App
+    _worker_students_database = SnapshotStudentsDatabase.open(
+        FileStorage(snapshot_directory), SNAPSHOT_FILENAME
+    )
+
+
+def write_report_in_worker(
+    job: dict, output_directory: Path, output_format: str
+) -> Path:
+    return write_report(_worker_students_database, job, output_directory, output_format)
+
+
+def run_batch(
+    students_database: StudentsDatabase,
+    jobs: list[dict],
+    output_directory: Path,
+    workers: Optional[int] = None,
+    output_format: str = "text",
+) -> list[Path]:
+    """Runs every job, returning the paths of the files that were written (in the same
+    order as the jobs)
+
+    - By default, there's one worker process for each CPU core. With workers=1, the jobs
+      are run in this process.
+    """
+    jobs_by_filename: dict[str, dict] = {}
+    for job in jobs:
+        validate_job(job)
+        # Otherwise the later report would silently replace the earlier one
+        filename = output_filename(job, output_format)
+        if filename in jobs_by_filename:
+            raise ValueError(
+                f"The jobs {jobs_by_filename[filename]!r} and {job!r} would both be "
+                + f"written to {filename}"
+            )
+        jobs_by_filename[filename] = job
+    output_directory.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    with metrics.timer("batch.run_batch"):
+        if workers == 1:
+            return [
+                write_report(students_database, job, output_directory, output_format)
+                for job in jobs
+            ]
+
+        with tempfile.TemporaryDirectory(
+            prefix="batch-snapshot-"
+        ) as snapshot_directory:
+            write_snapshot(students_database, FileStorage(Path(snapshot_directory)))
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=start_worker,
+                initargs=(Path(snapshot_directory), locale.setlocale(locale.LC_TIME)),
+            ) as executor:
+                # Jobs are sent in chunks, since most of them only take a few
+                # milliseconds
+                chunk_size = max(1, len(jobs) // (workers * 4))
+                return list(
+                    executor.map(
+                        write_report_in_worker,
+                        jobs,
+                        [output_directory] * len(jobs),
+                        [output_format] * len(jobs),
+                        chunksize=chunk_size,
+                    )
+                )
@@ -0,0 +1,206 @@
+"""A load-test client for the HTTP/JSON API, which reports requests per second and
+latency percentiles
+
+Run it from the root of the repository. By default, it starts its own server (with an
+in-memory roster):
+    python -m bench.api_load --clients 50 --requests 200
+Or point it at a server that's already running, using an existing account:
+    python -m bench.api_load --url http://127.0.0.1:8080 --username admin --password ...
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+from bench.roster import generate_roster
+from bench.run import app_with_roster
+
+
+class Connection:
+    """A kept-alive HTTP/1.1 connection to the API server"""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> Connection:
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, host)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[dict] = None,
+        token: Optional[str] = None,
+    ) -> tuple[int, dict]:
+        encoded_body = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            + f"Content-Length: {len(encoded_body)}\r\n"
+        )
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + encoded_body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        status = int(status_line.split()[1])
+        content_length = 0
+        while True:
+            header_line = await self.reader.readline()
+            if header_line in (b"\r\n", b""):
+                break
+            name, _, value = header_line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value)
+        response_body = await self.reader.readexactly(content_length)
+        return status, json.loads(response_body)
+
+    def close(self):
+        self.writer.close()
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_client(
+    host: str,
+    port: int,
+    token: str,
+    requests: int,
+    max_id: int,
+    seed: int,
+    latencies: list[float],
+):
+    """Sends a mix of lookups and reports from one client, recording the latency of each
+    request
+    """
+    rng = random.Random(seed)
+    connection = await Connection.open(host, port)
+    try:
+        for _ in range(requests):
+            roll = rng.random()
+            if roll < 0.8:
+                path = f"/students/{rng.randint(1, max_id)}"
+            elif roll < 0.95:
+                path = f"/reports/surnames?prefix={rng.choice('ABCDEFGHJKLMNOPRSTW')}"
+            else:
+                path = "/reports/upcoming-birthdays"
+
+            started_at = time.perf_counter()
+            status, _body = await connection.request("GET", path, token=token)
+            latencies.append(time.perf_counter() - started_at)
+            if status != 200:
+                raise RuntimeError(f"GET {path} returned HTTP {status}")
+    finally:
+        connection.close()
+
+
+async def load_test(
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    clients: int,
+    requests: int,
+    max_id: int,
+) -> dict:
+    login_connection = await Connection.open(host, port)
+    status, body = await login_connection.request(
+        "POST", "/login", {"username": username, "password": password}
+    )
+    login_connection.close()
+    if status != 200:
+        raise RuntimeError(f"Couldn't log in: {body}")
+
+    latencies: list[float] = []
+    started_at = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_client(host, port, body["token"], requests, max_id, seed, latencies)
+            for seed in range(clients)
+        )
+    )
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+async def self_hosted_load_test(roster_size: int, clients: int, requests: int) -> dict:
+    """Starts a server with a generated roster on a free port, then load-tests it"""
+    # Imported here so that the server code is only needed when self-hosting
+    from api_server import ApiServer
+    from inputs import password_to_hash
+
+    app = app_with_roster(generate_roster(roster_size))
+    app.accounts_database.add_account("loadtest", password_to_hash("loadtest"))
+    server = await ApiServer(app).start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await load_test(
+            "127.0.0.1", port, "loadtest", "loadtest", clients, requests, roster_size
+        )
+
+
+def main(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url",
+        help="The server to test. If not provided, a server is started in-process",
+    )
+    parser.add_argument("--username", default="loadtest")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--roster-size", type=int, default=10_000)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per client")
+    options = parser.parse_args(arguments)
+
+    if options.url:
+        split_url = urlsplit(options.url)
+        results = asyncio.run(
+            load_test(
+                split_url.hostname or "127.0.0.1",
+                split_url.port or 80,
+                options.username,
+                options.password,
+                options.clients,
+                options.requests,
+                options.roster_size,
+            )
+        )
+    else:
+        results = asyncio.run(
+            self_hosted_load_test(
+                options.roster_size, options.clients, options.requests
+            )
+        )
+
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Measures how long an incremental backup takes, and how much it writes, after a small
+change to the students
+
+Run it from the root of the repository, e.g.
+    python -m bench.backup_incremental --roster-size 100000 --changed 0.01
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Optional
+
+from backup import BackupStore
+from bench.roster import generate_roster
+from util import MemoryStorage
+
+
+def measure_backup(roster_size: int, changed_fraction: float, seed: int = 0) -> dict:
+    roster = generate_roster(roster_size, seed)
+    source = MemoryStorage()
+    source.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    backup_store = BackupStore(MemoryStorage())
+
+    started_at = time.perf_counter()
+    first_snapshot = backup_store.backup(source)
+    first_backup_seconds = time.perf_counter() - started_at
+
+    # Change the address of some students, spread throughout the file
+    rng = random.Random(seed)
+    for student in rng.sample(roster, round(roster_size * changed_fraction)):
+        student["home_address"] = f"{rng.randint(1, 200)} Changed Street"
+    source.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+
+    started_at = time.perf_counter()
+    second_snapshot = backup_store.backup(source)
+    incremental_backup_seconds = time.perf_counter() - started_at
+
+    file_size = second_snapshot["files"]["students.json"]["size"]
+    results = {
+        "roster_size": roster_size,
+        "changed_students": round(roster_size * changed_fraction),
+        "file_size": file_size,
+        "first_backup": {
+            "seconds": first_backup_seconds,
+            "bytes_written": first_snapshot["bytes_written"],
+        },
+        "incremental_backup": {
+            "seconds": incremental_backup_seconds,
+            "bytes_written": second_snapshot["bytes_written"],
+            "fraction_of_file": second_snapshot["bytes_written"] / file_size,
+        },
+    }
+    print(
+        f"Full file {file_size / 1e6:.1f} MB; incremental backup wrote "
+        + f"{second_snapshot['bytes_written'] / 1e6:.2f} MB in "
+        + f"{incremental_backup_seconds * 1000:.0f} ms",
+        file=sys.stderr,
+    )
+    return results
+
+
+def main(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--roster-size", type=int, default=100_000)
+    parser.add_argument(
+        "--changed", type=float, default=0.01, help="The fraction of students to change"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(arguments)
+
+    print(
+        json.dumps(
+            measure_backup(options.roster_size, options.changed, options.seed), indent=2
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Measures how much faster batch report generation gets with more worker processes
+
+Run it from the root of the repository, e.g.
+    python -m bench.batch_scaling --roster-size 10000 --workers 1 2 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import batch
+from bench.roster import generate_roster
+from bench.run import app_with_roster
+
+
+def measure_scaling(
+    roster_size: int, worker_counts: list[int], repeats: int = 3, seed: int = 0
+) -> dict:
+    """Runs every report for every tutor group with each number of workers, returning
+    the best times in seconds
+
+    - 1 worker (every job run in this process) is always measured, since the speedups
+      are compared with it
+    """
+    if 1 not in worker_counts:
+        worker_counts = [1, *worker_counts]
+    students_database = app_with_roster(
+        generate_roster(roster_size, seed)
+    ).students_database
+    jobs = batch.every_tutor_group_jobs(students_database)
+
+    results = []
+    for workers in worker_counts:
+        timings = []
+        for _ in range(repeats):
+            output_directory = Path(tempfile.mkdtemp(prefix="pms-batch-"))
+            try:
+                started_at = time.perf_counter()
+                batch.run_batch(
+                    students_database, jobs, output_directory, workers=workers
+                )
+                timings.append(time.perf_counter() - started_at)
+            finally:
+                shutil.rmtree(output_directory)
+        results.append({"workers": workers, "seconds": min(timings)})
+
+    # Speedup is compared with running every job in this process
+    baseline = next(result["seconds"] for result in results if result["workers"] == 1)
+    for result in results:
+        result["speedup"] = baseline / result["seconds"]
+        print(
+            f"{result['workers']:3} workers {result['seconds'] * 1000:10.1f} ms "
+            + f"{result['speedup']:6.2f}x",
+            file=sys.stderr,
+        )
+
+    return {
+        "roster_size": roster_size,
+        "jobs": len(jobs),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--roster-size", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(arguments)
+
+    results = measure_scaling(
+        options.roster_size, options.workers, options.repeats, options.seed
+    )
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
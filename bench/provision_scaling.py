@@ -0,0 +1,84 @@
+"""Measures how many accounts can be provisioned per second with different numbers of
+password-hashing threads
+
+Run it from the root of the repository, e.g.
+    python -m bench.provision_scaling --accounts 32 --workers 1 2 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+from app import App
+from provisioning import provision_accounts
+from util import MemoryStorage
+
+
+def measure_scaling(
+    account_count: int, worker_counts: list[int], repeats: int = 1
+) -> dict:
+    """Provisions the accounts with each number of workers, returning the best rates in
+    accounts per second
+    """
+    # Half of the accounts have their own password, and the other half are given a
+    # generated one
+    rows = [
+        {
+            "line": number + 2,
+            "username": f"staff.{number}",
+            "password": "hunter2" if number % 2 else "",
+        }
+        for number in range(account_count)
+    ]
+
+    results = []
+    for workers in worker_counts:
+        timings = []
+        for _ in range(repeats):
+            accounts_database = App(storage=MemoryStorage()).accounts_database
+            started_at = time.perf_counter()
+            provision_accounts(rows, accounts_database, workers=workers)
+            timings.append(time.perf_counter() - started_at)
+        results.append(
+            {
+                "workers": workers,
+                "seconds": min(timings),
+                "accounts_per_second": account_count / min(timings),
+            }
+        )
+
+    # Speedup is compared with hashing every password in this thread
+    baseline = results[0]["seconds"]
+    for result in results:
+        result["speedup"] = baseline / result["seconds"]
+        print(
+            f"{result['workers']:3} workers {result['accounts_per_second']:8.1f} "
+            + f"accounts/s {result['speedup']:6.2f}x",
+            file=sys.stderr,
+        )
+
+    return {
+        "accounts": account_count,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def main(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=1)
+    options = parser.parse_args(arguments)
+
+    results = measure_scaling(options.accounts, options.workers, options.repeats)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
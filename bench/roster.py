@@ -0,0 +1,261 @@
+"""Generates realistic, repeatable rosters of students for benchmarks and load tests"""
+
+import random
+from datetime import date, timedelta
+from typing import Optional
+
+FORENAMES = [
+    "John",
+    "Jon",
+    "Emma",
+    "Olivia",
+    "Amelia",
+    "Isla",
+    "Ava",
+    "Mia",
+    "Ivy",
+    "Lily",
+    "Oliver",
+    "George",
+    "Noah",
+    "Arthur",
+    "Leo",
+    "Harry",
+    "Oscar",
+    "Archie",
+    "Henry",
+    "Freddie",
+    "Muhammad",
+    "Sophia",
+    "Grace",
+    "Freya",
+    "Aisha",
+    "Zara",
+    "Yusuf",
+    "Ethan",
+    "Chloe",
+    "Jack",
+    "Thomas",
+    "Charlie",
+    "Evie",
+    "Poppy",
+    "Ruby",
+    "Alfie",
+    "Theo",
+    "Jacob",
+    "Daisy",
+    "Ella",
+    "Siân",
+    "Zoë",
+    "Chloé",
+    "Łukasz",
+    "Oisín",
+    "Niamh",
+]
+SURNAMES = [
+    "Smith",
+    "Jones",
+    "Williams",
+    "Taylor",
+    "Brown",
+    "Davies",
+    "Evans",
+    "Wilson",
+    "Thomas",
+    "Johnson",
+    "Roberts",
+    "Robinson",
+    "Thompson",
+    "Wright",
+    "Walker",
+    "White",
+    "Edwards",
+    "Hughes",
+    "Green",
+    "Hall",
+    "Lewis",
+    "Harris",
+    "Clarke",
+    "Patel",
+    "Jackson",
+    "Wood",
+    "Turner",
+    "Martin",
+    "Cooper",
+    "Hill",
+    "Ward",
+    "Morris",
+    "Moore",
+    "Clark",
+    "Lee",
+    "King",
+    "Baker",
+    "Harrison",
+    "Morgan",
+    "Allen",
+    "James",
+    "Scott",
+    "Phillips",
+    "Watson",
+    "Davis",
+    "Parker",
+    "Price",
+    "Bennett",
+    "Young",
+    "Griffiths",
+    "Mitchell",
+    "Kelly",
+    "Cook",
+    "Carter",
+    "Richardson",
+    "Bailey",
+    "Collins",
+    "Bell",
+    "Shaw",
+    "Murphy",
+    "Miller",
+    "Cox",
+    "Richards",
+    "Khan",
+    "Marshall",
+    "Anderson",
+    "Simpson",
+    "Ellis",
+    "Adams",
+    "Singh",
+    "Begum",
+    "Wilkinson",
+    "Foster",
+    "Chapman",
+    "Powell",
+    "Webb",
+    "Rogers",
+    "Gray",
+    "Mason",
+    "Ali",
+    "Hunt",
+    "Hussain",
+    "Campbell",
+    "Matthews",
+    "Owen",
+    "Palmer",
+    "Holmes",
+    "Mills",
+    "Barnes",
+    "Knight",
+    "Lloyd",
+    "Butler",
+    "Russell",
+    "Barker",
+    "Fisher",
+    "Stevens",
+    "Jenkins",
+    "Murray",
+    "Dixon",
+    "Harvey",
+    "O'Brien",
+    "Hyde-Smith",
+    "Nowak",
+    "Ó Súilleabháin",
+]
+STREETS = [
+    "High Street",
+    "Station Road",
+    "Main Street",
+    "Park Road",
+    "Church Road",
+    "Church Street",
+    "London Road",
+    "Victoria Road",
+    "Green Lane",
+    "Manor Road",
+    "Tree Road",
+    "Mill Lane",
+    "Kings Road",
+    "The Crescent",
+    "Queens Road",
+]
+TOWNS = [
+    ("Bristol", "BS"),
+    ("Edinburgh", "EH"),
+    ("Leeds", "LS"),
+    ("Manchester", "M"),
+    ("Cardiff", "CF"),
+    ("Norwich", "NR"),
+    ("Lichfield", "WS"),
+    ("York", "YO"),
+]
+TUTOR_GROUP_LETTERS = ["A", "B", "C", "D", "E", "F", "G", "H"]
+
+
+def random_birthday(rng: random.Random, today: date) -> date:
+    """Picks a birthday for a secondary school pupil, i.e. someone aged 11 to 18"""
+    oldest = today.replace(year=today.year - 18)
+    age_range_days = (today.replace(year=today.year - 11) - oldest).days
+    return oldest + timedelta(days=rng.randrange(age_range_days))
+
+
+def tutor_group_for(birthday: date, rng: random.Random, today: date) -> str:
+    """Picks a tutor group that matches the year group of a pupil with the provided
+    birthday
+    """
+    # Years start in September, so pupils born after August are in the year below
+    academic_year = today.year if today.month >= 9 else today.year - 1
+    age_at_start_of_year = (
+        academic_year - birthday.year - (1 if birthday.month >= 9 else 0)
+    )
+    year_group = min(max(age_at_start_of_year - 4, 7), 13)
+    return f"{year_group}{rng.choice(TUTOR_GROUP_LETTERS)}"
+
+
+def generate_roster(
+    size: int, seed: int = 0, today: Optional[date] = None
+) -> list[dict]:
+    """Generates a list of students, in the same format as students-bootstrap.json
+
+    - The same seed and size will always produce the same roster
+    - IDs are sequential starting from 1, and school email addresses are unique,
+      following the same rules as StudentsDatabase.generate_email_address
+    """
+    rng = random.Random(seed)
+    today = today or date(2026, 9, 1)
+
+    used_email_addresses: dict[str, int] = {}
+    students = []
+    for id in range(1, size + 1):
+        forename = rng.choice(FORENAMES)
+        surname = rng.choice(SURNAMES)
+        birthday = random_birthday(rng, today)
+        town, postcode_area = rng.choice(TOWNS)
+
+        # Work out the next free discriminator for this email address
+        email_prefix = f"{surname.lower()}{forename.lower()[0]}"
+        discriminator = used_email_addresses.get(email_prefix, 0)
+        used_email_addresses[email_prefix] = discriminator + 1
+        discriminator_part = str(discriminator) if discriminator else ""
+
+        students.append(
+            {
+                "surname": surname,
+                "forename": forename,
+                "birthday": birthday.isoformat(),
+                "tutor_group": tutor_group_for(birthday, rng, today),
+                "home_address": "\n".join(
+                    [
+                        f"{rng.randint(1, 250)} {rng.choice(STREETS)},",
+                        f"{town},",
+                        f"{postcode_area}{rng.randint(1, 30)} {rng.randint(1, 9)}"
+                        + "".join(rng.choices("ABDEFGHJLNPQRSTUWXYZ", k=2))
+                        + ",",
+                        "United Kingdom",
+                    ]
+                ),
+                "home_phone": "+44 "
+                + f"{rng.randint(1000, 9999)} {rng.randint(100000, 999999)}",
+                "id": id,
+                "school_email": f"{email_prefix}{discriminator_part}@tree-road.edu",
+                "full_name": f"{forename} {surname}",
+            }
+        )
+
+    return students
@@ -0,0 +1,450 @@
+"""A standalone benchmark runner for the pupil management system
+
+Run it from the root of the repository, e.g.
+    python -m bench.run --sizes 1000 10000 --output bench/results/latest.json
+    python -m bench.run --compare bench/results/before.json bench/results/after.json
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import io
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+import analytics
+import audit
+import inputs
+import integrity
+import reports
+from app import App
+from audit import AuditLog
+from background import run_now
+from bench.roster import generate_roster
+from metadata import MetadataDatabase
+from query import Query
+from snapshot import SnapshotStudentsDatabase, write_snapshot
+from util import FileStorage, JSONDatabase, MemoryStorage, check_password
+
+# Each benchmark is a setup function, which is given a roster of students and returns
+# a function that performs the operation being timed
+Benchmark = Callable[[list[dict]], Callable[[], object]]
+BENCHMARKS: dict[str, tuple[Benchmark, bool]] = {}
+
+DEFAULT_SIZES = [1_000, 10_000]
+DEFAULT_RESULTS_DIRECTORY = Path("bench", "results")
+
+
+def benchmark(name: str, depends_on_size=True):
+    """Registers a benchmark setup function under the provided name
+
+    - If depends_on_size is False, the benchmark only runs once (with the smallest
+      roster)
+    """
+
+    def decorator(setup: Benchmark):
+        BENCHMARKS[name] = (setup, depends_on_size)
+        return setup
+
+    return decorator
+
+
+def app_with_roster(roster: list[dict]) -> App:
+    """Creates an in-memory App containing the provided students, signed in as a
+    benchmark user
+    """
+    storage = MemoryStorage()
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    storage.write_bytes(
+        "settings.json", json.dumps({"tui": {"onboarding": {"show": False}}}).encode()
+    )
+    app = App(storage=storage)
+    app.current_account = {"username": "benchmark"}
+    return app
+
+
+@contextmanager
+def answering(*answers: str):
+    """Makes prompts from the inputs module receive the provided answers (in a cycle)
+    instead of reading stdin
+    """
+    original_question = inputs.question
+    state = {"index": 0}
+
+    def fake_question(_prompt):
+        answer = answers[state["index"] % len(answers)]
+        state["index"] += 1
+        return answer
+
+    inputs.question = fake_question
+    try:
+        yield
+    finally:
+        inputs.question = original_question
+
+
+def silently(function: Callable[[], object]) -> Callable[[], object]:
+    """Wraps a function so that anything it prints is discarded"""
+
+    def wrapper():
+        with redirect_stdout(io.StringIO()):
+            return function()
+
+    return wrapper
+
+
+def scratch_directory() -> Path:
+    """Creates a temporary directory that is deleted when the benchmarks finish"""
+    directory = tempfile.mkdtemp(prefix="pms-bench-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return Path(directory)
+
+
+@benchmark("json_database.load")
+def bench_load(roster):
+    storage = FileStorage(scratch_directory())
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    database = JSONDatabase("students.json", [], storage=storage)
+    return database.load
+
+
+@benchmark("json_database.save")
+def bench_save(roster):
+    database = JSONDatabase(
+        "students.json", roster, storage=FileStorage(scratch_directory())
+    )
+    return database.save
+
+
+@benchmark("students.get_student")
+def bench_get_student(roster):
+    students_database = app_with_roster(roster).students_database
+    # Look up the last student, as it's the worst case for a scan
+    last_id = roster[-1]["id"]
+    return lambda: students_database.get_student(id=last_id)
+
+
+@benchmark("students.generate_email_address")
+def bench_generate_email_address(roster):
+    students_database = app_with_roster(roster).students_database
+    # Common names need the most discriminators to be tried
+    return lambda: students_database.generate_email_address("Smith", "John")
+
+
+@benchmark("students.add_student")
+def bench_add_student(roster):
+    students_database = app_with_roster(roster).students_database
+    return lambda: students_database.add_student(
+        "Smith", "John", date(2012, 1, 1), "1 Tree Road", "+44 1234 567890", "9A"
+    )
+
+
+@benchmark("students.find_possible_duplicates")
+def bench_find_possible_duplicates(roster):
+    students_database = app_with_roster(roster).students_database
+    # Check someone who shares a birthday and surname with an existing student, as
+    # happens when registering a duplicate
+    student = roster[-1]
+    birthday = date.fromisoformat(student["birthday"])
+    return lambda: students_database.find_possible_duplicates(
+        student["surname"], student["forename"], birthday, student["home_phone"]
+    )
+
+
+@benchmark("reports.likely_duplicates")
+def bench_likely_duplicates(roster):
+    students_database = app_with_roster(roster).students_database
+    return silently(lambda: run_now(reports.likely_duplicates(students_database)))
+
+
+if analytics.numpy_available():
+    # NumPy is optional, so these only run if it's installed
+
+    @benchmark("analytics.build_columns")
+    def bench_build_columns(roster):
+        students_database = app_with_roster(roster).students_database
+        return lambda: analytics.CohortColumns(students_database.data)
+
+    @benchmark("analytics.age_distribution_by_tutor_group")
+    def bench_age_distribution(roster):
+        cohort_analytics = analytics.CohortAnalytics(
+            app_with_roster(roster).students_database
+        )
+        # Build the columns before timing, since they're cached until the students
+        # change
+        cohort_analytics.columns()
+        return cohort_analytics.age_distribution_by_tutor_group
+
+
+@benchmark("reports.upcoming_birthdays")
+def bench_upcoming_birthdays(roster):
+    students_database = app_with_roster(roster).students_database
+    return silently(lambda: run_now(reports.upcoming_birthdays(students_database)))
+
+
+@benchmark("reports.surnames_starting_with")
+def bench_surnames_starting_with(roster):
+    students_database = app_with_roster(roster).students_database
+
+    def run():
+        with answering("S"):
+            run_now(reports.surnames_starting_with(students_database))
+
+    return silently(run)
+
+
+@benchmark("reports.forenames_starting_with")
+def bench_forenames_starting_with(roster):
+    students_database = app_with_roster(roster).students_database
+
+    def run():
+        with answering("J"):
+            run_now(reports.forenames_starting_with(students_database))
+
+    return silently(run)
+
+
+@benchmark("query.tutor_group_by_surname")
+def bench_query_tutor_group_by_surname(roster):
+    students_database = app_with_roster(roster).students_database
+    tutor_group = roster[0]["tutor_group"]
+    return lambda: (
+        Query(students_database)
+        .where_tutor_group(tutor_group)
+        .where_surname_starts_with("S")
+        .order_by("surname")
+        .run()
+    )
+
+
+@benchmark("snapshot.open")
+def bench_snapshot_open(roster):
+    # Compare with json_database.load, which is what each process does without a
+    # snapshot
+    storage = FileStorage(scratch_directory())
+    write_snapshot(app_with_roster(roster).students_database, storage)
+    return lambda: SnapshotStudentsDatabase.open(storage).snapshot_file.close()
+
+
+@benchmark("snapshot.tutor_group_by_surname")
+def bench_snapshot_tutor_group_by_surname(roster):
+    storage = FileStorage(scratch_directory())
+    write_snapshot(app_with_roster(roster).students_database, storage)
+    students_database = SnapshotStudentsDatabase.open(storage)
+    tutor_group = roster[0]["tutor_group"]
+    return lambda: (
+        Query(students_database, {"username": "benchmark"})
+        .where_tutor_group(tutor_group)
+        .where_surname_starts_with("S")
+        .order_by("surname")
+        .run()
+    )
+
+
+@benchmark("integrity.verify")
+def bench_integrity_verify(roster):
+    storage = FileStorage(scratch_directory())
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    return lambda: integrity.verify(storage, full=True)
+
+
+@benchmark("integrity.verify_unchanged")
+def bench_integrity_verify_unchanged(roster):
+    # What starting up with --verify-on-load costs when nothing has changed since the
+    # last check
+    storage = FileStorage(scratch_directory())
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    metadata_database = MetadataDatabase(storage=storage)
+    integrity.verify(storage, metadata_database)
+    return lambda: integrity.verify(storage, metadata_database)
+
+
+@benchmark("audit.record", depends_on_size=False)
+def bench_audit_record(_roster):
+    audit_log = AuditLog(MemoryStorage(), commit_interval=60)
+    account = {"username": "benchmark"}
+    return lambda: audit_log.record("view", 42, account)
+
+
+@benchmark("audit.events_for_student")
+def bench_audit_events_for_student(roster):
+    # 100 events for each student, e.g. a year of viewing their details
+    storage = MemoryStorage()
+    storage.write_bytes(
+        "audit.log",
+        audit.HEADER
+        + b"".join(
+            audit.RECORD.pack(1_700_000_000_000 + position, student["id"], 1, 0)
+            for position in range(100)
+            for student in roster
+        ),
+    )
+    audit_log = AuditLog(storage)
+    audit_log.account_number({"username": "benchmark"})
+    # Build the index before timing, since it's only built once
+    audit_log.events_for_student(1)
+    return lambda: audit_log.events_for_student(roster[len(roster) // 2]["id"])
+
+
+@benchmark("inputs.validators", depends_on_size=False)
+def bench_validators(_roster):
+    def run():
+        with answering("Łukasz O'Brien-Smith"):
+            inputs.name("")
+        with answering("2010-02-19"):
+            inputs.date("")
+        with answering("13AX"):
+            inputs.tutor_group("")
+        with answering("+44 1543 424203"):
+            inputs.phone_number("")
+        with answering("some.user-name"):
+            inputs.new_username("")
+
+    return silently(run)
+
+
+@benchmark("util.check_password", depends_on_size=False)
+def bench_check_password(_roster):
+    password_hash = inputs.password_to_hash("correct horse battery staple")
+    return lambda: check_password("correct horse battery staple", password_hash)
+
+
+def time_function(
+    function: Callable[[], object], repeats: int, min_time: float
+) -> dict:
+    """Times the provided function, returning statistics in seconds
+
+    - The function is called at least `repeats` times, and until at least `min_time`
+      seconds have passed
+    """
+    timings = []
+    started_at = time.perf_counter()
+    while len(timings) < repeats or time.perf_counter() - started_at < min_time:
+        call_started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - call_started_at)
+        # Don't let quick benchmarks run forever
+        if len(timings) >= 10_000:
+            break
+
+    return {
+        "calls": len(timings),
+        "mean": statistics.fmean(timings),
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "max": max(timings),
+    }
+
+
+def run_benchmarks(
+    sizes: list[int],
+    seed: int = 0,
+    repeats: int = 3,
+    min_time: float = 0.2,
+    only: Optional[list[str]] = None,
+) -> dict:
+    """Runs the registered benchmarks against rosters of each size, returning the
+    results
+    """
+    results = []
+    for size in sorted(sizes):
+        roster = generate_roster(size, seed)
+        for name, (setup, depends_on_size) in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            if not depends_on_size and size != min(sizes):
+                continue
+
+            timing = time_function(setup(roster), repeats, min_time)
+            result = {
+                "benchmark": name,
+                "size": size if depends_on_size else None,
+                **timing,
+            }
+            results.append(result)
+            print(
+                f"{name:40} {str(result['size']):>9} {timing['median'] * 1000:12.3f} ms"
+            )
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list[str]:
+    """Compares two sets of results, returning the names of benchmarks that regressed
+
+    - A regression is a median time that is more than `threshold` (as a fraction) slower
+      than the baseline
+    """
+    baseline_timings = {
+        (result["benchmark"], result["size"]): result["median"]
+        for result in baseline["results"]
+    }
+
+    regressions = []
+    for result in current["results"]:
+        key = (result["benchmark"], result["size"])
+        if key not in baseline_timings:
+            continue
+        ratio = result["median"] / baseline_timings[key]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{key[0]:40} {str(key[1]):>9} {ratio:8.2f}x {flag}")
+        if flag:
+            regressions.append(f"{key[0]}[{key[1]}]")
+
+    return regressions
+
+
+def main(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument(
+        "--only", nargs="+", help="Only run the benchmarks with these names"
+    )
+    parser.add_argument("--output", type=Path, help="Where to save the results as JSON")
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="Compare two saved results files instead of running the benchmarks",
+    )
+    options = parser.parse_args(arguments)
+
+    if options.compare:
+        baseline, current = (json.loads(path.read_text()) for path in options.compare)
+        regressions = compare_results(baseline, current)
+        return 1 if regressions else 0
+
+    results = run_benchmarks(
+        options.sizes, options.seed, options.repeats, options.min_time, options.only
+    )
+
+    output_path = options.output or Path(
+        DEFAULT_RESULTS_DIRECTORY, f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(results, indent=2))
+    print(f"Saved results to {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
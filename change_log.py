@@ -0,0 +1,164 @@
+"""A sequence-numbered log of the changes made to a database, so other systems can sync
+just the changes
+
+- Each change is stored as one line of JSON (JSON Lines), so recording a change only
+  appends to the file
+- Changes are numbered from 1 with no gaps, so a consumer only needs to remember the
+  last number it has seen
+- Old changes can be compacted (removed) once they're older than a retention window. A
+  consumer that has fallen further behind than that has to re-download everything and
+  start again.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from util import Storage
+
+
+class ChangesCompacted(LookupError):
+    """Raised when the changes that were asked for have been removed from the log by
+    compaction
+    """
+
+    def __init__(self, requested_seq: int, compacted_through: int):
+        super().__init__(
+            f"Changes up to #{compacted_through} have been compacted, so can't list "
+            + f"changes since #{requested_seq}"
+        )
+        self.requested_seq = requested_seq
+        self.compacted_through = compacted_through
+
+
+class ChangeLog:
+    def __init__(self, filename: str, storage: Storage):
+        self.filename = filename
+        self.storage = storage
+        self.lock = threading.Lock()
+
+        self.entries: list[dict] = []
+        # Every change up to and including this sequence number has been removed from
+        # the log
+        self.compacted_through = 0
+        self.load()
+
+    def load(self):
+        """Reads the log from storage
+
+        - The first line may be a header (rather than a change) that records how much
+          has been compacted
+        """
+        try:
+            contents = self.storage.read_bytes(self.filename)
+        except FileNotFoundError:
+            contents = b""
+
+        entries = []
+        compacted_through = 0
+        for line in contents.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "compacted_through" in entry:
+                compacted_through = entry["compacted_through"]
+            else:
+                entries.append(entry)
+
+        with self.lock:
+            self.entries = entries
+            self.compacted_through = compacted_through
+
+    def last_seq(self) -> int:
+        """Returns the sequence number of the latest change (or 0 if nothing has changed
+        yet)
+        """
+        return self.compacted_through + len(self.entries)
+
+    def record(
+        self, operation: str, record_id: int, record: Optional[dict] = None
+    ) -> dict:
+        """Adds a change to the end of the log, returning it
+
+        - operation= describes the change, e.g. "insert" or "update"
+        - record= is the new version of the record (if there is one), which is copied
+        """
+        with self.lock:
+            entry = {
+                "seq": self.last_seq() + 1,
+                "op": operation,
+                "id": record_id,
+                "timestamp": time.time(),
+                "record": dict(record) if record is not None else None,
+            }
+            self.storage.append_bytes(
+                self.filename, (json.dumps(entry) + "\n").encode("utf-8")
+            )
+            self.entries.append(entry)
+        return entry
+
+    def changes_since(self, seq: int) -> list[dict]:
+        """Returns the changes made after the provided sequence number, oldest first
+
+        - Use 0 to get every change
+        - Raises ChangesCompacted if some of the changes have already been compacted
+        """
+        with self.lock:
+            if seq < self.compacted_through:
+                raise ChangesCompacted(seq, self.compacted_through)
+            # Sequence numbers have no gaps, so the position of a change can be worked
+            # out directly
+            return self.entries[seq - self.compacted_through :]
+
+    def compact(self, retention: timedelta, now: Optional[float] = None) -> int:
+        """Removes changes that are older than the retention window, returning how many
+        were removed
+        """
+        cutoff = (now if now is not None else time.time()) - retention.total_seconds()
+
+        with self.lock:
+            removed_count = 0
+            while (
+                removed_count < len(self.entries)
+                and self.entries[removed_count]["timestamp"] < cutoff
+            ):
+                removed_count += 1
+            if not removed_count:
+                return 0
+
+            self.compacted_through += removed_count
+            self.entries = self.entries[removed_count:]
+            self.rewrite()
+
+        return removed_count
+
+    def redact(self, record_id: int) -> int:
+        """Removes the copies of a record from its earlier changes (e.g. when it's
+        purged), returning how many
+
+        - The changes themselves are kept, so sequence numbers don't change
+        """
+        with self.lock:
+            redacted_count = 0
+            for position, entry in enumerate(self.entries):
+                if entry["id"] == record_id and entry["record"] is not None:
+                    # Replaced rather than changed, since lists from changes_since()
+                    # share the entries
+                    self.entries[position] = {**entry, "record": None}
+                    redacted_count += 1
+            if redacted_count:
+                self.rewrite()
+
+        return redacted_count
+
+    def rewrite(self):
+        """Saves the whole log, replacing the file (the lock must be held)"""
+        lines = [json.dumps({"compacted_through": self.compacted_through})]
+        lines.extend(json.dumps(entry) for entry in self.entries)
+        self.storage.write_bytes(
+            self.filename, ("\n".join(lines) + "\n").encode("utf-8")
+        )
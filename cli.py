@@ -0,0 +1,555 @@
+"""Non-interactive commands, so reports and lookups can be run by scripts and scheduled
+jobs (e.g. cron)
+
+- They never clear the screen, split output into pages or wait for Enter
+- Output is either plain text (the same lines as the terminal UI, without colours) or
+  JSON
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import reports
+from change_log import ChangesCompacted
+from duplicates import DuplicateIndex
+from headless import read_script, run_script, strip_ansi
+from util import FileStorage
+
+if TYPE_CHECKING:
+    from app import App
+
+# Commands are run by whoever has access to the data directory, rather than by someone
+# who has logged in
+CLI_ACCOUNT = {"username": "command-line"}
+
+
+def write_lines(lines):
+    for line in lines:
+        sys.stdout.write(strip_ansi(line) + "\n")
+
+
+def run_report(application: App, arguments: argparse.Namespace):
+    students_database = application.students_database
+
+    if arguments.report in ("surnames", "forenames") and arguments.prefix is None:
+        print(f"The {arguments.report} report needs a --prefix", file=sys.stderr)
+        sys.exit(2)
+
+    if arguments.report == "duplicates":
+        duplicates = DuplicateIndex(
+            students_database.get_students(account=CLI_ACCOUNT)
+        ).find_all_duplicates()
+        if arguments.format == "json":
+            print(
+                json.dumps(
+                    [
+                        {
+                            "students": [student, other_student],
+                            "matching": matching_details,
+                        }
+                        for student, other_student, matching_details in duplicates
+                    ]
+                )
+            )
+        else:
+            write_lines(reports.duplicate_lines(duplicates))
+        return
+
+    if arguments.report == "birthdays":
+        query = reports.upcoming_birthdays_query(students_database, CLI_ACCOUNT)
+    elif arguments.report == "surnames":
+        query = reports.surnames_starting_with_query(
+            students_database, arguments.prefix, CLI_ACCOUNT
+        )
+    else:
+        query = reports.forenames_starting_with_query(
+            students_database, arguments.prefix, CLI_ACCOUNT
+        )
+
+    if arguments.explain:
+        # Describe how the report is found, rather than running it
+        print(query.explain())
+        return
+
+    target_students = query.run()
+    if arguments.format == "json":
+        print(json.dumps(target_students))
+    elif arguments.report == "birthdays":
+        write_lines(
+            reports.upcoming_birthday_lines(
+                target_students, students_database.get_derived_fields
+            )
+        )
+    elif arguments.report == "surnames":
+        write_lines(reports.surname_lines(target_students))
+    else:
+        write_lines(reports.forename_lines(target_students))
+
+
+def run_student_command(application: App, arguments: argparse.Namespace):
+    students_database = application.students_database
+    if arguments.id is None and arguments.email is None:
+        print("Provide a student ID or --email", file=sys.stderr)
+        sys.exit(2)
+
+    student = students_database.get_student(
+        id=arguments.id, email_address=arguments.email
+    )
+    if not student:
+        print("No student found", file=sys.stderr)
+        sys.exit(1)
+    application.audit_log.record("view", student["id"], CLI_ACCOUNT)
+
+    if arguments.format == "json":
+        print(json.dumps(student))
+    else:
+        derived_fields = students_database.get_derived_fields(student)
+        write_lines(
+            [
+                f"{student['full_name']} (#{student['id']})",
+                f"Surname: {student['surname']}",
+                f"Forename: {student['forename']}",
+                f"Birthday: {derived_fields.birthday_string} (age "
+                + f"{derived_fields.age()})",
+                f"Tutor group: {student['tutor_group']}",
+                f"Home phone number: {student['home_phone']}",
+                f"School email address: {student['school_email']}",
+            ]
+        )
+
+
+def run_changes_command(application: App, arguments: argparse.Namespace):
+    students_database = application.students_database
+    if arguments.compact is not None:
+        removed_count = students_database.change_log.compact(
+            timedelta(days=arguments.compact)
+        )
+        print(
+            f"Removed {removed_count} changes older than {arguments.compact} days",
+            file=sys.stderr,
+        )
+        return
+
+    if arguments.snapshot:
+        seq, students = students_database.snapshot()
+        print(json.dumps({"seq": seq, "students": students}))
+        return
+
+    try:
+        changes = students_database.changes_since(arguments.since)
+    except ChangesCompacted as error:
+        print(
+            f"{error}. Use --snapshot to start again from a full copy.", file=sys.stderr
+        )
+        sys.exit(2)
+
+    # Print one change per line (JSON Lines), so that the output can be streamed
+    for change in changes:
+        sys.stdout.write(json.dumps(change) + "\n")
+
+
+def run_ui_script(application: App, arguments: argparse.Namespace):
+    output = run_script(application, read_script(arguments.script))
+    sys.stdout.write(output if arguments.keep_colours else strip_ansi(output))
+
+
+def run_batch_command(application: App, arguments: argparse.Namespace):
+    # Imported here, since only this command needs it
+    import batch
+
+    if arguments.jobs:
+        jobs = json.loads(arguments.jobs.read_text(encoding="utf-8"))
+    else:
+        jobs = batch.every_tutor_group_jobs(application.students_database)
+
+    try:
+        written_files = batch.run_batch(
+            application.students_database,
+            jobs,
+            arguments.output,
+            arguments.workers,
+            arguments.format,
+        )
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        sys.exit(2)
+    print(f"Wrote {len(written_files)} reports to {arguments.output}", file=sys.stderr)
+
+
+def backup_store_for(application: App, arguments: argparse.Namespace):
+    # Imported here, since only the backup commands need it
+    from backup import BackupStore
+
+    directory = arguments.backups or application.storage.get_file_path("backups")
+    return BackupStore(FileStorage(directory))
+
+
+def run_backup_command(application: App, arguments: argparse.Namespace):
+    snapshot = backup_store_for(application, arguments).backup(application.storage)
+    print(
+        f"Saved snapshot {snapshot['id']} of {len(snapshot['files'])} files "
+        + f"({snapshot['bytes_written']} new bytes)",
+        file=sys.stderr,
+    )
+
+
+def run_restore_command(application: App, arguments: argparse.Namespace):
+    from backup import SnapshotNotFound
+
+    backup_store = backup_store_for(application, arguments)
+    if arguments.list:
+        for snapshot in backup_store.snapshots():
+            total_size = sum(
+                file_info["size"] for file_info in snapshot["files"].values()
+            )
+            print(
+                f"{snapshot['id']:5}  {snapshot['created']}  {total_size:12} bytes  "
+                + f"{snapshot['bytes_written']:12} new bytes"
+            )
+        return
+
+    try:
+        snapshot = backup_store.find_snapshot(arguments.snapshot, arguments.at)
+    except SnapshotNotFound as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    restored_files = backup_store.restore(snapshot, application.storage)
+    print(
+        f"Restored {', '.join(restored_files)} from snapshot {snapshot['id']} "
+        + f"({snapshot['created']})",
+        file=sys.stderr,
+    )
+
+
+def run_migrate_command(application: App, _arguments: argparse.Namespace):
+    # Pending migrations are run when the app starts, so by now they've already been
+    # applied
+    import migrations
+
+    for migration in application.applied_migrations:
+        print(
+            f"Migrated {migration.filename} to version {migration.version}: "
+            + f"{migration.description}"
+        )
+    if not application.applied_migrations:
+        print("The databases are already up to date")
+    for filename in migrations.MIGRATABLE_FILES:
+        print(
+            f"{filename}: schema version "
+            + f"{migrations.schema_version(application.metadata_database, filename)}"
+        )
+
+
+def run_accounts_import_command(application: App, arguments: argparse.Namespace):
+    # Imported here, since only this command needs it
+    import csv
+
+    from provisioning import ProvisioningError, provision_accounts, read_accounts_csv
+
+    try:
+        with open(arguments.file, newline="", encoding="utf-8-sig") as file:
+            rows = read_accounts_csv(file)
+        created_accounts = provision_accounts(
+            rows, application.accounts_database, arguments.workers
+        )
+    except ProvisioningError as error:
+        print("No accounts were created:", file=sys.stderr)
+        for problem in error.problems:
+            print(f"- {problem}", file=sys.stderr)
+        sys.exit(2)
+    except ValueError as error:
+        # e.g. someone else took one of the usernames while the passwords were being
+        # hashed
+        print("No accounts were created:", file=sys.stderr)
+        print(f"- {error}", file=sys.stderr)
+        sys.exit(2)
+
+    # The generated passwords are only shown now, since only their hashes are stored
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["username", "password"])
+    for username, generated_password in created_accounts:
+        if generated_password is not None:
+            writer.writerow([username, generated_password])
+    print(f"Created {len(created_accounts)} accounts", file=sys.stderr)
+
+
+def run_verify_command(_application: None, arguments: argparse.Namespace):
+    # Imported here, since only this command needs it
+    from integrity import verify
+    from metadata import MetadataDatabase
+
+    # Checking the files shouldn't create them, so nothing is set up if it's missing
+    if not arguments.data.is_dir():
+        print(f"There's no data directory at {arguments.data}", file=sys.stderr)
+        sys.exit(2)
+    storage = FileStorage(arguments.data)
+
+    # Without the metadata, every file is checked and the results aren't remembered
+    metadata_database = None
+    if (arguments.data / "metadata.json").exists():
+        try:
+            metadata_database = MetadataDatabase(storage=storage)
+        except ValueError as error:
+            print(f"metadata.json: isn't valid JSON ({error})")
+
+    result = verify(storage, metadata_database, full=arguments.full)
+    for problem in result.problems:
+        print(problem)
+    for filename in result.checked:
+        print(f"Checked {filename}", file=sys.stderr)
+    for filename in result.skipped:
+        print(
+            f"Skipped {filename} (unchanged, generation "
+            + f"{result.generations[filename]})",
+            file=sys.stderr,
+        )
+    if result.problems:
+        sys.exit(1)
+    print("No problems found", file=sys.stderr)
+
+
+def run_snapshot_command(application: App, arguments: argparse.Namespace):
+    # Imported here, since only this command needs it
+    from snapshot import SNAPSHOT_FILENAME, write_snapshot
+
+    if arguments.output:
+        storage, filename = FileStorage(arguments.output.parent), arguments.output.name
+    else:
+        storage, filename = application.storage, SNAPSHOT_FILENAME
+    student_count = write_snapshot(application.students_database, storage, filename)
+    print(
+        f"Wrote a snapshot of {student_count} students to "
+        + f"{storage.get_file_path(filename) or filename}",
+        file=sys.stderr,
+    )
+
+
+def run_audit_command(application: App, arguments: argparse.Namespace):
+    audit_log = application.audit_log
+    events = (
+        audit_log.events_for_student(arguments.id)
+        if arguments.id is not None
+        else audit_log.events()
+    )
+
+    for event in events:
+        if arguments.format == "json":
+            sys.stdout.write(
+                json.dumps({**event, "timestamp": event["timestamp"].isoformat()})
+                + "\n"
+            )
+        else:
+            sys.stdout.write(
+                f"{event['timestamp']:%Y-%m-%d %H:%M:%S}  "
+                + f"{event['username'] or '(nobody)':20}  "
+                + f"{event['action']:8}  student #{event['student_id']}\n"
+            )
+
+
+def add_commands(subcommands: argparse._SubParsersAction):
+    """Adds the non-interactive commands to the main argument parser"""
+    changes_parser = subcommands.add_parser(
+        "changes",
+        help="Print the changes made to the students since a sequence number, "
+        + "as JSON Lines",
+    )
+    changes_parser.add_argument(
+        "--since", type=int, default=0, help="The last sequence number that was synced"
+    )
+    changes_parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Print every student, and the sequence number to request changes "
+        + "since next time",
+    )
+    changes_parser.add_argument(
+        "--compact",
+        type=int,
+        metavar="DAYS",
+        help="Remove changes older than this many days from the log",
+    )
+    changes_parser.set_defaults(run=run_changes_command)
+
+    report_parser = subcommands.add_parser(
+        "report", help="Print a report without opening the terminal UI"
+    )
+    report_parser.add_argument(
+        "report", choices=["birthdays", "surnames", "forenames", "duplicates"]
+    )
+    report_parser.add_argument(
+        "--prefix",
+        help="The start of the names to include (surnames and forenames reports)",
+    )
+    report_parser.add_argument("--format", choices=["text", "json"], default="text")
+    report_parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Show which index the report would use, instead of running it",
+    )
+    report_parser.set_defaults(run=run_report)
+
+    batch_parser = subcommands.add_parser(
+        "batch", help="Write lots of reports to files at once, using every CPU core"
+    )
+    batch_parser.add_argument(
+        "output", type=Path, help="The directory to write the reports to"
+    )
+    batch_parser.add_argument(
+        "--jobs",
+        type=Path,
+        help="A JSON file with a list of reports to write, e.g. "
+        + '[{"report": "surnames", "tutor_group": "9A", "prefix": "S"}]. '
+        + "By default, every report is written for every tutor group",
+    )
+    batch_parser.add_argument(
+        "--workers",
+        type=int,
+        help="How many processes to use (by default, one per CPU core)",
+    )
+    batch_parser.add_argument("--format", choices=["text", "json"], default="text")
+    batch_parser.set_defaults(run=run_batch_command)
+
+    backup_parser = subcommands.add_parser(
+        "backup",
+        help="Take a snapshot of the databases, only storing the parts that changed "
+        + "since the last one",
+    )
+    backup_parser.add_argument(
+        "--backups",
+        type=Path,
+        metavar="DIRECTORY",
+        help="Where to keep the backups (by default, data/backups)",
+    )
+    backup_parser.set_defaults(run=run_backup_command)
+
+    restore_parser = subcommands.add_parser(
+        "restore", help="Restore the databases from a backup snapshot"
+    )
+    restore_parser.add_argument(
+        "--backups",
+        type=Path,
+        metavar="DIRECTORY",
+        help="Where the backups are kept (by default, data/backups)",
+    )
+    restore_parser.add_argument(
+        "--list",
+        action="store_true",
+        help="List the snapshots instead of restoring one",
+    )
+    restore_parser.add_argument(
+        "--snapshot", type=int, metavar="ID", help="The snapshot to restore"
+    )
+    restore_parser.add_argument(
+        "--at",
+        type=datetime.fromisoformat,
+        metavar="TIME",
+        help="Restore the latest snapshot taken at or before this time, e.g. "
+        + "2024-07-01T09:00 (by default, the latest)",
+    )
+    restore_parser.set_defaults(run=run_restore_command)
+
+    audit_parser = subcommands.add_parser(
+        "audit",
+        help="Show who has viewed, registered or changed students (one event per line)",
+    )
+    audit_parser.add_argument(
+        "id",
+        type=int,
+        nargs="?",
+        help="Only show the events for the student with this ID",
+    )
+    audit_parser.add_argument("--format", choices=["text", "json"], default="text")
+    audit_parser.set_defaults(run=run_audit_command)
+
+    snapshot_parser = subcommands.add_parser(
+        "snapshot",
+        help="Write a read-only snapshot of the students that other processes "
+        + "can memory-map",
+    )
+    snapshot_parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="FILE",
+        help="Where to write the snapshot (by default, data/students.snapshot)",
+    )
+    snapshot_parser.set_defaults(run=run_snapshot_command)
+
+    verify_parser = subcommands.add_parser(
+        "verify",
+        help="Check the database files for damage, e.g. duplicate IDs or email "
+        + "addresses and invalid dates",
+    )
+    verify_parser.add_argument(
+        "--data",
+        type=Path,
+        default=Path(".", "data"),
+        metavar="DIRECTORY",
+        help="The data directory to check",
+    )
+    verify_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Check every file, even if it hasn't changed since it last passed",
+    )
+    # The files are checked without loading them into the app, since loading them might
+    # be what fails
+    verify_parser.set_defaults(run=run_verify_command, load_app=False)
+
+    migrate_parser = subcommands.add_parser(
+        "migrate",
+        help="Update the database files to the latest format, then show their "
+        + "schema versions",
+    )
+    migrate_parser.set_defaults(run=run_migrate_command)
+
+    accounts_parser = subcommands.add_parser(
+        "accounts", help="Manage accounts without opening the terminal UI"
+    )
+    accounts_subcommands = accounts_parser.add_subparsers(
+        title="commands", metavar="COMMAND", required=True
+    )
+    import_parser = accounts_subcommands.add_parser(
+        "import",
+        help="Create an account for each row of a CSV file with a username column and "
+        + "an optional password column. Passwords are generated for rows without "
+        + "one, and printed as CSV",
+    )
+    import_parser.add_argument("file", type=Path)
+    import_parser.add_argument(
+        "--workers",
+        type=int,
+        help="How many passwords to hash at once (by default, one per CPU core)",
+    )
+    import_parser.set_defaults(run=run_accounts_import_command)
+
+    student_parser = subcommands.add_parser(
+        "student", help="Look up students without opening the terminal UI"
+    )
+    student_subcommands = student_parser.add_subparsers(
+        title="commands", metavar="COMMAND", required=True
+    )
+    get_parser = student_subcommands.add_parser("get", help="Print a student's details")
+    get_parser.add_argument("id", type=int, nargs="?", help="The student's ID")
+    get_parser.add_argument(
+        "--email", help="Look the student up by their school email address instead"
+    )
+    get_parser.add_argument("--format", choices=["text", "json"], default="text")
+    get_parser.set_defaults(run=run_student_command)
+
+    script_parser = subcommands.add_parser(
+        "script",
+        help="Run the terminal UI with answers from a script file (one per line), "
+        + "printing what it shows",
+    )
+    script_parser.add_argument("script", type=Path)
+    script_parser.add_argument(
+        "--keep-colours",
+        action="store_true",
+        help="Don't remove colours from the output",
+    )
+    script_parser.set_defaults(run=run_ui_script)
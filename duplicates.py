@@ -0,0 +1,210 @@
+"""Finds students that are likely to have been registered more than once, e.g. "Jon
+Smith" and "John Smith"
+
+- Comparing every student with every other student would take O(n²) time, so students
+  are grouped into "blocks" by keys that duplicates almost always share (their birthday,
+  phone number and how their surname sounds). Only students in the same block are
+  compared.
+- A pair of students is a likely duplicate if enough of their details match. See
+  compare()
+"""
+from __future__ import annotations
+
+import unicodedata
+from typing import Iterable
+
+# Letters that sound similar are given the same Soundex digit. Vowels (and H, W, Y) are
+# left out
+SOUNDEX_DIGITS = {
+    **dict.fromkeys("BFPV", "1"),
+    **dict.fromkeys("CGJKQSXZ", "2"),
+    **dict.fromkeys("DT", "3"),
+    "L": "4",
+    **dict.fromkeys("MN", "5"),
+    "R": "6",
+}
+
+# How many of the compared details need to match for a pair of students to be reported
+MATCHES_NEEDED = 3
+
+
+def to_ascii_letters(name: str) -> str:
+    """Removes accents and anything that isn't a letter, e.g. "Ó Súilleabháin" becomes
+    "OSUILLEABHAIN"
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(
+        character for character in decomposed if "A" <= character.upper() <= "Z"
+    ).upper()
+
+
+def soundex(name: str) -> str:
+    """Returns the Soundex code of a name, so names that sound alike (e.g. "Jon" and
+    "John") get the same code
+
+    - Returns an empty string if the name doesn't contain any letters that Soundex
+      understands
+    """
+    letters = to_ascii_letters(name)
+    if not letters:
+        return ""
+
+    code = letters[0]
+    previous_digit = SOUNDEX_DIGITS.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = SOUNDEX_DIGITS.get(letter, "")
+        if digit and digit != previous_digit:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W don't separate letters with the same digit, but vowels do
+        if letter not in "HW":
+            previous_digit = digit
+
+    return code.ljust(4, "0")
+
+
+def normalise_phone_number(phone_number: str) -> str:
+    """Keeps only the digits of a phone number, so differently-formatted copies of a
+    number match
+    """
+    return "".join(character for character in phone_number if character.isdigit())
+
+
+def profile(student: dict) -> dict[str, str]:
+    """Works out the normalised details of a student that are compared when looking for
+    duplicates
+    """
+    return {
+        "birthday": student["birthday"],
+        "phone number": normalise_phone_number(student["home_phone"]),
+        "similar surname": soundex(student["surname"]),
+        "similar forename": soundex(student["forename"]),
+    }
+
+
+def compare(
+    student_profile: dict[str, str], other_profile: dict[str, str]
+) -> list[str]:
+    """Returns the descriptions of the details that two students (with the provided
+    profiles) have in common
+    """
+    return [
+        detail
+        for detail, value in student_profile.items()
+        if value and value == other_profile[detail]
+    ]
+
+
+class DuplicateIndex:
+    """Groups students by their blocking keys, so possible duplicates can be found
+    without comparing every pair
+    """
+
+    # The details in a student's profile that they are grouped by
+    BLOCKING_DETAILS = ["birthday", "phone number", "similar surname"]
+    # Likely duplicates always share at least this many blocking keys, since only one
+    # compared detail isn't one
+    SHARED_KEYS_NEEDED = MATCHES_NEEDED - 1
+
+    def __init__(self, students: Iterable[dict] = ()):
+        # Maps each blocking key to the IDs of the students that have it
+        self.blocks: dict[tuple[str, str], set[int]] = {}
+        self.students_by_id: dict[int, dict] = {}
+        self.profiles_by_id: dict[int, dict[str, str]] = {}
+        for student in students:
+            self.add(student)
+
+    def blocking_keys(self, student_profile: dict[str, str]) -> list[tuple[str, str]]:
+        return [
+            (detail, student_profile[detail])
+            for detail in self.BLOCKING_DETAILS
+            if student_profile[detail]
+        ]
+
+    def candidate_blocks(self, student_profile: dict[str, str]) -> list[set[int]]:
+        """Returns the blocks that need to be searched for duplicates of a student with
+        the provided profile
+
+        - A duplicate shares at least two blocking keys, so it's always in one of the
+          student's blocks other than the biggest one. Leaving out the biggest block
+          (usually everyone with a similar surname) saves most of the comparisons.
+        """
+        blocks = [
+            self.blocks.get(key, set()) for key in self.blocking_keys(student_profile)
+        ]
+        if self.SHARED_KEYS_NEEDED >= 2 and blocks:
+            blocks.sort(key=len)
+            blocks.pop()
+        return blocks
+
+    def add(self, student: dict):
+        student_profile = profile(student)
+        self.students_by_id[student["id"]] = student
+        self.profiles_by_id[student["id"]] = student_profile
+        for key in self.blocking_keys(student_profile):
+            self.blocks.setdefault(key, set()).add(student["id"])
+
+    def remove(self, student: dict):
+        del self.students_by_id[student["id"]]
+        student_profile = self.profiles_by_id.pop(student["id"])
+        for key in self.blocking_keys(student_profile):
+            block = self.blocks.get(key)
+            if block is not None:
+                block.discard(student["id"])
+                if not block:
+                    del self.blocks[key]
+
+    def find_matches(self, student: dict) -> list[tuple[dict, list[str]]]:
+        """Returns the indexed students that are likely to be duplicates of the provided
+        student
+
+        - The provided student doesn't need to have an ID yet, so it can be checked
+          before it's registered
+        - Returns a list of (other student, details that match) tuples
+        """
+        student_profile = profile(student)
+        candidate_ids: set[int] = set()
+        for block in self.candidate_blocks(student_profile):
+            candidate_ids.update(block)
+        candidate_ids.discard(student.get("id"))
+
+        matches = []
+        for candidate_id in sorted(candidate_ids):
+            matching_details = compare(
+                student_profile, self.profiles_by_id[candidate_id]
+            )
+            if len(matching_details) >= MATCHES_NEEDED:
+                matches.append((self.students_by_id[candidate_id], matching_details))
+        return matches
+
+    def find_all_duplicates(self) -> list[tuple[dict, dict, list[str]]]:
+        """Returns every pair of indexed students that are likely to be duplicates,
+        ordered by ID
+
+        - Only pairs in the same block are compared, and each pair is only compared once
+        """
+        duplicates = []
+        for student_id, student_profile in self.profiles_by_id.items():
+            candidate_ids: set[int] = set()
+            for block in self.candidate_blocks(student_profile):
+                candidate_ids.update(block)
+
+            for other_id in candidate_ids:
+                # Only compare each pair from the side of the student with the lower ID
+                if other_id <= student_id:
+                    continue
+                matching_details = compare(
+                    student_profile, self.profiles_by_id[other_id]
+                )
+                if len(matching_details) >= MATCHES_NEEDED:
+                    duplicates.append(
+                        (
+                            self.students_by_id[student_id],
+                            self.students_by_id[other_id],
+                            matching_details,
+                        )
+                    )
+
+        duplicates.sort(key=lambda duplicate: (duplicate[0]["id"], duplicate[1]["id"]))
+        return duplicates
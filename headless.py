@@ -0,0 +1,77 @@
+"""Runs the terminal UI without a person at the keyboard, e.g. for scheduled jobs or
+end-to-end tests
+
+- The answers to each prompt (including menu selections, passwords and "Press Enter"
+  pauses) come from a script, with one answer per line. A blank line is the same as just
+  pressing Enter.
+- Everything the UI prints is captured, rather than being shown in the terminal
+- The session ends when the script runs out of answers
+"""
+from __future__ import annotations
+
+import io
+import sys
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+import regex as re
+
+import inputs
+
+if TYPE_CHECKING:
+    from app import App
+
+# Matches the ANSI escape codes used for colours and clearing the screen
+ANSI_ESCAPE_REGEX = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+def strip_ansi(text: str) -> str:
+    """Removes colours and other terminal escape codes from some text"""
+    return ANSI_ESCAPE_REGEX.sub("", text)
+
+
+def read_script(script_path: Path) -> list[str]:
+    """Reads the answers from a script file, one per line"""
+    return script_path.read_text(encoding="utf-8").splitlines()
+
+
+@contextmanager
+def scripted_console(answers: Iterable[str]) -> Iterator[io.StringIO]:
+    """Makes input() (and password prompts) read from the answers, and captures
+    everything that's printed
+
+    - Yields the buffer that the output is captured in
+    - When the answers run out, the next prompt raises EOFError
+    """
+    script = io.StringIO("".join(f"{answer}\n" for answer in answers))
+    output = io.StringIO()
+
+    original_stdin, original_stdout = sys.stdin, sys.stdout
+    original_getpass = inputs.getpass
+    # input() reads from sys.stdin and writes its prompt to sys.stdout when they've been
+    # replaced. getpass() always reads from the terminal, so it's replaced with input()
+    # (the password is in the script anyway)
+    sys.stdin, sys.stdout = script, output
+    inputs.getpass = input
+    try:
+        yield output
+    finally:
+        sys.stdin, sys.stdout = original_stdin, original_stdout
+        inputs.getpass = original_getpass
+
+
+def run_script(app: App, answers: Iterable[str]) -> str:
+    """Runs the terminal UI, answering its prompts with the provided answers, and
+    returns what it printed
+
+    - The session ends when it runs out of answers (or if the script exits the program)
+    """
+    # Imported here to avoid a circular import, since the terminal UI imports most other
+    # modules
+    from terminal_ui import TerminalUI
+
+    # The session ends with an EOFError once the script has finished
+    with scripted_console(answers) as output, suppress(EOFError):
+        TerminalUI(app).show()
+    return output.getvalue()
@@ -2,6 +2,7 @@ import datetime
 import unicodedata
 from base64 import b64encode
 from getpass import getpass
+from typing import Optional
 
 import bcrypt
 import phonenumbers
@@ -12,6 +13,14 @@ from colorama import Style
 from menu import color, error_incorrect_input
 from util import process_password
 
+# Usernames can only contain word characters, periods, hyphens and spaces
+VALID_USERNAME_REGEX = r"^[\w\.\- ]+$"
+# Names can contain any alphabetic character, any space charcater, hyphens, periods and
+# apostrophes
+VALID_NAME_REGEX = r"^[\p{Alphabetic}\p{Z}\-\.']+$"
+# Tutor groups are 1+ digits followed by 1+ capital letters, e.g 7CA or 12A
+TUTOR_GROUP_REGEX = r"^(\d+)([A-Z]+)$"
+
 
 def question(prompt) -> str:
     """Asks the user for input. Performs no input validation!"""
@@ -22,13 +31,21 @@ def question(prompt) -> str:
 
 def valid_utf8(prompt):
     """Asks the user for input, returning a valid, normalised UTF-8 string"""
-    try:
-        raw_input = question(prompt)
-    except UnicodeDecodeError:
-        # So, you thought it'd be funny to enter invalid UTF-8, eh?
-        error_incorrect_input("Invalid character sequence")
-        return valid_utf8(prompt)
+    while True:
+        try:
+            raw_input = question(prompt)
+            break
+        except UnicodeDecodeError:
+            # So, you thought it'd be funny to enter invalid UTF-8, eh?
+            error_incorrect_input("Invalid character sequence")
+
+    return normalise(raw_input)
+
 
+def normalise(raw_input: str) -> str:
+    """Removes leading/trailing whitespace and normalises the unicode characters, like
+    every other input
+    """
     # NFKC ensures that composed characters are used where possible, and also replaces
     # compatability characters with their canonical form, https://stackoverflow.com/a/16467505
     return unicodedata.normalize("NFKC", raw_input.strip())
@@ -41,13 +58,12 @@ def text(prompt, error_message="Enter some text") -> str:
     - Removes leading/trailing whitespace
     - Normalizes the unicode characters (composed and canonical form)
     """
-    stripped_input = valid_utf8(prompt).strip()
+    while True:
+        stripped_input = valid_utf8(prompt).strip()
+        if stripped_input:
+            return stripped_input
 
-    if not stripped_input:
         error_incorrect_input(error_message)
-        return text(prompt)
-
-    return stripped_input
 
 
 def multiline(prompt, error_message: str = "Enter some text"):
@@ -57,40 +73,40 @@ def multiline(prompt, error_message: str = "Enter some text"):
     - It validates that some text was entered
     - Pressing enter on an empty line submits the input
     """
-    print(
-        prompt
-        + color("(Enter to insert newlines; press Enter twice to submit)", Style.DIM)
-    )
-
-    lines = []
     while True:
-        line = valid_utf8("")
-        if line == "":
-            break
-        # Preserve indentation but remove trailing spaces
-        line.rstrip()
-        lines.append(line)
-
-    full_input = "\n".join(lines)
+        print(
+            prompt
+            + color(
+                "(Enter to insert newlines; press Enter twice to submit)", Style.DIM
+            )
+        )
+
+        lines = []
+        while True:
+            line = valid_utf8("")
+            if line == "":
+                break
+            # Preserve indentation but remove trailing spaces
+            line.rstrip()
+            lines.append(line)
+
+        full_input = "\n".join(lines)
+
+        # Validate that they actually entered something
+        if full_input.strip() != "":
+            return full_input
 
-    # Validate that they actually entered something
-    if full_input.strip() == "":
         error_incorrect_input(error_message)
-        return multiline(prompt, error_message)
-
-    return full_input
 
 
 def integer(prompt, error_message: str = "Enter a valid whole number") -> int:
     """Asks for a valid integer to be input"""
-    raw_input = text(prompt, "Enter at least 1 digit")
-    try:
-        int_input = int(raw_input)
-    except ValueError:
-        error_incorrect_input(error_message)
-        return integer(prompt, error_message)
-
-    return int_input
+    while True:
+        raw_input = text(prompt, "Enter at least 1 digit")
+        try:
+            return int(raw_input)
+        except ValueError:
+            error_incorrect_input(error_message)
 
 
 def yes_no(prompt, error_message = 'Enter "yes" or "no"') -> bool:
@@ -98,30 +114,39 @@ def yes_no(prompt, error_message = 'Enter "yes" or "no"') -> bool:
     YES_ANSWERS = ["yes", "y", "t", "true", "1", ":thumbs_up:"]
     NO_ANSWERS = ["no", "n", "f", "false", "0", ":thumbs_down:"]
     
-    lowercase_input = text(prompt, error_message).lower()
-    if lowercase_input in YES_ANSWERS:
-        return True
-    if lowercase_input in NO_ANSWERS:
-        return False
-    
-    return yes_no(prompt, error_message)
+    while True:
+        lowercase_input = text(prompt, error_message).lower()
+        if lowercase_input in YES_ANSWERS:
+            return True
+        if lowercase_input in NO_ANSWERS:
+            return False
+
+
+def username_problem(username: str) -> Optional[str]:
+    """Checks a (normalised) username against the rules in new_username(), returning
+    what's wrong with it (if anything)
+
+    - Doesn't ask for input, so it can be used to check usernames from elsewhere (e.g. a
+      file of accounts to create)
+    """
+    if not 1 <= len(username) <= 64:
+        return "Enter a username made up of 1–64 characters"
+    if not re.search(VALID_USERNAME_REGEX, username):
+        return "Only use letters, numbers, ., -, _, and spaces"
+    return None
 
 
 def new_username(prompt) -> str:
     """Usernames can be 1 to 64 characters. They must only be made up of word characters,
     periods, hyphens or spaces."""
-    valid_username_regex = r"^[\w\.\- ]+$"
-
-    raw_input = text(prompt, "Enter a username")
-    length = len(raw_input)
-    if not 1 <= length <= 64:
-        error_incorrect_input("Enter a username made up of 1–64 characters")
-        return new_username(prompt)
-    if not re.search(valid_username_regex, raw_input):
-        error_incorrect_input("Only use letters, numbers, ., -, _, and spaces")
-        return new_username(prompt)
+    while True:
+        raw_input = text(prompt, "Enter a username")
+        problem = username_problem(raw_input)
+        if problem:
+            error_incorrect_input(problem)
+            continue
 
-    return raw_input
+        return raw_input
 
 
 def password_to_hash(raw_password: str) -> str:
@@ -144,12 +169,12 @@ def password(
     if not hide_characters:
         return text(prompt, error_message)
 
-    raw_input = getpass(prompt)
-    if not raw_input:
-        error_incorrect_input(error_message)
-        return password(prompt, error_message, hide_characters)
+    while True:
+        raw_input = getpass(prompt)
+        if raw_input:
+            return raw_input
 
-    return raw_input
+        error_incorrect_input(error_message)
 
 
 def new_password(prompt, hide_characters=True):
@@ -168,33 +193,31 @@ def new_password(prompt, hide_characters=True):
 def name(prompt):
     """Names can include letters from any script, as well as spaces, hyphens and periods.
     Returns the name in title case."""
-    # Allow any alphabetic character, any space charcater, hyphens and periods
-    valid_name_regex = r"^[\p{Alphabetic}\p{Z}\-\.']+$"
+    while True:
+        raw_input = text(prompt)
+        if re.match(VALID_NAME_REGEX, raw_input):
+            return raw_input.title()
 
-    raw_input = text(prompt)
-    if not re.match(valid_name_regex, raw_input):
         error_incorrect_input("Only use letters, ., -, ', and spaces")
-        return name(prompt)
-
-    return raw_input.title()
 
 
 def date(prompt) -> datetime.date:
     """Prompts the user to input a date in YYYY-MM-DD format."""
     # Rule 1 of dealing with timezones: Don't deal with timezones
-    raw_input = text(prompt)
+    while True:
+        raw_input = text(prompt)
 
-    try:
-        parsed_date = datetime.date.fromisoformat(raw_input)
-    except ValueError:
-        error_incorrect_input("Enter a valid date in the format YYYY-MM-DD")
-        return date(prompt)
+        try:
+            parsed_date = datetime.date.fromisoformat(raw_input)
+        except ValueError:
+            error_incorrect_input("Enter a valid date in the format YYYY-MM-DD")
+            continue
 
-    if parsed_date > datetime.date.today():
-        error_incorrect_input("Enter a date that's in the past")
-        return date(prompt)
+        if parsed_date > datetime.date.today():
+            error_incorrect_input("Enter a date that's in the past")
+            continue
 
-    return parsed_date
+        return parsed_date
 
 
 def tutor_group(prompt):
@@ -204,31 +227,28 @@ def tutor_group(prompt):
     - Checks that the input's in the format of a tutor group
     - Doesn't check that the input is a sutor group that actually exists
     Note: The spec doesn't really explain how tutor groups are meant to work"""
-    # Allow 1+ digits followed by 1+ capital letters, e.g 7CA or 12A
-    tutor_group_regex = r"^(\d+)([A-Z]+)$"
-
-    raw_input = text(prompt).upper()
+    while True:
+        raw_input = text(prompt).upper()
+        if re.match(TUTOR_GROUP_REGEX, raw_input):
+            return raw_input
 
-    if not re.match(tutor_group_regex, raw_input):
         error_incorrect_input("Enter a tutor group in a format like 13AX")
-        return tutor_group(prompt)
-
-    return raw_input
 
 
 def phone_number(prompt):
     """Prompts the user to input a valid UK or international phone number"""
-    raw_input = text(prompt)
+    while True:
+        raw_input = text(prompt)
 
-    try:
-        parsed_phone_number = phonenumbers.parse(raw_input, "GB")
-    except NumberParseException:
-        error_incorrect_input("Enter a phone number (UK or international format)")
-        return phone_number(prompt)
+        try:
+            parsed_phone_number = phonenumbers.parse(raw_input, "GB")
+        except NumberParseException:
+            error_incorrect_input("Enter a phone number (UK or international format)")
+            continue
 
-    if not phonenumbers.is_possible_number(parsed_phone_number):
+        if phonenumbers.is_possible_number(parsed_phone_number):
+            break
         error_incorrect_input("Enter a correctly-formatted phone number")
-        return phone_number(prompt)
 
     serialized_phone_number = phonenumbers.format_number(
         parsed_phone_number, phonenumbers.PhoneNumberFormat.INTERNATIONAL
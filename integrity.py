@@ -0,0 +1,504 @@
+"""Checks that the database files haven't been damaged (e.g. by being edited by hand or
+only partly written)
+
+- Each check reads its files once, from start to finish, without loading them into the
+  databases. It looks for records in the wrong format, values that should be unique but
+  aren't (like student IDs and email addresses), and anything that would break the
+  indexes that are built when the files are loaded.
+- Files that are checked together (e.g. the students and the archive, which can't share
+  IDs) are registered with @integrity_check. If any of them has problems, each problem
+  is listed, rather than stopping at the first one.
+- After a check passes, the checksum of each file is kept in the metadata database,
+  along with a generation number (how many different versions of the file have passed).
+  If the files haven't changed since, the check is skipped.
+"""
+from __future__ import annotations
+
+import io
+import json
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date
+from operator import itemgetter
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import audit
+from metadata import MetadataDatabase
+from metrics import metrics
+from migrations import iter_json_array
+from util import Storage
+
+# Where the checksums of files that have passed their check are kept in the metadata
+# database
+INTEGRITY_SECTION = "integrity"
+READ_BLOCK_SIZE = 1024 * 1024
+# Only the first few problems with each file are listed, since one mistake often causes
+# many more
+MAX_PROBLEMS_PER_FILE = 20
+
+STUDENT_STRING_FIELDS = [
+    "surname",
+    "forename",
+    "birthday",
+    "tutor_group",
+    "home_address",
+    "home_phone",
+    "school_email",
+    "full_name",
+]
+get_student_strings = itemgetter(*STUDENT_STRING_FIELDS)
+CHANGE_OPERATIONS = {"insert", "update", "archive", "purge"}
+
+
+class IntegrityError(ValueError):
+    """Raised when the database files are checked as they're loaded and have problems"""
+
+    def __init__(self, problems: list[str]):
+        super().__init__(
+            f"The database files have {len(problems)} problem(s), starting with: "
+            + f"{problems[0]}"
+        )
+        self.problems = problems
+
+
+class ChecksummingReader(io.RawIOBase):
+    """Reads from a file, working out the checksum of everything that has been read"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.checksum = 0
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.file.read(len(buffer))
+        buffer[: len(data)] = data
+        self.checksum = zlib.crc32(data, self.checksum)
+        self.size += len(data)
+        return len(data)
+
+    def read_rest(self):
+        """Reads the rest of the file, so the checksum covers all of it (even if a check
+        stopped early)
+        """
+        while True:
+            data = self.file.read(READ_BLOCK_SIZE)
+            if not data:
+                return
+            self.checksum = zlib.crc32(data, self.checksum)
+            self.size += len(data)
+
+
+def file_checksum(storage: Storage, filename: str) -> dict:
+    """Returns the checksum and size of a file (the checksum is None if it doesn't
+    exist)
+    """
+    try:
+        file = storage.open_for_reading(filename)
+    except FileNotFoundError:
+        return {"checksum": None, "size": 0}
+    with file:
+        reader = ChecksummingReader(file)
+        reader.read_rest()
+    return {"checksum": f"{reader.checksum:08x}", "size": reader.size}
+
+
+def is_unchanged(stored: Optional[dict], checksum: dict) -> bool:
+    return stored is not None and (stored["checksum"], stored["size"]) == (
+        checksum["checksum"],
+        checksum["size"],
+    )
+
+
+class Verification:
+    """Keeps track of the problems found by a check, and the checksums of the files it
+    read
+    """
+
+    def __init__(self, storage: Storage, metadata_database: Optional[MetadataDatabase]):
+        self.storage = storage
+        self.metadata_database = metadata_database
+        self.problems: list[str] = []
+        self.problem_counts: dict[str, int] = {}
+        self.checksums: dict[str, dict] = {}
+
+    def problem(self, filename: str, message: str):
+        count = self.problem_counts[filename] = self.problem_counts.get(filename, 0) + 1
+        if count <= MAX_PROBLEMS_PER_FILE:
+            self.problems.append(f"{filename}: {message}")
+
+    @contextmanager
+    def open(self, filename: str) -> Iterator[Optional[BinaryIO]]:
+        """Opens a file for a check (or gives None if it doesn't exist, as it'll be
+        created when it's loaded)
+        """
+        try:
+            file = self.storage.open_for_reading(filename)
+        except FileNotFoundError:
+            self.checksums[filename] = {"checksum": None, "size": 0}
+            yield None
+            return
+        with file:
+            reader = ChecksummingReader(file)
+            yield io.BufferedReader(reader, READ_BLOCK_SIZE)
+            reader.read_rest()
+            self.checksums[filename] = {
+                "checksum": f"{reader.checksum:08x}",
+                "size": reader.size,
+            }
+
+    def json_array(self, filename: str) -> Iterator[tuple[int, object]]:
+        """Yields the position and value of each item in a file's JSON array, one at a
+        time
+        """
+        with self.open(filename) as file:
+            if file is None:
+                return
+            try:
+                yield from enumerate(iter_json_array(file, READ_BLOCK_SIZE))
+            except ValueError as error:
+                self.problem(filename, f"isn't a valid JSON list ({error})")
+
+    def finish(self):
+        for filename, count in self.problem_counts.items():
+            if count > MAX_PROBLEMS_PER_FILE:
+                self.problems.append(
+                    f"{filename}: ...and {count - MAX_PROBLEMS_PER_FILE} "
+                    + "more problem(s)"
+                )
+
+
+# Each check, and the files that it reads (which are skipped together if none of them
+# have changed)
+CHECKS: list[tuple[tuple[str, ...], Callable[[Verification], None]]] = []
+
+
+def integrity_check(*filenames: str):
+    """Registers a check of some database files"""
+
+    def decorator(check: Callable[[Verification], None]):
+        CHECKS.append((filenames, check))
+        return check
+
+    return decorator
+
+
+def is_valid_date(value) -> bool:
+    try:
+        return isinstance(value, str) and date.fromisoformat(value).isoformat() == value
+    except ValueError:
+        return False
+
+
+def student_problems(student) -> list[str]:
+    """Returns anything wrong with the format of a student's record"""
+    # Nearly every record is fine, so check the whole record quickly first
+    try:
+        if (
+            type(student["id"]) is int
+            and student["id"] > 0
+            and set(map(type, get_student_strings(student))) == {str}
+            and date.fromisoformat(student["birthday"]).isoformat()
+            == student["birthday"]
+            and student["full_name"] == f"{student['forename']} {student['surname']}"
+        ):
+            return []
+    except (KeyError, TypeError, ValueError):
+        pass
+    return list(find_student_problems(student))
+
+
+def find_student_problems(student) -> Iterator[str]:
+    """Yields what's wrong with a student's record (which is slower than checking it
+    with student_problems())
+    """
+    if not isinstance(student, dict):
+        yield "isn't a JSON object"
+        return
+    if (
+        not isinstance(student.get("id"), int)
+        or isinstance(student.get("id"), bool)
+        or student["id"] < 1
+    ):
+        yield f"has an invalid ID ({student.get('id')!r})"
+    for field_name in STUDENT_STRING_FIELDS:
+        if not isinstance(student.get(field_name), str):
+            yield f"has an invalid {field_name} ({student.get(field_name)!r})"
+    if isinstance(student.get("birthday"), str) and not is_valid_date(
+        student["birthday"]
+    ):
+        yield f"has a birthday that isn't a valid date ({student['birthday']!r})"
+    if (
+        all(
+            isinstance(student.get(name), str)
+            for name in ("forename", "surname", "full_name")
+        )
+        and student["full_name"] != f"{student['forename']} {student['surname']}"
+    ):
+        yield (
+            f"has a full name ({student['full_name']!r}) that doesn't match their "
+            + "forename and surname"
+        )
+
+
+def describe_record(position: int, record) -> str:
+    if isinstance(record, dict) and "id" in record:
+        return f"record {position} (ID {record['id']!r})"
+    return f"record {position}"
+
+
+@integrity_check("students.json", "students-archive.json")
+def check_students(verification: Verification):
+    """Students need unique IDs and email addresses (including archived students, as
+    they aren't reused)
+    """
+    ids: set = set()
+    email_addresses: set = set()
+    highest_removed_id = (
+        verification.metadata_database.get("students", "highest_removed_id", 0)
+        if verification.metadata_database
+        else None
+    )
+
+    for filename in ("students.json", "students-archive.json"):
+        for position, student in verification.json_array(filename):
+            problems = student_problems(student)
+            if not isinstance(student, dict):
+                verification.problem(filename, f"record {position} {problems[0]}")
+                continue
+
+            student_id, email_address = student.get("id"), student.get("school_email")
+            if isinstance(student_id, int):
+                if student_id in ids:
+                    problems.append("has the same ID as another student")
+                ids.add(student_id)
+            if isinstance(email_address, str):
+                if email_address in email_addresses:
+                    problems.append(
+                        "has the same email address as another student "
+                        + f"({email_address})"
+                    )
+                email_addresses.add(email_address)
+
+            if filename == "students-archive.json":
+                if not is_valid_date(student.get("archived_on")):
+                    problems.append("has an invalid archived_on date")
+                # IDs of archived students must never be given out again (see
+                # StudentsDatabase.next_id())
+                if (
+                    highest_removed_id is not None
+                    and isinstance(student_id, int)
+                    and student_id > highest_removed_id
+                ):
+                    problems.append(
+                        "has a higher ID than highest_removed_id in metadata.json"
+                    )
+
+            for problem in problems:
+                verification.problem(
+                    filename, f"{describe_record(position, student)} {problem}"
+                )
+
+
+@integrity_check("accounts.json")
+def check_accounts(verification: Verification):
+    usernames: set = set()
+    for position, account in verification.json_array("accounts.json"):
+        if not isinstance(account, dict) or not isinstance(
+            account.get("username"), str
+        ):
+            verification.problem(
+                "accounts.json", f"record {position} doesn't have a username"
+            )
+            continue
+        username = account["username"]
+        if username != username.lower():
+            verification.problem(
+                "accounts.json",
+                f"{username!r} isn't in lowercase, so nobody can log in to it",
+            )
+        if username in usernames:
+            verification.problem(
+                "accounts.json", f"there's more than one account called {username!r}"
+            )
+        if not isinstance(account.get("password_hash"), str):
+            verification.problem(
+                "accounts.json", f"{username!r} doesn't have a password hash"
+            )
+        usernames.add(username)
+
+
+@integrity_check("students-changes.jsonl")
+def check_change_log(verification: Verification):
+    """Changes must be numbered with no gaps, since ChangeLog.changes_since() relies on
+    it
+    """
+    with verification.open("students-changes.jsonl") as file:
+        if file is None:
+            return
+        next_seq = 1
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                verification.problem(
+                    "students-changes.jsonl", f"line {line_number} isn't valid JSON"
+                )
+                continue
+            if not isinstance(entry, dict):
+                verification.problem(
+                    "students-changes.jsonl", f"line {line_number} isn't a JSON object"
+                )
+            elif "compacted_through" in entry and line_number == 1:
+                next_seq = entry["compacted_through"] + 1
+            elif entry.get("seq") != next_seq:
+                message = (
+                    f"line {line_number} should be change #{next_seq} "
+                    + f"(not {entry.get('seq')!r})"
+                )
+                verification.problem("students-changes.jsonl", message)
+                next_seq = (
+                    entry["seq"] + 1
+                    if isinstance(entry.get("seq"), int)
+                    else next_seq + 1
+                )
+            else:
+                if entry.get("op") not in CHANGE_OPERATIONS:
+                    verification.problem(
+                        "students-changes.jsonl",
+                        f"line {line_number} has an unknown operation "
+                        + f"({entry.get('op')!r})",
+                    )
+                next_seq += 1
+
+
+@integrity_check("audit.log", "audit-accounts.json")
+def check_audit_log(verification: Verification):
+    usernames = [
+        username for _, username in verification.json_array("audit-accounts.json")
+    ]
+    if not all(isinstance(username, str) for username in usernames):
+        verification.problem("audit-accounts.json", "should only contain usernames")
+    if len(set(usernames)) != len(usernames):
+        verification.problem(
+            "audit-accounts.json", "lists the same username more than once"
+        )
+
+    with verification.open("audit.log") as file:
+        if file is None:
+            return
+        if file.read(len(audit.HEADER)) != audit.HEADER:
+            verification.problem("audit.log", "isn't an audit log")
+            return
+        position = 0
+        while True:
+            block = file.read(audit.READ_BLOCK_SIZE)
+            whole_records_length = len(block) - len(block) % audit.RECORD.size
+            for _, _, account_number, action_number in audit.RECORD.iter_unpack(
+                block[:whole_records_length]
+            ):
+                if action_number >= len(audit.ACTIONS):
+                    verification.problem(
+                        "audit.log",
+                        f"event {position} has an unknown action ({action_number})",
+                    )
+                if account_number > len(usernames):
+                    verification.problem(
+                        "audit.log",
+                        f"event {position} is by an account that isn't listed",
+                    )
+                position += 1
+            if whole_records_length != len(block):
+                # Blocks are a multiple of the record size, so this can only happen at
+                # the end of the file
+                verification.problem(
+                    "audit.log",
+                    "ends with a half-written event (it's removed when loaded)",
+                )
+            if len(block) < audit.READ_BLOCK_SIZE:
+                return
+
+
+@dataclass
+class VerificationResult:
+    problems: list[str] = field(default_factory=list)
+    # The files that were checked, and the files that were skipped because they hadn't
+    # changed since they passed
+    checked: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    # The generation of each file that has passed a check (see the module docstring)
+    generations: dict[str, int] = field(default_factory=dict)
+
+
+@metrics.timed("integrity.verify")
+def verify(
+    storage: Storage, metadata_database: Optional[MetadataDatabase] = None, full=False
+) -> VerificationResult:
+    """Checks the database files, skipping the ones that haven't changed since they last
+    passed (unless full=True)
+
+    - Without a metadata database, every file is checked and nothing is remembered
+    """
+    result = VerificationResult()
+    passed: dict[str, dict] = {}
+
+    for filenames, check in CHECKS:
+        stored = {
+            filename: metadata_database.get(INTEGRITY_SECTION, filename)
+            if metadata_database
+            else None
+            for filename in filenames
+        }
+        # Checksums are much quicker to work out than doing the whole check again
+        if not full and all(
+            is_unchanged(stored[filename], file_checksum(storage, filename))
+            for filename in filenames
+        ):
+            result.skipped.extend(filenames)
+            result.generations.update(
+                {filename: stored[filename]["generation"] for filename in filenames}
+            )
+            continue
+
+        verification = Verification(storage, metadata_database)
+        check(verification)
+        verification.finish()
+        result.checked.extend(filenames)
+        result.problems.extend(verification.problems)
+        if verification.problems:
+            continue
+
+        for filename in filenames:
+            checksum = verification.checksums.get(filename) or file_checksum(
+                storage, filename
+            )
+            previous = stored[filename]
+            generation = previous["generation"] if previous else 0
+            if (
+                not is_unchanged(previous, checksum)
+                and checksum["checksum"] is not None
+            ):
+                generation += 1
+            passed[filename] = {**checksum, "generation": generation}
+            result.generations[filename] = generation
+
+    if metadata_database and passed:
+        with metadata_database.batch():
+            for filename, record in passed.items():
+                metadata_database.set(INTEGRITY_SECTION, filename, record)
+    metrics.increment("integrity.files_checked", len(result.checked))
+    return result
+
+
+def check_on_load(storage: Storage, metadata_database: MetadataDatabase):
+    """Checks the database files before they're loaded, raising IntegrityError if any
+    have problems
+    """
+    result = verify(storage, metadata_database)
+    if result.problems:
+        raise IntegrityError(result.problems)
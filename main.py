@@ -1,17 +1,144 @@
 """Mr Leeman's System: A pupil management system for Tree Road School
 This project is for Task 3 of the lesson 2.2.1 Programming fundamentals - validation"""
+import argparse
 import locale
+import os
+import sys
+from pathlib import Path
 
-from app import App
+import cli
+from app import App, AppPool
+from integrity import IntegrityError
+from metrics import metrics
+from profiling import Profiler
 from terminal_ui import TerminalUI
 
+
+def run_terminal_ui(application: App, arguments: argparse.Namespace):
+    profiling_mode = arguments.profile or Profiler.mode_from_environment()
+    profiler = Profiler(application.storage, profiling_mode) if profiling_mode else None
+    terminal_ui = TerminalUI(application, profiler=profiler)
+
+    # Execute the terminal UI
+    if profiler:
+        profiler.start()
+    try:
+        terminal_ui.show()
+    finally:
+        if profiler:
+            profiler.stop()
+            saved_files = profiler.save()
+            print(f"Saved profiling results: {', '.join(saved_files)}")
+
+
+def run_api_server(application: App, arguments: argparse.Namespace):
+    # Imported here so that the terminal UI doesn't have to load the server code
+    from api_server import ApiServer
+
+    if arguments.tenants:
+        pool = AppPool.for_directory(
+            arguments.tenants,
+            max_loaded=arguments.max_loaded,
+            idle_seconds=arguments.idle_minutes * 60
+            if arguments.idle_minutes
+            else None,
+        )
+        ApiServer(pool=pool).serve_forever(arguments.host, arguments.port)
+    else:
+        ApiServer(application).serve_forever(arguments.host, arguments.port)
+
+
+parser = argparse.ArgumentParser(
+    description="A pupil management system for Tree Road School"
+)
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="session",
+    choices=["session", "pages"],
+    help="Profile the program with cProfile and tracemalloc, saving the results to the "
+    + 'data directory. Use "--profile pages" to profile each page separately '
+    + "(can also be set with PMS_PROFILE=session|pages)",
+)
+parser.add_argument(
+    "--verify-on-load",
+    action="store_true",
+    help="Check the database files for damage before loading them, skipping files that "
+    + "haven't changed since they last passed (can also be set with "
+    + "PMS_VERIFY_ON_LOAD=1)",
+)
+parser.set_defaults(run=run_terminal_ui)
+subcommands = parser.add_subparsers(title="commands", metavar="COMMAND")
+
+serve_parser = subcommands.add_parser(
+    "serve", help="Serve an HTTP/JSON API instead of the terminal UI"
+)
+serve_parser.add_argument("--host", default="127.0.0.1")
+serve_parser.add_argument("--port", type=int, default=8080)
+serve_parser.add_argument(
+    "--tenants",
+    type=Path,
+    metavar="DIRECTORY",
+    help="Serve every school that has a data directory inside DIRECTORY, at "
+    + "/schools/<name>/...",
+)
+serve_parser.add_argument(
+    "--max-loaded",
+    type=int,
+    default=8,
+    help="How many schools to keep loaded at once (with --tenants)",
+)
+serve_parser.add_argument(
+    "--idle-minutes",
+    type=float,
+    help="Unload schools that haven't been used for this long (with --tenants)",
+)
+serve_parser.set_defaults(run=run_api_server)
+
+cli.add_commands(subcommands)
+
+arguments = parser.parse_args()
+
 # Use the current system locale for formatting dates/times
 # See https://bugs.python.org/issue29457#msg287086
 locale.setlocale(locale.LC_TIME, "")
 
-# Initialise the application and the user interface
-application = App()
-terminal_ui = TerminalUI(application)
+# Collect performance metrics if they've been enabled with the PMS_METRICS environment
+# variable
+metrics.configure_from_environment()
+
+if arguments.run is run_api_server and arguments.tenants:
+    # Each school is loaded from its own data directory by the pool, so the default one
+    # isn't needed
+    arguments.load_app = False
+
+if not getattr(arguments, "load_app", True):
+    # Commands like verify read the files directly, since loading them might be what
+    # fails
+    arguments.run(None, arguments)
+    sys.exit()
 
-# Execute the terminal UI
-terminal_ui.show()
\ No newline at end of file
+# Initialise the application and run the chosen interface
+try:
+    application = App(
+        verify_on_load=arguments.verify_on_load
+        or os.environ.get("PMS_VERIFY_ON_LOAD") == "1"
+    )
+except IntegrityError as error:
+    print(
+        "The database files have problems, so they haven't been loaded:",
+        file=sys.stderr,
+    )
+    for problem in error.problems:
+        print(f"- {problem}", file=sys.stderr)
+    print(
+        'Run "python main.py verify" to check them again once they\'ve been fixed.',
+        file=sys.stderr,
+    )
+    sys.exit(1)
+try:
+    arguments.run(application, arguments)
+finally:
+    application.audit_log.flush()
+    if metrics.enabled:
+        metrics.dump(application.storage)
@@ -1,9 +1,14 @@
 """A menu-driven interface based around the Menu and Option classes"""
 from __future__ import annotations
-from typing import TYPE_CHECKING, Callable, Literal, Optional
+import shutil
+import sys
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Iterable, Literal, Optional
 
 from colorama import Fore, Style
 
+from metrics import metrics
+
 if TYPE_CHECKING:
     from terminal_ui import Breadcrumbs, TerminalUI
 
@@ -20,8 +25,8 @@ def print_hint(hint: str):
     print(color(hint, Style.DIM))
 
 
-def info_line(field: str, data):
-    """Prints a piece of data with a label (on a single line)
+def format_info_line(field: str, data) -> str:
+    """Formats a piece of data with a label (on a single line)
     
     - The field is the label for the data
     - The data parameter is the actual data, e.g. a number or a string
@@ -29,13 +34,105 @@ def info_line(field: str, data):
     """
     label_part = f"{field.strip()}: "
     content_part = bold(str(data))
-    print(label_part + content_part)
+    return label_part + content_part
+
+
+def info_line(field: str, data):
+    """Prints a piece of data with a label (on a single line), see format_info_line()"""
+    print(format_info_line(field, data))
+
+
+# https://stackoverflow.com/a/50560686
+CLEAR_SCREEN = "\033[H\033[J"
 
 
 def clear_screen():
     """Clears the screen/terminal (preserving scrollback)"""
-    # https://stackoverflow.com/a/50560686
-    print("\033[H\033[J", end="")
+    print(CLEAR_SCREEN, end="")
+
+
+class Frame:
+    """Collects the lines of text for a screen, so that they can be written to the
+    terminal all at once
+
+    - Writing once per frame stops the screen visibly tearing on slow connections, e.g.
+      over SSH
+    """
+
+    def __init__(self):
+        self.parts: list[str] = []
+
+    def clear_screen(self):
+        self.parts.append(CLEAR_SCREEN)
+
+    def line(self, text: str = ""):
+        self.parts.append(text)
+        self.parts.append("\n")
+
+    def hint(self, hint: str):
+        """Adds a line of deemphasized text, see print_hint()"""
+        self.line(color(hint, Style.DIM))
+
+    def info_line(self, field: str, data):
+        """Adds a piece of data with a label, see format_info_line()"""
+        self.line(format_info_line(field, data))
+
+    def flush(self):
+        """Writes everything in the frame to the terminal in one go, then empties the
+        frame
+        """
+        sys.stdout.write("".join(self.parts))
+        sys.stdout.flush()
+        self.parts.clear()
+
+
+def page_size() -> Optional[int]:
+    """Works out how many lines of a long list fit on the screen at once
+
+    - Returns None if the output isn't going to a terminal (e.g. it's redirected to a
+      file), in which case the output shouldn't be split into pages
+    """
+    if not sys.stdout.isatty():
+        return None
+    # Leave space for the prompt and a bit of context
+    return max(shutil.get_terminal_size().lines - 3, 5)
+
+
+def show_paginated(lines: Iterable[str], total: Optional[int] = None):
+    """Prints a long list of lines one screen at a time, so that printing thousands of
+    lines doesn't flood the terminal
+
+    - Each screen is written in a single write, and lines are only formatted when their
+      screen is shown
+    - Between screens, the user can press Enter to see more, or type "q" to stop
+    - total= is the number of lines, if it is known, to be shown in the prompt
+    """
+    lines_per_page = page_size()
+    remaining_lines = iter(lines)
+    shown_count = 0
+    frame = Frame()
+
+    while True:
+        # With no page size, islice() takes every line at once
+        page_lines = list(islice(remaining_lines, lines_per_page))
+        for line in page_lines:
+            frame.line(line)
+        shown_count += len(page_lines)
+        frame.flush()
+
+        if lines_per_page is None or len(page_lines) < lines_per_page:
+            return
+        if total is not None and shown_count >= total:
+            return
+
+        progress_part = (
+            f"Shown {shown_count} of {total}. " if total else f"Shown {shown_count}. "
+        )
+        answer = wait_for_enter_key(
+            progress_part + "Press Enter for more, or type q to stop..."
+        )
+        if answer.strip().lower() == "q":
+            return
 
 
 def wait_for_enter_key(text = "Press Enter to continue..."):
@@ -56,33 +153,32 @@ def color(string: str, color: str) -> str:
 def get_selection(max: int) -> Optional[int]:
     """Asks the user to pick a 1-indexed number up to (and including) `max`,
     returing it as zero-indexed."""
-    try:
-        raw_input = input("Pick an option: ")
-    except KeyboardInterrupt:
-        print(color("Cancelled!", Fore.RED))
-        return None
+    while True:
+        try:
+            raw_input = input("Pick an option: ")
+        except KeyboardInterrupt:
+            print(color("Cancelled!", Fore.RED))
+            return None
 
-    if not raw_input.isnumeric():
-        error_incorrect_input("Your selection must be a positive number!")
-        return get_selection(max)
-
-    selection = int(raw_input)
-    if selection < 0:
-        error_incorrect_input("Select a positive number!")
-        return get_selection(max)
-    if selection > max:
-        error_incorrect_input(
-            f"Selection out of bounds: Must be below {max+1}")
-        return get_selection(max)
-
-    # If they entered 0, we assume that they want to exit the selection
-    if selection == 0:
-        return None
+        if not raw_input.isnumeric():
+            error_incorrect_input("Your selection must be a positive number!")
+            continue
 
-    # Subtract one from the selection, since the user is given options that are
-    # indexed from 1, but we want them to be zero-indexed
-    selection -= 1
-    return selection
+        selection = int(raw_input)
+        if selection < 0:
+            error_incorrect_input("Select a positive number!")
+            continue
+        if selection > max:
+            error_incorrect_input(f"Selection out of bounds: Must be below {max + 1}")
+            continue
+
+        # If they entered 0, we assume that they want to exit the selection
+        if selection == 0:
+            return None
+
+        # Subtract one from the selection, since the user is given options that are
+        # indexed from 1, but we want them to be zero-indexed
+        return selection - 1
 
 
 class MenuItem:
@@ -101,16 +197,20 @@ class MenuItem:
         self.should_show = should_show
         self.description = description
 
-    def execute(self, ui: TerminalUI):
+    def execute(self, ui: TerminalUI, error_handling: Literal["restart", "return"] = "restart"):
         pass
 
 
-def page_callback_wrapper(callback):
-    """Runs the callback for a page until it returns a success code or raises an error"""
+def page_callback_wrapper(callback, ui: TerminalUI):
+    """Runs the callback for a page until it returns a success code or raises an error
+
+    - Callbacks can yield BackgroundTasks to do slow work without freezing the UI (see
+      background.py)
+    """
     result = 1
     while isinstance(result, int) and result > 0:
         # The callback returned a positive number, so it wants to be restarted
-        result = callback()
+        result = ui.background.run_page(callback)
 
 
 class Page(MenuItem):
@@ -132,77 +232,105 @@ class Page(MenuItem):
         self.breadcrumbs = None
 
     def execute(self, ui: TerminalUI, error_handling: Literal["restart", "return"] = "restart"):
-        try:
-            if self.clear_at_start:
-                clear_screen()
+        # Settings changed by the page are saved together, once the page has finished
+        with ui.app.settings_database.batch():
+            if ui.profiler:
+                # Attribute the time and memory used by this page to it
+                with ui.profiler.page_context(self.title):
+                    return self.run(ui, error_handling)
+            return self.run(ui, error_handling)
+
+    def run(
+        self, ui: TerminalUI, error_handling: Literal["restart", "return"] = "restart"
+    ):
+        """Runs the page, handling errors according to the error_handling parameter
+
+        - If the page is restarted after an error, it happens in a loop (rather than
+          recursively), so a page that keeps failing doesn't grow the stack
+        """
+        while True:
+            try:
+                self.before_foreward_navigation(ui)
 
-            self.before_foreward_navigation(ui)
+                # Actually run the page
+                page_callback_wrapper(self.callback, ui)
 
-            # Actually run the page
-            page_callback_wrapper(self.callback)
+                if self.pause_at_end:
+                    print()
+                    wait_for_enter_key()
 
-            if self.pause_at_end:
-                print()
-                wait_for_enter_key()
-
-            self.before_backward_navigation(ui)
-        except KeyboardInterrupt as error:
-            print(color("\n" + "Aborted", Fore.RED))
-            self.before_backward_navigation(ui)
-            raise error
-            
-        except Exception as error:
-            error_type = type(error).__name__
-            error_text = f"{error_type}: {error}"
-
-            print(color(f"Encountered an error while running '{self.title}'", Fore.RED))
-            print(color(error_text, Fore.RESET))
-
-            print()
-            action_part = "return to the previous screen" if error_handling == "return" else "try again"
-            inputted_text = wait_for_enter_key(f"Press Enter to {action_part}...")
-
-            # Hidden feature: Type "RAISE" at the prompt to re-raise the exception
-            if inputted_text.lower() == "raise":
+                self.before_backward_navigation(ui)
+                return
+            except KeyboardInterrupt as error:
+                print(color("\n" + "Aborted", Fore.RED))
+                self.before_backward_navigation(ui)
                 raise error
 
-            # Restart the page or go back to the previous page according to error_handling parameter
-            if error_handling == "restart":
+            except Exception as error:
+                error_type = type(error).__name__
+                error_text = f"{error_type}: {error}"
+
+                print(
+                    color(
+                        f"Encountered an error while running '{self.title}'", Fore.RED
+                    )
+                )
+                print(color(error_text, Fore.RESET))
+
+                print()
+                action_part = (
+                    "return to the previous screen"
+                    if error_handling == "return"
+                    else "try again"
+                )
+                inputted_text = wait_for_enter_key(f"Press Enter to {action_part}...")
+
+                # Hidden feature: Type "RAISE" at the prompt to re-raise the exception
+                if inputted_text.lower() == "raise":
+                    raise error
+
+                # Restart the page or go back to the previous page according to
+                # error_handling parameter
                 # TODO: Bail out and go back to previous page if there have been too many errors
                 # Future idea: Give the user a menu to chose what to do, e.g. go back, restart page, debug error
                 self.before_backward_navigation(ui)
-                return self.execute(ui, error_handling)
-            if error_handling == "return":
-                self.before_backward_navigation(ui)
-                return
-
+                if error_handling == "return":
+                    return
 
     def before_foreward_navigation(self, ui: TerminalUI):
         """Called just before the user "enters into" the page"""
         ui.breadcrumbs.push(self.title)
-        title_line = ui.breadcrumbs.to_formatted()
-        print(title_line)
+        frame = Frame()
+        if self.clear_at_start:
+            frame.clear_screen()
+        frame.line(ui.breadcrumbs.to_formatted())
+        frame.flush()
     
     def before_backward_navigation(self, ui: TerminalUI):
         """Called just before the user "exits out of" the page, i.e. after the callback has reutned"""
         ui.breadcrumbs.pop()
 
+
 class Submenu(MenuItem):
+    """A menu item that opens another menu, e.g. a list of reports"""
 
-    def execute(self, ui):
-        # FIXME update breadcrumbs here (probably)
-        menu = Menu(self.options, ui)
-        menu.show()
+    def execute(self, ui: TerminalUI, error_handling: Literal["restart", "return"] = "restart"):
+        Navigator(ui).open(self, error_handling=error_handling)
 
     def __init__(self,
                  label: str,
                  title: str,
                  options: list[MenuItem],
-                 should_show: Optional[Callable[[], bool]] = None):
-        super().__init__(label, should_show)
-        self.should_show = should_show
+                 should_show: Optional[Callable[[], bool]] = None,
+                 description: Optional[str] = None,
+                 loop = False):
+        """title: The name of the submenu, shown in the breadcrumbs while it is open
+        loop: If False, the submenu closes after one of its options has been used
+        """
+        super().__init__(label, should_show, description)
         self.options = options
         self.title = title
+        self.loop = loop
 
 
 class Menu:
@@ -213,76 +341,195 @@ class Menu:
                 return True
         return False
 
+    def visible_options(self) -> list[MenuItem]:
+        """Returns the options that should currently be shown in the menu
 
-    def show(self, loop=False, error_handling: Literal["restart", "return"] = "restart"):
-        """Shows the menu to the user. It displays a list of possible actions and lets the user pick one of them.
-        loop: Can be set to True to make the menu re-appear when the chosen action has completed.
-              Useful for the main menu of the app, so multiple actions can be performed in one session.
+        - The should_show functions are only called again once the app's state has
+          changed (e.g. someone has logged in/out or a database has been saved), as some
+          of them access the databases
         """
+        state_version = self.ui.app.state_version()
+        if (
+            self.visible_options_cache is not None
+            and self.visible_options_cache[0] == state_version
+        ):
+            return self.visible_options_cache[1]
 
         # Go through all the options and add the ones that should be shown
         relevant_options: list[MenuItem] = []
         for option in self.options:
-            if option.should_show is not None:
-                if option.should_show():
-                    relevant_options.append(option)
-            else:
+            if option.should_show is None or option.should_show():
                 relevant_options.append(option)
 
-        # Handle the case of no available options
-        if len(relevant_options) == 0:
-            print(color("No options available. Goodbye!", Fore.RED))
-            return
-        
-        print("AAA")
-        clear_screen()
+        self.visible_options_cache = (state_version, relevant_options)
+        return relevant_options
+
+    def render(self, relevant_options: list[MenuItem]):
+        """Shows the menu's options on the screen (all in one write)"""
+        frame = Frame()
+        frame.clear_screen()
 
         # If any of the items have descriptions, we add more padding (line breaks) to the menu
         # to keep it readable and to seperate out the options.
         use_extra_linebreaks = self.uses_descriptions()
 
-        print(self.ui.breadcrumbs.to_formatted())
+        frame.line(self.ui.breadcrumbs.to_formatted())
         if use_extra_linebreaks:
             # Padding between the breadcrumbs and the options
-            print()
+            frame.line()
 
-        # Print each option on its own line
+        # Add each option on its own line
         for i, option in enumerate(relevant_options):
             if use_extra_linebreaks and i > 0:
                 # Padding betweem each option
-                print()
+                frame.line()
 
             if option.description:
-                print_hint(option.description)
+                frame.hint(option.description)
 
-            print(f"{i+1}) {option.label}")
+            frame.line(f"{i + 1}) {option.label}")
 
         if use_extra_linebreaks:
             # Padding between options and selection input
-            print()
+            frame.line()
+
+        frame.flush()
+
+    def choose(self) -> Optional[MenuItem]:
+        """Shows the menu and asks the user to pick an option
+
+        - Returns None if the user chose to exit the menu, or there weren't any options
+          to pick
+        """
+        with metrics.timer("menu.render"):
+            relevant_options = self.visible_options()
+
+            # Handle the case of no available options
+            if len(relevant_options) == 0:
+                print(color("No options available. Goodbye!", Fore.RED))
+                return None
+
+            self.render(relevant_options)
 
         # Ask the user to select a option number
         selection = get_selection(len(relevant_options))
 
         if selection is None:
             # Exit the menu if the user entered "0" (to cancel the selection)
-            return
+            return None
 
         print()
+        return relevant_options[selection]
 
-        # Execute the callback for the selected option
-        selected_option = relevant_options[selection]
-        try:
-            selected_option.execute(ui=self.ui, error_handling=error_handling)
-        except KeyboardInterrupt:
-            # If the user cancels the page, treat it as if the page exited cleanly
-            pass
-
-        if not loop:
-            return
-
-        self.show(loop)
+    def show(self, loop=False, error_handling: Literal["restart", "return"] = "restart"):
+        """Shows the menu to the user. It displays a list of possible actions and lets the user pick one of them.
+        loop: Can be set to True to make the menu re-appear when the chosen action has completed.
+              Useful for the main menu of the app, so multiple actions can be performed in one session.
+        """
+        navigator = Navigator(self.ui)
+        navigator.push(self, loop=loop, error_handling=error_handling)
+        navigator.run()
 
     def __init__(self, options: list[MenuItem], ui: TerminalUI):
         self.options = options or []
         self.ui = ui
+        # The state version and options from the last time the should_show functions
+        # were checked
+        self.visible_options_cache: Optional[tuple[object, list[MenuItem]]] = None
+
+
+class NavigationEntry:
+    """A menu that is open in a Navigator"""
+
+    def __init__(
+        self,
+        menu: Menu,
+        loop: bool,
+        error_handling: Literal["restart", "return"],
+        title: Optional[str],
+    ):
+        self.menu = menu
+        self.loop = loop
+        self.error_handling: Literal["restart", "return"] = error_handling
+        # Only submenus add their title to the breadcrumbs
+        self.title = title
+        # Set once the menu should be closed, e.g. after its one choice has been made
+        # (when it doesn't loop)
+        self.finished = False
+
+
+class Navigator:
+    """Runs menus using an explicit stack of open menus, instead of each menu calling
+    the next one recursively
+
+    - Opening a submenu pushes it onto the stack, and exiting it pops it off again
+    - The stack only ever holds the menus that are currently open, so a long session
+      doesn't use more memory over time
+    """
+
+    def __init__(self, ui: TerminalUI):
+        self.ui = ui
+        self.stack: list[NavigationEntry] = []
+
+    def push(
+        self,
+        menu: Menu,
+        loop=False,
+        error_handling: Literal["restart", "return"] = "restart",
+        title: Optional[str] = None,
+    ):
+        if title:
+            self.ui.breadcrumbs.push(title)
+        self.stack.append(NavigationEntry(menu, loop, error_handling, title))
+
+    def pop(self):
+        entry = self.stack.pop()
+        if entry.title:
+            self.ui.breadcrumbs.pop()
+
+    def open(
+        self, submenu: Submenu, error_handling: Literal["restart", "return"] = "restart"
+    ):
+        """Opens a submenu and runs it until it's closed"""
+        self.push(
+            Menu(submenu.options, self.ui), submenu.loop, error_handling, submenu.title
+        )
+        self.run()
+
+    def run(self):
+        """Keeps showing the menu at the top of the stack until every menu has been
+        exited
+        """
+        while self.stack:
+            entry = self.stack[-1]
+            if entry.finished:
+                self.pop()
+                continue
+
+            selected_option = entry.menu.choose()
+
+            if selected_option is None:
+                self.pop()
+                continue
+
+            if isinstance(selected_option, Submenu):
+                # Exiting the submenu goes back to this menu, unless this menu only
+                # allows one choice
+                entry.finished = not entry.loop
+                self.push(
+                    Menu(selected_option.options, self.ui),
+                    selected_option.loop,
+                    entry.error_handling,
+                    selected_option.title,
+                )
+                continue
+
+            # Execute the callback for the selected option
+            try:
+                selected_option.execute(ui=self.ui, error_handling=entry.error_handling)
+            except KeyboardInterrupt:
+                # If the user cancels the page, treat it as if the page exited cleanly
+                pass
+
+            if not entry.loop:
+                entry.finished = True
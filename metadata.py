@@ -0,0 +1,23 @@
+"""Stores information about the other databases, rather than data shown to users"""
+from typing import Any
+
+from util import JSONDatabase, Storage
+
+
+class MetadataDatabase(JSONDatabase):
+    """A database of values grouped into sections, e.g. one section for each database
+    that needs to store metadata
+    """
+
+    def __init__(self, storage: Storage):
+        super().__init__("metadata.json", {}, storage=storage)
+
+    def get(self, section: str, key: str, default: Any = None) -> Any:
+        with self.lock.read():
+            return self.data.get(section, {}).get(key, default)
+
+    def set(self, section: str, key: str, value: Any):
+        with self.lock.write():
+            self.data.setdefault(section, {})[key] = value
+            self.save()
+        return value
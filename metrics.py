@@ -0,0 +1,170 @@
+"""Lightweight timers and counters for finding out where time is spent in the app
+
+Metrics are disabled by default, in which case instrumented functions only pay for one
+attribute check. They can be enabled by setting the PMS_METRICS environment variable to
+"json" or "prometheus", which also decides the format that they are saved in when the
+program exits.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+from contextlib import contextmanager
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Literal, Optional, TypeVar
+
+if TYPE_CHECKING:
+    from util import Storage
+
+MetricsFormat = Literal["json", "prometheus"]
+FunctionType = TypeVar("FunctionType", bound=Callable)
+
+
+class Timer:
+    """Keeps a running total of the time spent in a section of code"""
+
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.calls += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_seconds": self.total_seconds,
+            "mean_seconds": self.total_seconds / self.calls if self.calls else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+
+class Metrics:
+    """A collection of named timers and counters"""
+
+    ENVIRONMENT_VARIABLE = "PMS_METRICS"
+
+    def __init__(self):
+        self.enabled = False
+        self.format: MetricsFormat = "json"
+        self.timers: dict[str, Timer] = {}
+        self.counters: dict[str, int] = {}
+
+    def enable(self, format: MetricsFormat = "json"):
+        self.enabled = True
+        self.format = format
+
+    def configure_from_environment(self):
+        """Enables metrics if the PMS_METRICS environment variable is set to a supported
+        format
+
+        - "1" is treated the same as "json"
+        """
+        requested_format = os.environ.get(self.ENVIRONMENT_VARIABLE, "").strip().lower()
+        if requested_format in ("1", "json"):
+            self.enable("json")
+        elif requested_format == "prometheus":
+            self.enable("prometheus")
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+
+    def increment(self, name: str, amount: int = 1):
+        """Adds to the named counter (if metrics are enabled)"""
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_time(self, name: str, seconds: float):
+        """Adds a measurement to the named timer"""
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        timer.record(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Times the code inside the `with` block, for cases where the timed() decorator
+        doesn't fit
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, perf_counter() - started_at)
+
+    def timed(self, name: str) -> Callable[[FunctionType], FunctionType]:
+        """A decorator that times every call to the decorated function"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                started_at = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record_time(name, perf_counter() - started_at)
+
+            return wrapper
+
+        return decorator
+
+    def to_dict(self) -> dict:
+        return {
+            "timers": {
+                name: timer.to_dict() for name, timer in sorted(self.timers.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_prometheus(self) -> str:
+        """Formats the metrics using the Prometheus text exposition format"""
+
+        def metric_name(name: str) -> str:
+            return "pms_" + name.replace(".", "_").replace("-", "_")
+
+        lines = []
+        for name, timer in sorted(self.timers.items()):
+            base_name = metric_name(name)
+            lines.append(f"# TYPE {base_name}_seconds summary")
+            lines.append(f"{base_name}_seconds_count {timer.calls}")
+            lines.append(f"{base_name}_seconds_sum {timer.total_seconds}")
+            lines.append(f"# TYPE {base_name}_seconds_max gauge")
+            lines.append(f"{base_name}_seconds_max {timer.max_seconds}")
+        for name, value in sorted(self.counters.items()):
+            base_name = metric_name(name)
+            lines.append(f"# TYPE {base_name}_total counter")
+            lines.append(f"{base_name}_total {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, storage: Storage, format: Optional[MetricsFormat] = None) -> str:
+        """Saves the metrics to a file in the provided storage (e.g. the data directory)
+
+        - Returns the name of the file that was written
+        """
+        format = format or self.format
+        if format == "prometheus":
+            filename, contents = "metrics.prom", self.to_prometheus()
+        else:
+            filename, contents = "metrics.json", json.dumps(self.to_dict(), indent=2)
+
+        storage.write_bytes(filename, contents.encode("utf-8"))
+        return filename
+
+
+# The metrics for the whole process
+metrics = Metrics()
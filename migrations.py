@@ -0,0 +1,272 @@
+"""Versioned changes to the format of the records in the database files, e.g. fixing how
+a field is stored
+
+- Each database file has a schema version, which is kept in the metadata database (0 if
+  it's never been migrated)
+- A migration is a function that changes one record (e.g. one student) into the new
+  format. Migrations must give the same result if they're run on a record that's already
+  in the new format.
+- Pending migrations are run when the app starts, before the databases are loaded.
+  `python main.py migrate` runs them without opening the terminal UI, and shows each
+  file's schema version.
+- Files that are a list of records (e.g. students and accounts) are migrated one record
+  at a time, reading the old file and writing the new file a bit at a time, so the whole
+  file never has to be in memory twice. Progress is saved regularly, so an interrupted
+  migration carries on where it left off.
+"""
+from __future__ import annotations
+
+import io
+import json
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Iterator
+
+from metrics import metrics
+from util import Storage
+
+if TYPE_CHECKING:
+    from metadata import MetadataDatabase
+
+# The files that can have migrations
+MIGRATABLE_FILES = [
+    "students.json",
+    "students-archive.json",
+    "accounts.json",
+    "settings.json",
+]
+
+# How much of the old file is read at once, and how many records are written before
+# progress is saved
+READ_BLOCK_SIZE = 64 * 1024
+RECORDS_PER_BATCH = 1000
+
+# The whitespace allowed between JSON values (the json module's own pattern, which is
+# quicker to match than \s*)
+WHITESPACE_REGEX = json.decoder.WHITESPACE
+
+
+class Migration:
+    def __init__(
+        self,
+        filename: str,
+        version: int,
+        description: str,
+        transform: Callable[[Any], Any],
+    ):
+        self.filename = filename
+        self.version = version
+        self.description = description
+        self.transform = transform
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(filename: str, version: int, description: str):
+    """Registers a function that changes a record into the format for the provided
+    schema version
+    """
+
+    def decorator(transform: Callable[[Any], Any]):
+        MIGRATIONS.append(Migration(filename, version, description, transform))
+        return transform
+
+    return decorator
+
+
+@migration(
+    "students.json", 1, "Build full names from the normalised forename and surname"
+)
+@migration(
+    "students-archive.json",
+    1,
+    "Build full names from the normalised forename and surname",
+)
+def normalise_full_name(student: dict) -> dict:
+    # Students used to be given a full name made from their names as they were typed,
+    # e.g. "  jOHN smith" rather than "John Smith"
+    student["full_name"] = " ".join([student["forename"], student["surname"]])
+    return student
+
+
+def schema_version(metadata_database: MetadataDatabase, filename: str) -> int:
+    return metadata_database.get("schema_versions", filename, 0)
+
+
+def pending_migrations(
+    metadata_database: MetadataDatabase, filename: str
+) -> list[Migration]:
+    current_version = schema_version(metadata_database, filename)
+    return sorted(
+        (
+            migration
+            for migration in MIGRATIONS
+            if migration.filename == filename and migration.version > current_version
+        ),
+        key=lambda migration: migration.version,
+    )
+
+
+def iter_json_array(
+    stream: BinaryIO, block_size: int = READ_BLOCK_SIZE
+) -> Iterator[Any]:
+    """Yields each item in a JSON array, reading the file a block at a time rather than
+    all at once
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    end_of_file = False
+    started = False
+
+    while True:
+        position = WHITESPACE_REGEX.match(buffer, position).end()
+        if position == len(buffer):
+            if end_of_file:
+                raise ValueError("The JSON array ends too early")
+            more_text = text.read(block_size)
+            buffer, position, end_of_file = (
+                buffer[position:] + more_text,
+                0,
+                not more_text,
+            )
+            continue
+
+        character = buffer[position]
+        if not started:
+            if character != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            position += 1
+        elif character == "]":
+            return
+        elif character == ",":
+            position += 1
+        else:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item probably continues in the next block
+                if end_of_file:
+                    raise
+                more_text = text.read(block_size)
+                buffer, position, end_of_file = (
+                    buffer[position:] + more_text,
+                    0,
+                    not more_text,
+                )
+                continue
+            yield item
+
+
+def first_character(storage: Storage, filename: str) -> str:
+    with storage.open_for_reading(filename) as stream:
+        start = stream.read(READ_BLOCK_SIZE).lstrip()
+    return start[:1].decode("utf-8")
+
+
+def apply(migrations: list[Migration], record: Any) -> Any:
+    for migration in migrations:
+        record = migration.transform(record)
+    return record
+
+
+def migrate_array_file(storage: Storage, filename: str, migrations: list[Migration]):
+    """Migrates every record in a file that contains a JSON array, writing the new
+    version to a temporary file
+
+    - The temporary file only replaces the real file once every record has been migrated
+    - If a migration to the same version was interrupted, it carries on from the last
+      saved progress
+    """
+    temporary_filename = f"{filename}.migrating"
+    progress_filename = f"{filename}.migration-progress.json"
+    target_version = migrations[-1].version
+
+    records_done = 0
+    try:
+        progress = json.loads(storage.read_bytes(progress_filename))
+        if progress["version"] == target_version:
+            # Throw away anything that was written after the progress was last saved
+            storage.truncate(temporary_filename, progress["bytes_written"])
+            records_done = progress["records_done"]
+    except FileNotFoundError:
+        pass
+    if not records_done:
+        storage.write_bytes(temporary_filename, b"[")
+    bytes_written = 1 if not records_done else progress["bytes_written"]
+
+    def write_batch(batch: list[str]):
+        nonlocal bytes_written
+        # Separated in the same way as json.dumps(), so the file is the same as if the
+        # database had saved it
+        contents = (", " if records_done > len(batch) else "") + ", ".join(batch)
+        encoded_contents = contents.encode("utf-8")
+        storage.append_bytes(temporary_filename, encoded_contents)
+        bytes_written += len(encoded_contents)
+        storage.write_bytes(
+            progress_filename,
+            json.dumps(
+                {
+                    "version": target_version,
+                    "records_done": records_done,
+                    "bytes_written": bytes_written,
+                }
+            ).encode("utf-8"),
+        )
+
+    with storage.open_for_reading(filename) as stream:
+        batch = []
+        for index, record in enumerate(iter_json_array(stream)):
+            if index < records_done:
+                continue
+            batch.append(json.dumps(apply(migrations, record)))
+            records_done += 1
+            if len(batch) == RECORDS_PER_BATCH:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+
+    storage.append_bytes(temporary_filename, b"]")
+    storage.rename(temporary_filename, filename)
+    storage.delete(progress_filename)
+
+
+def migrate_file(
+    storage: Storage, metadata_database: MetadataDatabase, filename: str
+) -> list[Migration]:
+    """Runs the pending migrations for a file, returning the migrations that were run"""
+    migrations = pending_migrations(metadata_database, filename)
+    if not migrations:
+        return []
+    try:
+        is_array = first_character(storage, filename) == "["
+    except FileNotFoundError:
+        # The file will be created in the latest format, so it shouldn't be migrated
+        # next time
+        metadata_database.set("schema_versions", filename, migrations[-1].version)
+        return []
+
+    with metrics.timer(f"migrations.{filename}"):
+        if is_array:
+            migrate_array_file(storage, filename, migrations)
+        else:
+            # Other files (i.e. settings) are a single record, which is small enough to
+            # migrate in one go
+            record = json.loads(storage.read_bytes(filename))
+            storage.write_bytes(
+                filename, json.dumps(apply(migrations, record)).encode("utf-8")
+            )
+    metadata_database.set("schema_versions", filename, migrations[-1].version)
+    return migrations
+
+
+def run_pending(
+    storage: Storage, metadata_database: MetadataDatabase
+) -> list[Migration]:
+    """Runs every pending migration, returning the migrations that were run"""
+    applied_migrations = []
+    for filename in MIGRATABLE_FILES:
+        applied_migrations.extend(migrate_file(storage, metadata_database, filename))
+    return applied_migrations
@@ -1,6 +1,6 @@
 """Provides a guided introduction to the application, when it is first run."""
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 from inputs import yes_no
 
 from menu import Page, bold, clear_screen, page_callback_wrapper, wait_for_enter_key
@@ -17,10 +17,17 @@ class Onboarding:
 
         self.stage = self.app.settings_database.get("tui", "onboarding", "stage")
 
-    def set_stage(self, stage: str):
+    def set_stage(self, stage: Optional[str]):
         self.stage = stage
         self.app.settings_database.set("tui", "onboarding", "stage", value=stage)
 
+    def finish(self):
+        """Stops onboarding from showing on future runs"""
+        # Both settings are saved with a single write
+        with self.app.settings_database.batch():
+            self.set_stage(None)
+            self.app.settings_database.set("tui", "onboarding", "show", value=False)
+
     def ask_to_start_onboarding(self):
         clear_screen()
         print(f"Welcome to {bold(self.app.brand.APP_NAME)}!")
@@ -45,7 +52,7 @@ First, let's create an account. This identifies you as an individual, so you'll
 Create a new account for yourself by entering the required details at the prompts below."""
         )
         print()
-        page_callback_wrapper(self.ui.create_account)
+        page_callback_wrapper(self.ui.create_account, self.ui)
 
     def log_in(self):
         print()
@@ -56,7 +63,7 @@ Now that your account has been created, let's log in for the first time.
 Enter your username and password you just created at the prompts below."""
         )
         print()
-        page_callback_wrapper(self.ui.log_in)
+        page_callback_wrapper(self.ui.log_in, self.ui)
 
     def show(self):
         stages: dict[str, Page] = {
@@ -70,7 +77,8 @@ Enter your username and password you just created at the prompts below."""
             should_continue = self.ask_to_start_onboarding()
             if not should_continue:
                 # Prevent onboarding starting on future runs
-                self.app.settings_database.set("tui", "onboarding", "show", value=False)
+                self.finish()
+                self.ui.breadcrumbs.pop()
                 return
 
             # Start with account creation
@@ -90,5 +98,5 @@ Enter your username and password you just created at the prompts below."""
         # Onboarding is done!
         print()
         wait_for_enter_key("You're ready to go! Press Enter to view the main menu...")
-        self.app.settings_database.set("tui", "onboarding", "show", value=False)
+        self.finish()
         self.ui.breadcrumbs.pop()
@@ -0,0 +1,182 @@
+"""A profiling mode for finding out why the program is slow, using cProfile and
+tracemalloc
+
+- In "session" mode, the whole terminal UI session is profiled as one
+- In "pages" mode, each page is profiled separately, so costs can be attributed to the
+  page that caused them
+- When profiling stops, .pstats files (readable with the pstats module or tools like
+  snakeviz) and a report of the top memory allocations are saved to the data directory
+"""
+from __future__ import annotations
+
+import cProfile
+import marshal
+import os
+import pstats
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import TYPE_CHECKING, Literal, Optional
+
+import regex as re
+
+if TYPE_CHECKING:
+    from util import Storage
+
+ProfilingMode = Literal["session", "pages"]
+
+
+def slugify(text: str) -> str:
+    """Converts a page title into something that can safely be used in a filename"""
+    return re.sub(r"[^\w]+", "-", text.lower()).strip("-")
+
+
+class Profiler:
+    ENVIRONMENT_VARIABLE = "PMS_PROFILE"
+
+    def __init__(
+        self, storage: Storage, mode: ProfilingMode = "session", top_allocations=25
+    ):
+        self.storage = storage
+        self.mode = mode
+        self.top_allocations = top_allocations
+        self.started_at = datetime.now()
+
+        self.session_profile = cProfile.Profile()
+        # Used in "pages" mode: one profile per page title, and the stack of pages
+        # currently being executed
+        self.page_profiles: dict[str, cProfile.Profile] = {}
+        self.page_stack: list[cProfile.Profile] = []
+        # Also used in "pages" mode: how many times each page was shown, and the total
+        # change in memory (in bytes and blocks) at each line of code while it was
+        # shown. These are added up rather than kept for every visit, so they don't keep
+        # growing during a long session.
+        self.page_visits: Counter[str] = Counter()
+        self.page_allocation_sizes: dict[str, Counter[str]] = {}
+        self.page_allocation_counts: dict[str, Counter[str]] = {}
+
+    @classmethod
+    def mode_from_environment(cls) -> Optional[ProfilingMode]:
+        """Reads the profiling mode from the PMS_PROFILE environment variable, if it's
+        set
+
+        - "1" is treated the same as "session"
+        """
+        requested_mode = os.environ.get(cls.ENVIRONMENT_VARIABLE, "").strip().lower()
+        if requested_mode in ("1", "session"):
+            return "session"
+        if requested_mode == "pages":
+            return "pages"
+        return None
+
+    def start(self):
+        tracemalloc.start()
+        if self.mode == "session":
+            self.session_profile.enable()
+
+    def stop(self):
+        if self.mode == "session":
+            self.session_profile.disable()
+
+    @contextmanager
+    def page(self, title: str):
+        """Profiles the code inside the `with` block as part of the page with the
+        provided title
+
+        - Only the innermost page is profiled at any time, so nested pages aren't
+          counted twice
+        """
+        profile = self.page_profiles.setdefault(title, cProfile.Profile())
+        if self.page_stack:
+            self.page_stack[-1].disable()
+        self.page_stack.append(profile)
+        allocations_before = tracemalloc.take_snapshot()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.page_stack.pop()
+
+            allocation_changes = tracemalloc.take_snapshot().compare_to(
+                allocations_before, "lineno"
+            )
+            self.page_visits[title] += 1
+            sizes = self.page_allocation_sizes.setdefault(title, Counter())
+            counts = self.page_allocation_counts.setdefault(title, Counter())
+            for statistic in allocation_changes[: self.top_allocations]:
+                line_of_code = str(statistic.traceback[0])
+                sizes[line_of_code] += statistic.size_diff
+                counts[line_of_code] += statistic.count_diff
+
+            if self.page_stack:
+                self.page_stack[-1].enable()
+
+    def page_context(self, title: str):
+        """Returns a context manager for profiling a page, which does nothing unless in
+        "pages" mode
+        """
+        if self.mode != "pages":
+            return nullcontext()
+        return self.page(title)
+
+    def save_profile(self, profile: cProfile.Profile, filename: str):
+        """Saves a profile in the same format as pstats.Stats.dump_stats()"""
+        stats = pstats.Stats(profile)
+        self.storage.write_bytes(filename, marshal.dumps(stats.stats))  # type: ignore
+
+    def allocation_report(self) -> str:
+        """Lists the lines of code that are currently holding the most memory"""
+        lines = [f"Top {self.top_allocations} allocations at exit"]
+        snapshot = tracemalloc.take_snapshot()
+        for statistic in snapshot.statistics("lineno")[: self.top_allocations]:
+            lines.append(str(statistic))
+
+        for title, sizes in self.page_allocation_sizes.items():
+            counts = self.page_allocation_counts[title]
+            lines.append("")
+            lines.append(
+                f"Allocation changes while on page '{title}' "
+                + f"(shown {self.page_visits[title]} times)"
+            )
+            biggest_changes = sorted(
+                sizes, key=lambda line: abs(sizes[line]), reverse=True
+            )
+            for line_of_code in biggest_changes[: self.top_allocations]:
+                lines.append(
+                    f"{line_of_code}: size={sizes[line_of_code]:+} B, "
+                    + f"count={counts[line_of_code]:+}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> list[str]:
+        """Saves the profiles and the allocation report, returning the names of the
+        files that were written
+        """
+        file_prefix = f"profile-{self.started_at:%Y%m%d-%H%M%S}"
+        written_files = []
+
+        # Snapshot the allocations first, so that saving the profiles doesn't show up in
+        # the report
+        allocation_report = (
+            self.allocation_report() if tracemalloc.is_tracing() else None
+        )
+        tracemalloc.stop()
+
+        if self.mode == "session":
+            written_files.append(f"{file_prefix}.pstats")
+            self.save_profile(self.session_profile, written_files[-1])
+        for title, profile in self.page_profiles.items():
+            written_files.append(f"{file_prefix}-{slugify(title)}.pstats")
+            self.save_profile(profile, written_files[-1])
+
+        if allocation_report:
+            written_files.append(f"{file_prefix}-allocations.txt")
+            self.storage.write_bytes(
+                written_files[-1], allocation_report.encode("utf-8")
+            )
+
+        return written_files
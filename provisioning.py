@@ -0,0 +1,138 @@
+"""Creates lots of accounts at once from a CSV file, e.g. when setting up the accounts
+for every member of staff
+
+- The file has a "username" column and an optional "password" column. Accounts without a
+  password are given a randomly generated one, which is returned so it can be passed on
+  to the person the account is for.
+- Every row is checked before anything is created, using the same rules as the terminal
+  UI (see inputs.py)
+- Hashing passwords is slow on purpose, so they're hashed by several threads at once
+  (bcrypt doesn't hold the GIL while it's hashing), then every account is saved at once
+"""
+from __future__ import annotations
+
+import csv
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Optional, TextIO
+
+import inputs
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from accounts import AccountsDatabase
+
+# How many random bytes are in a generated password (it's about 1.3 characters per byte)
+GENERATED_PASSWORD_BYTES = 12
+
+
+class ProvisioningError(ValueError):
+    """Raised when some of the accounts to create are invalid (in which case none of
+    them are created)
+    """
+
+    def __init__(self, problems: list[str]):
+        super().__init__(
+            f"{len(problems)} account(s) can't be created, starting with: {problems[0]}"
+        )
+        self.problems = problems
+
+
+def read_accounts_csv(file: TextIO) -> list[dict]:
+    """Reads the rows of an accounts CSV file, as {"line": ..., "username": ...,
+    "password": ...} dictionaries
+    """
+    reader = csv.DictReader(file)
+    if not reader.fieldnames or "username" not in reader.fieldnames:
+        raise ProvisioningError(
+            ['The first line should list the columns, including "username"']
+        )
+    return [
+        {
+            "line": reader.line_num,
+            "username": row["username"] or "",
+            "password": row.get("password") or "",
+        }
+        for row in reader
+    ]
+
+
+def check_rows(rows: Iterable[dict], accounts_database: AccountsDatabase) -> list[str]:
+    """Returns the problems with the accounts to create, e.g. usernames that are invalid
+    or already taken
+    """
+    problems = []
+    existing_usernames = set(accounts_database.get_usernames())
+    usernames_in_file: dict[str, int] = {}
+    for row in rows:
+        username = inputs.normalise(row["username"])
+        problem = inputs.username_problem(username)
+        if problem:
+            problems.append(f"Line {row['line']}: {problem} (got {row['username']!r})")
+            continue
+
+        normalised_username = username.lower()
+        if normalised_username in existing_usernames:
+            problems.append(
+                f"Line {row['line']}: There's already an account with the username "
+                + f"{normalised_username}"
+            )
+        elif normalised_username in usernames_in_file:
+            problems.append(
+                f"Line {row['line']}: The username {normalised_username} "
+                + f"is also on line {usernames_in_file[normalised_username]}"
+            )
+        usernames_in_file.setdefault(normalised_username, row["line"])
+    return problems
+
+
+def generate_password() -> str:
+    return secrets.token_urlsafe(GENERATED_PASSWORD_BYTES)
+
+
+def hash_passwords(passwords: list[str], workers: Optional[int] = None) -> list[str]:
+    """Hashes every password (see inputs.password_to_hash()) using several threads,
+    keeping them in the same order
+
+    - By default, there's one thread for each CPU core
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [inputs.password_to_hash(password) for password in passwords]
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="hash-password"
+    ) as executor:
+        return list(executor.map(inputs.password_to_hash, passwords))
+
+
+@metrics.timed("provisioning.provision_accounts")
+def provision_accounts(
+    rows: list[dict], accounts_database: AccountsDatabase, workers: Optional[int] = None
+) -> list[tuple[str, Optional[str]]]:
+    """Creates an account for each row (see read_accounts_csv()), all at once
+
+    - Raises ProvisioningError (without creating any accounts) if any of the rows are
+      invalid
+    - Returns each (username, generated password) pair, where the password is None if
+      the row had its own
+    """
+    problems = check_rows(rows, accounts_database)
+    if problems:
+        raise ProvisioningError(problems)
+
+    usernames = [inputs.normalise(row["username"]).lower() for row in rows]
+    generated_passwords = [
+        None if row["password"] else generate_password() for row in rows
+    ]
+    passwords = [
+        row["password"] or generated
+        for row, generated in zip(rows, generated_passwords)
+    ]
+
+    password_hashes = hash_passwords(passwords, workers)
+    # If someone else took one of the usernames while the passwords were being hashed,
+    # this raises ValueError
+    accounts_database.add_accounts(list(zip(usernames, password_hashes)))
+    metrics.increment("provisioning.accounts_created", len(usernames))
+    return list(zip(usernames, generated_passwords))
@@ -0,0 +1,463 @@
+"""A small query layer over the students database, so reports don't each need their own
+loop
+
+Queries are built up from conditions, then planned and run, e.g.
+    Query(students_database).where_tutor_group("9A").where_surname_starts_with("S").order_by("birthday").run()
+
+- The planner looks at the conditions and picks the index that narrows the students down
+  the most (by ID, email address, name prefix, tutor group or birthday). If none of the
+  conditions can use an index, every student is scanned.
+- Query.explain() describes the plan that was picked, which helps to see why a query is
+  slow
+"""
+from __future__ import annotations
+
+import datetime
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from students import DerivedFields, StudentsDatabase
+
+# Sorts after every character, so it can be used to find the end of a range of strings
+# that share a prefix
+HIGHEST_CHARACTER = "\U0010ffff"
+
+
+class SortedIndex:
+    """Keeps student IDs sorted by a key (e.g. their case-folded surname), so ranges of
+    keys can be found quickly
+
+    - Entries are (key, student ID) tuples, so students that share a key are kept in ID
+      order
+    """
+
+    def __init__(self):
+        self.entries: list[tuple[Any, int]] = []
+
+    def rebuild(self, entries: Iterable[tuple[Any, int]]):
+        """Replaces every entry at once, which is much quicker than adding them one at a
+        time
+        """
+        self.entries = sorted(entries)
+
+    def add(self, key: Any, student_id: int):
+        insort(self.entries, (key, student_id))
+
+    def remove(self, key: Any, student_id: int):
+        position = bisect_left(self.entries, (key, student_id))
+        if position < len(self.entries) and self.entries[position] == (key, student_id):
+            del self.entries[position]
+
+    def range_positions(self, low: Any, high: Any) -> tuple[int, int]:
+        """Returns the start and end positions of the entries with keys from low to high
+        (inclusive)
+        """
+        start = bisect_left(self.entries, (low,))
+        end = bisect_right(self.entries, (high, float("inf")))
+        return start, end
+
+    def ids_in_range(self, low: Any, high: Any) -> Iterator[int]:
+        start, end = self.range_positions(low, high)
+        # Entries are looked up by position, since they might be read from a snapshot
+        # file (see the snapshot module)
+        return (self.entries[position][1] for position in range(start, end))
+
+    def count_in_range(self, low: Any, high: Any) -> int:
+        start, end = self.range_positions(low, high)
+        return end - start
+
+
+class Condition:
+    """Something that a student must match to be included in the results of a query"""
+
+    # The order that an index lookup returns the students in (e.g. "surname"), if it's
+    # useful for sorting
+    index_order: Optional[str] = None
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+    def matches(self, student: dict, derived_fields: DerivedFields) -> bool:
+        raise NotImplementedError
+
+    def estimate(self, _students_database: StudentsDatabase) -> Optional[int]:
+        """Returns how many students an index lookup would find, or None if there isn't
+        an index for it
+        """
+        return None
+
+    def lookup(self, students_database: StudentsDatabase) -> Iterable[dict]:
+        """Returns the students (or a few more) that could match, using an index"""
+        raise NotImplementedError
+
+
+class IdIs(Condition):
+    def __init__(self, student_id: int):
+        self.student_id = student_id
+
+    def describe(self):
+        return f"ID = {self.student_id}"
+
+    def matches(self, student, _derived_fields):
+        return student["id"] == self.student_id
+
+    def estimate(self, students_database):
+        return 1 if self.student_id in students_database.students_by_id else 0
+
+    def lookup(self, students_database):
+        student = students_database.students_by_id.get(self.student_id)
+        return [student] if student else []
+
+
+class EmailIs(Condition):
+    def __init__(self, email_address: str):
+        self.email_address = email_address
+
+    def describe(self):
+        return f"email address = {self.email_address}"
+
+    def matches(self, student, _derived_fields):
+        return student["school_email"] == self.email_address
+
+    def estimate(self, students_database):
+        return 1 if self.email_address in students_database.students_by_email else 0
+
+    def lookup(self, students_database):
+        student = students_database.students_by_email.get(self.email_address)
+        return [student] if student else []
+
+
+class TutorGroupIs(Condition):
+    def __init__(self, tutor_group: str):
+        self.tutor_group = tutor_group.strip().upper()
+
+    def describe(self):
+        return f"tutor group = {self.tutor_group}"
+
+    def matches(self, student, _derived_fields):
+        return student["tutor_group"] == self.tutor_group
+
+    def estimate(self, students_database):
+        return len(students_database.students_by_tutor_group.get(self.tutor_group, ()))
+
+    def lookup(self, students_database):
+        return students_database.students_by_tutor_group.get(
+            self.tutor_group, {}
+        ).values()
+
+
+class NameStartsWith(Condition):
+    """Matches students whose surname (or forename) starts with some text (any case)"""
+
+    def __init__(self, field: str, prefix: str):
+        self.field = field
+        self.prefix = prefix.casefold()
+        self.index_order = field
+
+    def describe(self):
+        return f"{self.field} starts with {self.prefix!r}"
+
+    def matches(self, _student, derived_fields):
+        casefolded_name = (
+            derived_fields.surname_casefolded
+            if self.field == "surname"
+            else derived_fields.forename_casefolded
+        )
+        return casefolded_name.startswith(self.prefix)
+
+    def index(self, students_database: StudentsDatabase) -> SortedIndex:
+        return (
+            students_database.surname_index
+            if self.field == "surname"
+            else students_database.forename_index
+        )
+
+    def estimate(self, students_database):
+        return self.index(students_database).count_in_range(
+            self.prefix, self.prefix + HIGHEST_CHARACTER
+        )
+
+    def lookup(self, students_database):
+        student_ids = self.index(students_database).ids_in_range(
+            self.prefix, self.prefix + HIGHEST_CHARACTER
+        )
+        return (
+            students_database.students_by_id[student_id] for student_id in student_ids
+        )
+
+
+class BirthdayWithinDays(Condition):
+    """Matches students whose next birthday is in the next few days (including today)"""
+
+    def __init__(self, days: int, today: datetime.date):
+        self.days = days
+        self.today = today
+
+    def describe(self):
+        return f"birthday within {self.days} days of {self.today.isoformat()}"
+
+    def matches(self, _student, derived_fields):
+        return (
+            derived_fields.next_birthday_ordinal(self.today) - self.today.toordinal()
+            <= self.days
+        )
+
+    def month_day_ranges(self) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+        """Returns the ranges of (month, day) birthdays to look up, in date order
+
+        - The range is split in two if it goes past the end of the year
+        - It's one day longer than needed, so 29 February birthdays are included in
+          non-leap years
+        """
+        if self.days + 1 >= 365:
+            # Every birthday is included
+            return [((1, 1), (12, 31))]
+        last_day = self.today + datetime.timedelta(days=self.days + 1)
+        start = (self.today.month, self.today.day)
+        end = (last_day.month, last_day.day)
+        if end < start:
+            return [(start, (12, 31)), ((1, 1), end)]
+        return [(start, end)]
+
+    def estimate(self, students_database):
+        return sum(
+            students_database.birthday_index.count_in_range(low, high)
+            for low, high in self.month_day_ranges()
+        )
+
+    def lookup(self, students_database):
+        for low, high in self.month_day_ranges():
+            for student_id in students_database.birthday_index.ids_in_range(low, high):
+                yield students_database.students_by_id[student_id]
+
+
+class Matches(Condition):
+    """Matches students using any function, e.g. Matches("lives in Leeds", lambda
+    student: ...)
+
+    - It can't use an index, so it's always checked by scanning
+    """
+
+    def __init__(self, description: str, function: Callable[[dict], bool]):
+        self.description = description
+        self.function = function
+
+    def describe(self):
+        return self.description
+
+    def matches(self, student, _derived_fields):
+        return self.function(student)
+
+
+class Plan:
+    """How a query will be run: where the students come from, and what's done to them
+    afterwards
+    """
+
+    def __init__(
+        self,
+        driving_condition: Optional[Condition],
+        estimated_rows: int,
+        needs_sort: bool,
+    ):
+        self.driving_condition = driving_condition
+        self.estimated_rows = estimated_rows
+        self.needs_sort = needs_sort
+
+
+class Query:
+    """A query over the students in a database, built up by chaining methods"""
+
+    # The fields that results can be sorted by, and how to get the value to sort by
+    SORT_KEYS: dict[str, Callable[[dict, DerivedFields, datetime.date], Any]] = {
+        "id": lambda student, _derived_fields, _today: student["id"],
+        "surname": lambda student, derived_fields, _today: (
+            derived_fields.surname_casefolded,
+            student["id"],
+        ),
+        "forename": lambda student, derived_fields, _today: (
+            derived_fields.forename_casefolded,
+            student["id"],
+        ),
+        "birthday": lambda student, derived_fields, _today: (
+            derived_fields.birth_date,
+            student["id"],
+        ),
+        "next_birthday": lambda student, derived_fields, today: (
+            derived_fields.next_birthday_ordinal(today),
+            student["id"],
+        ),
+        "tutor_group": lambda student, _derived_fields, _today: (
+            student["tutor_group"],
+            student["id"],
+        ),
+    }
+
+    def __init__(
+        self,
+        students_database: StudentsDatabase,
+        account: Optional[dict] = None,
+        today: Optional[datetime.date] = None,
+    ):
+        """account= is the account running the query (see
+        StudentsDatabase.get_students())
+        """
+        self.students_database = students_database
+        self.account = account
+        self.today = today or datetime.date.today()
+        self.conditions: list[Condition] = []
+        self.sort_field: Optional[str] = None
+        self.descending = False
+        self.row_limit: Optional[int] = None
+        self.fields: Optional[tuple[str, ...]] = None
+
+    def where(self, condition: Condition) -> Query:
+        self.conditions.append(condition)
+        return self
+
+    def where_id(self, student_id: int) -> Query:
+        return self.where(IdIs(student_id))
+
+    def where_email(self, email_address: str) -> Query:
+        return self.where(EmailIs(email_address))
+
+    def where_tutor_group(self, tutor_group: str) -> Query:
+        return self.where(TutorGroupIs(tutor_group))
+
+    def where_surname_starts_with(self, prefix: str) -> Query:
+        return self.where(NameStartsWith("surname", prefix))
+
+    def where_forename_starts_with(self, prefix: str) -> Query:
+        return self.where(NameStartsWith("forename", prefix))
+
+    def where_birthday_within_days(self, days: int) -> Query:
+        return self.where(BirthdayWithinDays(days, self.today))
+
+    def order_by(self, field: str, descending=False) -> Query:
+        if field not in self.SORT_KEYS:
+            raise ValueError(f"Can't sort by {field}")
+        self.sort_field = field
+        self.descending = descending
+        return self
+
+    def limit(self, row_limit: int) -> Query:
+        self.row_limit = row_limit
+        return self
+
+    def select(self, *fields: str) -> Query:
+        """Only include these fields of each student in the results (by default, every
+        field is included)
+
+        - Raises a ValueError if any of the fields aren't one of StudentsDatabase.FIELDS
+        """
+        unknown_fields = [
+            field for field in fields if field not in self.students_database.FIELDS
+        ]
+        if unknown_fields:
+            raise ValueError(
+                f"Can't select {', '.join(unknown_fields)} "
+                + f"(the fields are {', '.join(self.students_database.FIELDS)})"
+            )
+        self.fields = fields
+        return self
+
+    def plan(self) -> Plan:
+        """Picks the index that will find the fewest students, or a full scan if none of
+        the conditions have one
+        """
+        best_condition = None
+        best_estimate = len(self.students_database.data)
+        for condition in self.conditions:
+            estimate = condition.estimate(self.students_database)
+            if estimate is not None and (
+                best_condition is None or estimate < best_estimate
+            ):
+                best_condition = condition
+                best_estimate = estimate
+
+        # Results from an index are already in its order, so they don't need sorting
+        already_sorted = (
+            best_condition is not None
+            and best_condition.index_order is not None
+            and best_condition.index_order == self.sort_field
+            and not self.descending
+        )
+        needs_sort = self.sort_field is not None and not already_sorted
+        return Plan(best_condition, best_estimate, needs_sort)
+
+    def explain(self) -> str:
+        """Describes how the query will be run"""
+        with self.students_database.lock.read():
+            plan = self.plan()
+
+        if plan.driving_condition is None:
+            lines = [f"Full scan of {plan.estimated_rows} students"]
+        else:
+            lines = [
+                f"Index lookup: {plan.driving_condition.describe()} (about "
+                + f"{plan.estimated_rows} students)"
+            ]
+        for condition in self.conditions:
+            if condition is not plan.driving_condition:
+                lines.append(f"Filter: {condition.describe()}")
+        if plan.needs_sort:
+            lines.append(
+                f"Sort: {self.sort_field}{' (descending)' if self.descending else ''}"
+            )
+        elif self.sort_field is not None:
+            lines.append(f"Sort: {self.sort_field} (already in index order)")
+        if self.row_limit is not None:
+            lines.append(f"Limit: {self.row_limit}")
+        if self.fields is not None:
+            lines.append(f"Select: {', '.join(self.fields)}")
+        return "\n".join(lines)
+
+    def run(self) -> list[dict]:
+        if self.account is None and not self.students_database.app.signed_in():
+            # Users that aren't signed in don't get to access student data
+            return []
+
+        get_derived_fields = self.students_database.get_derived_fields
+        with self.students_database.lock.read():
+            plan = self.plan()
+            candidates = (
+                plan.driving_condition.lookup(self.students_database)
+                if plan.driving_condition
+                else self.students_database.data
+            )
+            # Every condition is checked (even the one used for the index), since some
+            # lookups find a few extra students
+            matching_students = (
+                student
+                for student in candidates
+                if all(
+                    condition.matches(student, get_derived_fields(student))
+                    for condition in self.conditions
+                )
+            )
+
+            if plan.needs_sort:
+                sort_key = self.SORT_KEYS[self.sort_field]
+
+                def key(student):
+                    return sort_key(student, get_derived_fields(student), self.today)
+
+                if self.row_limit is not None:
+                    choose = heapq.nlargest if self.descending else heapq.nsmallest
+                    results = choose(self.row_limit, matching_students, key=key)
+                else:
+                    results = sorted(
+                        matching_students, key=key, reverse=self.descending
+                    )
+            else:
+                # The students can be streamed, stopping as soon as there are enough
+                results = list(islice(matching_students, self.row_limit))
+
+        if self.fields is not None:
+            return [
+                {field: student[field] for field in self.fields} for student in results
+            ]
+        return results
@@ -1,83 +1,206 @@
 from __future__ import annotations
-from typing import Callable, TYPE_CHECKING
+from typing import Any, Callable, Generator, Iterable, Optional, TYPE_CHECKING
 from colorama import Style
+import analytics
+from analytics import CohortAnalytics
 from app import App
+from background import BackgroundTask
+from duplicates import DuplicateIndex
 from inputs import text
-from menu import Menu, Page, bold, clear_screen, color, wait_for_enter_key
+from menu import Menu, MenuItem, Page, bold, color, show_paginated
+from metrics import metrics
+from query import Query
+from students import DerivedFields, StudentsDatabase
 from datetime import date
 
 if TYPE_CHECKING:
     from terminal_ui import TerminalUI
 
-from util import iso_to_locale_string
+# A function that returns the derived fields of a student, e.g.
+# StudentsDatabase.get_derived_fields
+GetDerivedFields = Callable[[dict], DerivedFields]
+# Reports find their results in the background (see background.py), then show them
+ReportPage = Generator[BackgroundTask, Any, None]
 
 
-def print_report_item(index: int, main_text: str, *suffixes: str):
+def format_report_item(index: int, main_text: str, *suffixes: str) -> str:
     one_indexed_index = index + 1
     index_part = color(f"{one_indexed_index:3})", Style.DIM)
 
     suffix_part = color(" ".join(suffixes), Style.DIM) if suffixes else ""
-    print(" ".join([index_part, main_text, suffix_part]))
+    return " ".join([index_part, main_text, suffix_part])
 
 
-def upcoming_birthdays(students: list[dict]):
-    """A report of students' birthdays in the next 30 days"""
-    target_students = []
-    for student in students:
-        birthday = date.fromisoformat(student["birthday"])
-        birthday_this_year = birthday.replace(year=date.today().year)
+def upcoming_birthdays_query(
+    students_database: StudentsDatabase, account: Optional[dict] = None
+) -> Query:
+    """Finds the students whose birthdays are in the next 30 days, soonest first"""
+    return (
+        Query(students_database, account)
+        .where_birthday_within_days(30)
+        .order_by("next_birthday")
+    )
 
-        time_until_birthday = birthday_this_year - date.today()
-        # Lower bound of 0 to ensure birthday hasn't already passed
-        birthday_is_soon = 0 <= time_until_birthday.days <= 30
-        if birthday_is_soon:
-            target_students.append(student)
 
-    for i, student in enumerate(target_students):
-        birthday_string = iso_to_locale_string(student["birthday"])
-        print_report_item(i, birthday_string, student["full_name"])
+def surnames_starting_with_query(
+    students_database: StudentsDatabase,
+    target_substring: str,
+    account: Optional[dict] = None,
+) -> Query:
+    """Finds the students whose surname starts with the provided text
+    (case-insensitive), sorted by surname
+    """
+    return (
+        Query(students_database, account)
+        .where_surname_starts_with(target_substring)
+        .order_by("surname")
+    )
 
 
-def surnames_starting_with(students: list[dict]):
-    """Asks for a letter and prints a report of students with a surname beginning with it"""
-    target_substring = text("Include surnames that start with: ").lower()
+def forenames_starting_with_query(
+    students_database: StudentsDatabase,
+    target_substring: str,
+    account: Optional[dict] = None,
+) -> Query:
+    """Finds the students whose forename starts with the provided text
+    (case-insensitive), sorted by forename
+    """
+    return (
+        Query(students_database, account)
+        .where_forename_starts_with(target_substring)
+        .order_by("forename")
+    )
+
+
+def upcoming_birthday_lines(
+    target_students: list[dict], derived_fields: GetDerivedFields = DerivedFields
+) -> Iterable[str]:
+    return (
+        format_report_item(
+            i, derived_fields(student).birthday_string, student["full_name"]
+        )
+        for i, student in enumerate(target_students)
+    )
+
+
+def surname_lines(target_students: list[dict]) -> Iterable[str]:
+    # Format students' names as "Surname, Forename", since they're sorted by surname
+    return (
+        format_report_item(i, ", ".join([student["surname"], student["forename"]]))
+        for i, student in enumerate(target_students)
+    )
+
+
+def forename_lines(target_students: list[dict]) -> Iterable[str]:
+    # Format students' names as "Forename Surname", since they're sorted by forename
+    return (
+        format_report_item(i, " ".join([student["forename"], student["surname"]]))
+        for i, student in enumerate(target_students)
+    )
+
+
+def duplicate_lines(duplicates: list[tuple[dict, dict, list[str]]]) -> Iterable[str]:
+    return (
+        format_report_item(
+            i,
+            f"{student['full_name']} (#{student['id']}) and "
+            + f"{other_student['full_name']} (#{other_student['id']})",
+            f"same {', '.join(matching_details)}",
+        )
+        for i, (student, other_student, matching_details) in enumerate(duplicates)
+    )
+
 
-    # Case-insensitively get students whose surname startw with the inputted string
-    target_students = []
-    for student in students:
-        surname_matches = student["surname"].lower().startswith(
-            target_substring)
-        if surname_matches:
-            target_students.append(student)
+def upcoming_birthdays(students_database: StudentsDatabase) -> ReportPage:
+    """A report of students' birthdays in the next 30 days"""
+    target_students = yield BackgroundTask(
+        "Finding birthdays", upcoming_birthdays_query(students_database).run
+    )
+    show_paginated(
+        upcoming_birthday_lines(target_students, students_database.get_derived_fields),
+        total=len(target_students),
+    )
 
-    # Sort alphabetically by surname
-    target_students.sort(key=lambda student: student["surname"])
 
-    # Print students' names in the format "Surname, Forename", since we're sorting by surname
-    for i, student in enumerate(target_students):
-        formatted_name = ", ".join([student["surname"], student["forename"]])
-        print_report_item(i, formatted_name)
+def surnames_starting_with(students_database: StudentsDatabase) -> ReportPage:
+    """Asks for a letter and prints a report of students with a surname beginning with it"""
+    target_substring = text("Include surnames that start with: ")
+    target_students = yield BackgroundTask(
+        "Finding students",
+        surnames_starting_with_query(students_database, target_substring).run,
+    )
+    show_paginated(surname_lines(target_students), total=len(target_students))
 
 
-def forenames_starting_with(students: list[dict]):
+def forenames_starting_with(students_database: StudentsDatabase) -> ReportPage:
     """Asks for a letter and prints a report of students with a forename beginning with it"""
-    target_substring = text("Include forenames that start with: ").lower()
+    target_substring = text("Include forenames that start with: ")
+    target_students = yield BackgroundTask(
+        "Finding students",
+        forenames_starting_with_query(students_database, target_substring).run,
+    )
+    show_paginated(forename_lines(target_students), total=len(target_students))
+
+
+def likely_duplicates(students_database: StudentsDatabase) -> ReportPage:
+    """A report of pairs of students that are likely to have been registered twice"""
+    duplicates = yield BackgroundTask(
+        "Comparing students",
+        lambda: DuplicateIndex(students_database.get_students()).find_all_duplicates(),
+    )
+    show_paginated(duplicate_lines(duplicates), total=len(duplicates))
 
-    # Case-insensitively get students whose forename startw with the inputted string
-    target_students = []
-    for student in students:
-        forename_matches = student["forename"].lower().startswith(
-            target_substring)
-        if forename_matches:
-            target_students.append(student)
 
-    # Sort alphabetically by forename
-    target_students.sort(key=lambda student: student["forename"])
+def bar(count: int, largest_count: int, width: int = 40) -> str:
+    """Draws a horizontal bar for a bar chart, scaled so the largest count fills the
+    width
+    """
+    length = round(count / largest_count * width) if largest_count else 0
+    return "█" * length
+
+
+def age_distribution(cohort_analytics: CohortAnalytics) -> ReportPage:
+    """A report of how many students of each age are in each tutor group"""
+    distribution = yield BackgroundTask(
+        "Counting ages", cohort_analytics.age_distribution_by_tutor_group
+    )
+
+    report_lines = (
+        format_report_item(
+            i,
+            bold(tutor_group),
+            *(f"{age}: {count}" for age, count in age_counts.items()),
+        )
+        for i, (tutor_group, age_counts) in enumerate(distribution.items())
+    )
+    show_paginated(report_lines, total=len(distribution))
+
 
-    # Print students' names in the format "Forename Surname", since we're sorting by forename
-    for i, student in enumerate(target_students):
-        formatted_name = " ".join([student["forename"], student["surname"]])
-        print_report_item(i, formatted_name)
+def birthday_months(cohort_analytics: CohortAnalytics) -> ReportPage:
+    """A bar chart of how many students have a birthday in each month"""
+    histogram = yield BackgroundTask(
+        "Counting birthdays", cohort_analytics.birthday_month_histogram
+    )
+    largest_count = max(histogram)
+
+    report_lines = (
+        f"{date(2000, month + 1, 1).strftime('%b'):>4} {count:6} "
+        + f"{bar(count, largest_count)}"
+        for month, count in enumerate(histogram)
+    )
+    show_paginated(report_lines, total=len(histogram))
+
+
+def year_group_sizes(cohort_analytics: CohortAnalytics) -> ReportPage:
+    """A bar chart of how many students are in each year group"""
+    sizes = yield BackgroundTask("Counting students", cohort_analytics.year_group_sizes)
+    largest_count = max(sizes.values(), default=0)
+
+    report_lines = (
+        f"Year {year_group:>2} {count:6} {bar(count, largest_count)}"
+        for year_group, count in sizes.items()
+    )
+    show_paginated(report_lines, total=len(sizes))
 
 
 class ReportsMenu:
@@ -85,18 +208,47 @@ class ReportsMenu:
     def __init__(self, app: App, ui: TerminalUI):
         self.app = app
         self.ui = ui
+        # Only created if NumPy is installed
+        self._cohort_analytics: Optional[CohortAnalytics] = None
+
+    def cohort_analytics(self) -> CohortAnalytics:
+        if self._cohort_analytics is None:
+            self._cohort_analytics = CohortAnalytics(self.app.students_database)
+        return self._cohort_analytics
+
+    def analytics_option(
+        self,
+        title: str,
+        show_report: Callable[[CohortAnalytics], ReportPage],
+        description: str,
+    ):
+        """Like report_option(), but for reports from the analytics module, which are
+        hidden if NumPy isn't installed
+        """
+
+        def show_report_wrapper():
+            print()
+            with metrics.timer(f"reports.{show_report.__name__}"):
+                yield from show_report(self.cohort_analytics())
+
+        return Page(
+            title,
+            show_report_wrapper,
+            should_show=analytics.numpy_available,
+            description=description,
+        )
 
     def report_option(
         self,
         title: str,
-        show_report: Callable[[list[dict]], None],
+        show_report: Callable[[StudentsDatabase], ReportPage],
         description: str,
     ):
 
         def show_report_wrapper():
-            students = self.app.students_database.get_students()
             print()
-            show_report(students)
+            with metrics.timer(f"reports.{show_report.__name__}"):
+                yield from show_report(self.app.students_database)
 
         return Page(
             title,
@@ -104,34 +256,56 @@ class ReportsMenu:
             description=description,
         )
 
+    def options(self) -> list[MenuItem]:
+        return [
+            self.report_option(
+                "Upcoming birthdays",
+                upcoming_birthdays,
+                description="A list of students whose birthdays are in the next 30 "
+                + "days. This can be used to add upcoming birthdays to a noticeboard, "
+                + "or simply wish your students a happy birthday.",
+            ),
+            self.report_option(
+                "Surnames starting with...",
+                surnames_starting_with,
+                description="A list of students whose surnames begin with a letter you "
+                + "choose, sorted alphabetically. Can be used to decide who to let "
+                + "out of the classroom first, or as a last resort for taking the "
+                + "register.",
+            ),
+            self.report_option(
+                "Forenames starting with...",
+                forenames_starting_with,
+                description="A list of students whose forenames begin with a letter "
+                + "you choose, sorted alphabetically. Can be used as a more personal "
+                + "way to decide who to let out of the classroom first, or to find "
+                + "people with similar names that may accidentally be confused.",
+            ),
+            self.report_option(
+                "Likely duplicates",
+                likely_duplicates,
+                description="Pairs of students that have similar names and share a "
+                + "birthday or phone number. Use this to find students that were "
+                + "accidentally registered twice.",
+            ),
+            self.analytics_option(
+                "Ages in each tutor group",
+                age_distribution,
+                description="How many students of each age are in each tutor group.",
+            ),
+            self.analytics_option(
+                "Birthdays by month",
+                birthday_months,
+                description="A chart of how many students have their birthday in each "
+                + "month of the year.",
+            ),
+            self.analytics_option(
+                "Year group sizes",
+                year_group_sizes,
+                description="A chart of how many students are in each year group.",
+            ),
+        ]
+
     def show(self):
-        menu = Menu(
-            [
-                self.report_option(
-                    "Upcoming birthdays",
-                    upcoming_birthdays,
-                    description=
-                    "A list of students whose birthdays are in the next 30 days. "
-                    +
-                    "This can be used to add upcoming birthdays to a noticeboard, or simply wish your students a happy birthday.",
-                ),
-                self.report_option(
-                    "Surnames starting with...",
-                    surnames_starting_with,
-                    description=
-                    "A list of students whose surnames begin with a letter you choose, sorted alphabetically. "
-                    +
-                    "Can be used to decide who to let out of the classroom first, or as a last resort for taking the register.",
-                ),
-                self.report_option(
-                    "Forenames starting with...",
-                    forenames_starting_with,
-                    description=
-                    "A list of students whose forenames begin with a letter you choose, sorted alphabetically. "
-                    +
-                    "Can be used as a more personal way to decide who to let out of the classroom first, or to find people with similar names that may accidentally be confused.",
-                ),
-            ],
-            ui=self.ui
-        )
+        menu = Menu(self.options(), ui=self.ui)
         menu.show()
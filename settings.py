@@ -1,72 +1,122 @@
-from util import JSONDatabase, get_path_in_dictionary
+import copy
+from typing import Any
+from util import JSONDatabase, Storage
 
 
-class SettingsDatabase(JSONDatabase):
+class Setting:
+    """A setting that has been declared in the schema, with an accessor that's worked
+    out ahead of time
 
-    DEFAULT_SETTINGS = {
-        "tui": {
-            "onboarding": {
-                "show": True,
-                "stage": None
-            }
-        }
-    }
+    - path is the keys of the nested dictionaries that lead to the setting, e.g. ("tui",
+      "onboarding", "show")
+    - types is a tuple of the types that the value is allowed to be, e.g. (str,
+      type(None))
+    """
+
+    def __init__(self, path: tuple[str, ...], default: Any, types: tuple[type, ...]):
+        self.path = path
+        self.name = ".".join(path)
+        self.default = default
+        self.types = types
+        # The dictionaries that contain the setting, and the key of the setting inside
+        # the innermost one
+        self.parent_keys = path[:-1]
+        self.key = path[-1]
 
-    # A unique object used to represent the value of a setting that was not present in the database 
-    NOT_FOUND = object()
-
-    def __init__(self):
-        super().__init__("settings.json", self.DEFAULT_SETTINGS)
-    
-    def get_from_database(self, *path: str):
-        """Gets a value from the settings database, without filling defaults
-        
-        - Note that a default value may still be returned, as defaults are added to the database on the first run of the program.
-        - If the path isn't present in the database, the SettingsDatabase.NOT_FOUND object is returned
+    def get(self, data: dict) -> Any:
+        """Returns the saved value of the setting, or its default value if it hasn't
+        been saved
         """
-        # Stores the dictionary we're checking (with the setting somewhere inside), or the setting itself
-        matching_setting = self.data
-        
-        for path_item in path:
-            try:
-                matching_setting = matching_setting[path_item]
-            except KeyError:
-                # The setting at the specified path doesn't exist
-                return self.NOT_FOUND
-        
-        # Finished searching, so we must have the actual setting value now
-        return matching_setting
+        container = data
+        for key in self.parent_keys:
+            container = container.get(key)
+            if not isinstance(container, dict):
+                return self.default
+        return container.get(self.key, self.default)
 
+    def set(self, data: dict, value: Any) -> bool:
+        """Saves the value of the setting into the data, creating any dictionaries that
+        it's nested inside
 
-    def get(self, *path: str):
-        """Gets the value of a setting at the provided path
-        
-        - If the setting isn't currently present in the database, returns the default value for that setting
-        - If a default value doesn't exist, raises a KeyError
+        - Returns False if the setting already had that value, so nothing needed to be
+          changed
         """
-        saved_value = self.get_from_database(*path)
+        if not isinstance(value, self.types):
+            type_names = " or ".join(
+                allowed_type.__name__ for allowed_type in self.types
+            )
+            raise TypeError(
+                f"The {self.name} setting must be {type_names}, not "
+                + f"{type(value).__name__}"
+            )
+
+        container = data
+        for key in self.parent_keys:
+            container = container.setdefault(key, {})
+        if self.key in container and container[self.key] == value:
+            return False
+        container[self.key] = value
+        return True
+
+
+class SettingsDatabase(JSONDatabase):
+
+    # Every setting that can be stored, along with its default value and the types it's
+    # allowed to be
+    SCHEMA = {
+        "tui.onboarding.show": (True, (bool,)),
+        "tui.onboarding.stage": (None, (str, type(None))),
+    }
+
+    SETTINGS = {
+        tuple(name.split(".")): Setting(tuple(name.split(".")), default, types)
+        for name, (default, types) in SCHEMA.items()
+    }
+
+    DEFAULT_SETTINGS: dict = {}
+    for setting in SETTINGS.values():
+        setting.set(DEFAULT_SETTINGS, setting.default)
+    del setting
+
+    def __init__(self, storage: Storage):
+        # Copied, so that changing the settings of one database doesn't change the
+        # defaults of every other one
+        super().__init__(
+            "settings.json", copy.deepcopy(self.DEFAULT_SETTINGS), storage=storage
+        )
 
-        if saved_value is not self.NOT_FOUND:
-            return saved_value
+    def find_setting(self, path: tuple[str, ...]) -> Setting:
+        """Returns the declared setting at the provided path, which can be a tuple of
+        keys or a dotted name
 
+        - If the setting isn't in the schema, raises a KeyError
+        """
+        if len(path) == 1 and "." in path[0]:
+            path = tuple(path[0].split("."))
         try:
-            default_value = get_path_in_dictionary(self.DEFAULT_SETTINGS, *path)
+            return self.SETTINGS[path]
         except KeyError:
-            path_string = ".".join(path)
-            raise KeyError(f"Setting does not exist: {path_string}")
-        
-        return default_value
-        
+            raise KeyError(f"Setting does not exist: {'.'.join(path)}") from None
+
+    def get(self, *path: str):
+        """Gets the value of a setting at the provided path, e.g. get("tui",
+        "onboarding", "show") or get("tui.onboarding.show")
+
+        - If the setting isn't currently present in the database, returns the default value for that setting
+        - If the setting isn't in the schema, raises a KeyError
+        """
+        setting = self.find_setting(path)
+        with self.lock.read():
+            return setting.get(self.data)
+
     def set(self, *path: str, value):
-        # Stores the dictionary we're checking (with the target setting nested somewhere inside)
-        current_dictionary = self.data
-        while len(path) > 1:
-            current_dictionary = current_dictionary[path[0]]
-            path = path[1:]
-        
-        # No levels of nested dictionaries remain
-        key = path[0]
-        current_dictionary[key] = value
-
-        self.save()
-        return value
\ No newline at end of file
+        """Changes the value of a setting, saving it unless it already had that value
+
+        - Use SettingsDatabase.batch() to save several settings with a single write
+        - Raises a TypeError if the value isn't one of the types declared in the schema
+        """
+        setting = self.find_setting(path)
+        with self.lock.write():
+            if setting.set(self.data, value):
+                self.save()
+        return value
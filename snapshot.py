@@ -0,0 +1,477 @@
+"""A read-only snapshot of the students, in a binary format that can be memory-mapped
+
+Processes that only read the students (e.g. the batch report workers) can open the same
+snapshot file with mmap, so every process shares one copy of it through the operating
+system's page cache, rather than each one parsing students.json into its own Python
+objects.
+
+The file is laid out as:
+- HEADER, then the length of the directory and the directory itself (a small JSON object
+  with the number of students, where each of the sections below starts and the range of
+  each tutor group in the tutor group index)
+- The records: one fixed-width RECORD for each student, in the same order as
+  students.json. Any fields that aren't in StudentsDatabase.FIELDS are kept together as
+  a JSON object in the "extra" string.
+- The string heap: the UTF-8 text of every string in the records (each distinct string
+  is only stored once)
+- The indexes: arrays of record numbers, sorted by ID, email address, surname, forename,
+  birthday and tutor group
+
+Students are only turned into dictionaries when they're looked up, by reading straight
+from the mapped file through memoryviews. Snapshots are written for the computer they're
+used on, so numbers are in its byte order.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+
+from change_log import ChangeLog
+from duplicates import DuplicateIndex
+from metrics import metrics
+from query import SortedIndex
+from students import DerivedFields, StudentsDatabase
+from util import MemoryStorage, ReadWriteLock, Storage
+
+if TYPE_CHECKING:
+    from app import App
+
+SNAPSHOT_FILENAME = "students.snapshot"
+HEADER = b"PMSSNAP2"
+DIRECTORY_LENGTH = struct.Struct("=I")
+
+# The fields of a student, in the order they're stored in students.json
+STUDENT_FIELDS = tuple(StudentsDatabase.FIELDS)
+# The fields that are kept in the string heap, followed by the keys of the name indexes
+# and any other fields of the student (as a JSON object, or an empty string if there
+# aren't any)
+STRING_FIELDS = tuple(field for field in STUDENT_FIELDS if field != "id")
+HEAP_FIELDS = STRING_FIELDS + ("surname_casefolded", "forename_casefolded", "extra")
+# ID, birth month and day (the key of the birthday index), then the offset and length of
+# each string in the heap
+RECORD = struct.Struct("=IBB2x" + "II" * len(HEAP_FIELDS))
+ID = struct.Struct("=I")
+INDEXES = (
+    "by_id",
+    "by_email",
+    "by_surname",
+    "by_forename",
+    "by_birthday",
+    "by_tutor_group",
+)
+
+
+def align(buffer: bytearray, alignment=8):
+    """Pads the buffer, so the next section starts on a multiple of the alignment"""
+    buffer.extend(bytes(-len(buffer) % alignment))
+
+
+@metrics.timed("snapshot.write")
+def write_snapshot(
+    students_database: StudentsDatabase, storage: Storage, filename=SNAPSHOT_FILENAME
+) -> int:
+    """Writes a snapshot of the students to a file, returning how many students it
+    contains
+
+    - The file is replaced in one go, so processes that already have the old snapshot
+      open can carry on reading it
+    """
+    with students_database.lock.read():
+        students = list(students_database.data)
+        derived_fields = [
+            students_database.get_derived_fields(student) for student in students
+        ]
+        seq = students_database.change_log.last_seq()
+
+    heap = bytearray()
+    # Where each distinct string is in the heap, so repeated ones (like tutor groups)
+    # are only stored once
+    string_positions: dict[str, tuple[int, int]] = {}
+
+    def add_string(string: str) -> tuple[int, int]:
+        position = string_positions.get(string)
+        if position is None:
+            encoded = string.encode("utf-8")
+            position = string_positions[string] = (len(heap), len(encoded))
+            heap.extend(encoded)
+        return position
+
+    records = bytearray(RECORD.size * len(students))
+    for record_number, (student, fields) in enumerate(zip(students, derived_fields)):
+        extra_fields = {
+            field: value
+            for field, value in student.items()
+            if field not in STUDENT_FIELDS
+        }
+        strings = [student[field] for field in STRING_FIELDS] + [
+            fields.surname_casefolded,
+            fields.forename_casefolded,
+            json.dumps(extra_fields) if extra_fields else "",
+        ]
+        heap_positions = [number for string in strings for number in add_string(string)]
+        RECORD.pack_into(
+            records,
+            record_number * RECORD.size,
+            student["id"],
+            fields.birth_date.month,
+            fields.birth_date.day,
+            *heap_positions,
+        )
+
+    # Each index lists the record numbers in the order of its key (with the ID breaking
+    # ties, like SortedIndex)
+    index_keys: dict[str, Callable[[int], Any]] = {
+        "by_id": lambda n: students[n]["id"],
+        "by_email": lambda n: students[n]["school_email"],
+        "by_surname": lambda n: (
+            derived_fields[n].surname_casefolded,
+            students[n]["id"],
+        ),
+        "by_forename": lambda n: (
+            derived_fields[n].forename_casefolded,
+            students[n]["id"],
+        ),
+        "by_birthday": lambda n: (
+            derived_fields[n].birth_date.month,
+            derived_fields[n].birth_date.day,
+            students[n]["id"],
+        ),
+        "by_tutor_group": lambda n: (students[n]["tutor_group"], students[n]["id"]),
+    }
+    indexes = {
+        name: array("I", sorted(range(len(students)), key=key))
+        for name, key in index_keys.items()
+    }
+
+    tutor_groups: dict[str, list[int]] = {}
+    for position, record_number in enumerate(indexes["by_tutor_group"]):
+        tutor_group = students[record_number]["tutor_group"]
+        tutor_groups.setdefault(tutor_group, [position, position])[1] = position + 1
+
+    sections = [("records", records), ("heap", heap)] + [
+        (name, indexes[name].tobytes()) for name in INDEXES
+    ]
+    # Section offsets are from the end of the directory, so they don't depend on the
+    # directory's own length
+    section_offsets = {}
+    body = bytearray()
+    for name, section in sections:
+        align(body)
+        section_offsets[name] = [len(body), len(section)]
+        body.extend(section)
+    directory = {
+        "count": len(students),
+        "seq": seq,
+        "byteorder": sys.byteorder,
+        "tutor_groups": tutor_groups,
+        "sections": section_offsets,
+    }
+    contents = bytearray(HEADER)
+    directory_bytes = json.dumps(directory).encode("utf-8")
+    contents += DIRECTORY_LENGTH.pack(len(directory_bytes)) + directory_bytes
+    align(contents)
+    contents += body
+    storage.write_bytes(filename, bytes(contents))
+    metrics.increment("snapshot.bytes_written", len(contents))
+    return len(students)
+
+
+class StudentSnapshot:
+    """An open snapshot file, which reads students straight from the (memory-mapped)
+    file when they're looked up
+    """
+
+    def __init__(self, buffer):
+        """buffer= is the snapshot's contents (an mmap, or bytes)"""
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        if bytes(self.view[: len(HEADER)]) != HEADER:
+            raise ValueError("This file isn't a students snapshot")
+        (directory_length,) = DIRECTORY_LENGTH.unpack_from(self.view, len(HEADER))
+        directory_start = len(HEADER) + DIRECTORY_LENGTH.size
+        directory_end = directory_start + directory_length
+        directory = json.loads(bytes(self.view[directory_start:directory_end]))
+        body_start = directory_end + -directory_end % 8
+        if directory["byteorder"] != sys.byteorder:
+            raise ValueError(
+                "This snapshot was written on a computer with a different byte order"
+            )
+
+        self.count: int = directory["count"]
+        self.seq: int = directory["seq"]
+        self.sections = {
+            name: self.view[body_start + start : body_start + start + length]
+            for name, (start, length) in directory["sections"].items()
+        }
+        self.records = self.sections["records"]
+        self.heap = self.sections["heap"]
+        # Zero-copy views of the index arrays
+        self.indexes = {name: self.sections[name].cast("I") for name in INDEXES}
+        # The part of the tutor group index for each tutor group
+        self.tutor_group_indexes = {
+            tutor_group: self.indexes["by_tutor_group"][start:end]
+            for tutor_group, (start, end) in directory["tutor_groups"].items()
+        }
+
+    @classmethod
+    def open(cls, storage: Storage, filename=SNAPSHOT_FILENAME) -> StudentSnapshot:
+        """Opens a snapshot, memory-mapping it if it's on disk (snapshots in a
+        MemoryStorage are read into memory)
+        """
+        file_path = storage.get_file_path(filename)
+        if file_path is None:
+            return cls(storage.read_bytes(filename))
+        with open(file_path, "rb") as file:
+            # The mapping stays valid once the file is closed
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        # The views have to be released before the file can be unmapped
+        views = [
+            *self.tutor_group_indexes.values(),
+            *self.indexes.values(),
+            *self.sections.values(),
+            self.view,
+        ]
+        for view in views:
+            view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def string(self, record_number: int, field: str) -> str:
+        """Reads one of the strings in a record (see HEAP_FIELDS), without reading the
+        rest of the record
+        """
+        # Skips past the ID, birth month and day (8 bytes), then the (offset, length)
+        # pairs of the earlier fields
+        offset, length = struct.unpack_from(
+            "=II",
+            self.records,
+            record_number * RECORD.size + 8 + 8 * HEAP_FIELDS.index(field),
+        )
+        return str(self.heap[offset : offset + length], "utf-8")
+
+    def student_id(self, record_number: int) -> int:
+        return ID.unpack_from(self.records, record_number * RECORD.size)[0]
+
+    def birthday_key(self, record_number: int) -> tuple[int, int]:
+        """The student's birth month and day, which is the key of the birthday index"""
+        return tuple(
+            self.records[
+                record_number * RECORD.size + 4 : record_number * RECORD.size + 6
+            ]
+        )
+
+    def student(self, record_number: int) -> dict:
+        """Reads a whole record as a student's dictionary (in the same format as
+        students.json)
+        """
+        student_id, _month, _day, *heap_positions = RECORD.unpack_from(
+            self.records, record_number * RECORD.size
+        )
+        strings = iter(heap_positions)
+        student = {}
+        for field in STUDENT_FIELDS:
+            if field == "id":
+                student["id"] = student_id
+            else:
+                offset, length = next(strings), next(strings)
+                student[field] = str(self.heap[offset : offset + length], "utf-8")
+        # The last string holds any other fields (the name index keys before it aren't
+        # part of the student)
+        offset, length = heap_positions[-2:]
+        if length:
+            student.update(
+                json.loads(str(self.heap[offset : offset + length], "utf-8"))
+            )
+        return student
+
+
+class KeyView(Sequence):
+    """A list-like view of the keys of some records, in the order of an index, which can
+    be searched with bisect
+    """
+
+    def __init__(self, record_numbers: Sequence[int], key: Callable[[int], Any]):
+        self.record_numbers = record_numbers
+        self.key = key
+
+    def __len__(self):
+        return len(self.record_numbers)
+
+    def __getitem__(self, position):
+        return self.key(self.record_numbers[position])
+
+
+class SnapshotIndex(Mapping):
+    """A read-only dictionary of students, by a unique key (e.g. their ID), that looks
+    them up in a snapshot index
+
+    - Like the dictionaries in StudentsDatabase (e.g. students_by_id), so queries can
+      use it in the same way
+    """
+
+    def __init__(
+        self,
+        snapshot: StudentSnapshot,
+        record_numbers: Sequence[int],
+        key: Callable[[int], Any],
+    ):
+        self.snapshot = snapshot
+        self.record_numbers = record_numbers
+        self.keys_in_order = KeyView(record_numbers, key)
+
+    def __getitem__(self, key):
+        position = bisect_left(self.keys_in_order, key)
+        if position < len(self.keys_in_order) and self.keys_in_order[position] == key:
+            return self.snapshot.student(self.record_numbers[position])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        position = bisect_left(self.keys_in_order, key)
+        return (
+            position < len(self.keys_in_order) and self.keys_in_order[position] == key
+        )
+
+    def __iter__(self) -> Iterator:
+        return iter(self.keys_in_order)
+
+    def __len__(self):
+        return len(self.record_numbers)
+
+    def values(self):
+        # Quicker than the default, which looks up each key again
+        return (
+            self.snapshot.student(record_number)
+            for record_number in self.record_numbers
+        )
+
+
+class SnapshotStudents(Sequence):
+    """A read-only list of every student in a snapshot, in the same order as
+    students.json
+    """
+
+    def __init__(self, snapshot: StudentSnapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def __getitem__(self, position: int) -> dict:
+        if not -self.snapshot.count <= position < self.snapshot.count:
+            raise IndexError("student position out of range")
+        return self.snapshot.student(position % self.snapshot.count)
+
+    def copy(self) -> list[dict]:
+        return list(self)
+
+
+class SnapshotStudentsDatabase(StudentsDatabase):
+    """A read-only StudentsDatabase that serves lookups and reports from a snapshot,
+    without loading students.json
+
+    - Its indexes read from the snapshot's indexes, so queries use them just like they
+      would in a normal database
+    - Students can't be changed (doing so raises PermissionError)
+    - changes_since() reads the change log in the storage, so changes made since the
+      snapshot can still be synced
+    - app= can be None if every query is given an account, e.g. in the batch report
+      workers
+    """
+
+    def __init__(
+        self,
+        app: Optional[App],
+        snapshot: StudentSnapshot,
+        storage: Optional[Storage] = None,
+    ):
+        # JSONDatabase.__init__() isn't called, since that would load students.json
+        self.app = app
+        self.snapshot_file = snapshot
+        self.storage = storage if storage is not None else MemoryStorage()
+        self.filename = SNAPSHOT_FILENAME
+        self.version = 0
+        self.lock = ReadWriteLock()
+        self._batch_depth = 0
+        self._unsaved_changes = False
+        self._archive = None
+        self._archived_email_addresses = None
+
+        self.data = SnapshotStudents(snapshot)
+        indexes = snapshot.indexes
+        self.students_by_id = SnapshotIndex(
+            snapshot, indexes["by_id"], snapshot.student_id
+        )
+        self.students_by_email = SnapshotIndex(
+            snapshot, indexes["by_email"], lambda n: snapshot.string(n, "school_email")
+        )
+        self.students_by_tutor_group = {
+            tutor_group: SnapshotIndex(snapshot, record_numbers, snapshot.student_id)
+            for tutor_group, record_numbers in snapshot.tutor_group_indexes.items()
+        }
+        self.surname_index = self.snapshot_sorted_index(
+            "by_surname", lambda n: snapshot.string(n, "surname_casefolded")
+        )
+        self.forename_index = self.snapshot_sorted_index(
+            "by_forename", lambda n: snapshot.string(n, "forename_casefolded")
+        )
+        self.birthday_index = self.snapshot_sorted_index(
+            "by_birthday", snapshot.birthday_key
+        )
+        # Derived fields are worked out when they're needed, rather than being kept for
+        # every student
+        self.derived_fields: dict[int, DerivedFields] = {}
+        self.highest_id = (
+            snapshot.student_id(indexes["by_id"][-1]) if snapshot.count else 0
+        )
+        self.change_log = ChangeLog("students-changes.jsonl", self.storage)
+
+    @cached_property
+    def duplicate_index(self) -> DuplicateIndex:
+        """Built the first time it's needed, since it has to read every student"""
+        return DuplicateIndex(self.data)
+
+    @classmethod
+    def open(
+        cls, storage: Storage, filename=SNAPSHOT_FILENAME, app: Optional[App] = None
+    ) -> SnapshotStudentsDatabase:
+        return cls(app, StudentSnapshot.open(storage, filename), storage)
+
+    def snapshot_sorted_index(
+        self, name: str, key: Callable[[int], Any]
+    ) -> SortedIndex:
+        """A SortedIndex whose (key, student ID) entries are read from one of the
+        snapshot's indexes
+        """
+        snapshot = self.snapshot_file
+        index = SortedIndex()
+        index.entries = KeyView(
+            snapshot.indexes[name], lambda n: (key(n), snapshot.student_id(n))
+        )
+        return index
+
+    def save(self):
+        raise PermissionError("A read-only snapshot can't be saved")
+
+    def add_student(self, *_args, **_kwargs):
+        raise PermissionError("Students can't be registered in a read-only snapshot")
+
+    def update_student(self, _id: int, **_changes):
+        raise PermissionError("Students can't be changed in a read-only snapshot")
+
+    def archive_student(self, _id: int):
+        raise PermissionError("Students can't be archived in a read-only snapshot")
+
+    def purge_student(self, _id: int):
+        raise PermissionError("Students can't be purged in a read-only snapshot")
+
+    def snapshot(self) -> tuple[int, list[dict]]:
+        return self.snapshot_file.seq, self.data.copy()
@@ -1,20 +1,230 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Callable, Optional
 import datetime
+import locale
 from pathlib import Path
 from colorama import Style
-from menu import bold, color, info_line
-from util import JSONDatabase, iso_to_locale_string
+from change_log import ChangeLog
+from duplicates import DuplicateIndex
+from menu import Frame, bold, color
+from metrics import metrics
+from query import SortedIndex
+from util import JSONDatabase, Storage
 
 if TYPE_CHECKING:
     from app import App
 
 
+def next_birthday(birth_date: datetime.date, today: datetime.date) -> datetime.date:
+    """Returns the date of the next birthday on or after today (people born on 29
+    February celebrate on the 28th)
+    """
+    for year in (today.year, today.year + 1):
+        try:
+            birthday = birth_date.replace(year=year)
+        except ValueError:
+            birthday = datetime.date(year, 2, 28)
+        if birthday >= today:
+            return birthday
+    raise AssertionError("A birthday always happens within a year")
+
+
+class DerivedFields:
+    """Values that are worked out from a student's details, e.g. their parsed birthday
+
+    - They're worked out once (rather than every time a report is shown) and kept in
+      memory, not saved
+    - Values that depend on today's date or the locale are worked out again when those
+      change
+    """
+
+    def __init__(self, student: dict):
+        self.birth_date = datetime.date.fromisoformat(student["birthday"])
+        self.surname_casefolded = student["surname"].casefold()
+        self.forename_casefolded = student["forename"].casefold()
+
+        self._today: Optional[datetime.date] = None
+        self._age = 0
+        self._next_birthday_ordinal = 0
+        self._locale: Optional[str] = None
+        self._birthday_string = ""
+
+    def _update_for_today(self, today: datetime.date):
+        if today == self._today:
+            return
+        self._today = today
+        self._age = today.year - self.birth_date.year - (
+            (today.month, today.day) < (self.birth_date.month, self.birth_date.day)
+        )
+        self._next_birthday_ordinal = next_birthday(self.birth_date, today).toordinal()
+
+    def age(self, today: Optional[datetime.date] = None) -> int:
+        """Returns the student's age (today, unless another date is provided)
+
+        - When working something out for lots of students, pass today= so the date is
+          only looked up once
+        """
+        self._update_for_today(today or datetime.date.today())
+        return self._age
+
+    def next_birthday_ordinal(self, today: Optional[datetime.date] = None) -> int:
+        """Returns the next birthday as a proleptic Gregorian ordinal (see
+        date.toordinal()), which is quick to compare
+        """
+        self._update_for_today(today or datetime.date.today())
+        return self._next_birthday_ordinal
+
+    @property
+    def birthday_string(self) -> str:
+        """The birthday formatted for the current locale"""
+        # Calling setlocale() with no locale just returns the current one
+        current_locale = locale.setlocale(locale.LC_TIME)
+        if current_locale != self._locale:
+            self._locale = current_locale
+            self._birthday_string = self.birth_date.strftime("%x")
+        return self._birthday_string
+
+
 class StudentsDatabase(JSONDatabase):
-    def __init__(self, app: App):
-        super().__init__("students.json", [], Path(".", "students-bootstrap.json"))
+    # The details that can be changed after a student has been registered
+    UPDATABLE_FIELDS = [
+        "surname",
+        "forename",
+        "birthday",
+        "tutor_group",
+        "home_address",
+        "home_phone",
+    ]
+    # Every field of a student, in the order they're stored in students.json
+    FIELDS = UPDATABLE_FIELDS + ["id", "school_email", "full_name"]
+
+    def __init__(self, app: App, storage: Storage):
         self.app = app
+        # Indexes for looking up students quickly, which are kept up to date as students
+        # are changed
+        self.students_by_id: dict[int, dict] = {}
+        self.students_by_email: dict[str, dict] = {}
+        self.students_by_tutor_group: dict[str, dict[int, dict]] = {}
+        # Student IDs sorted by their names and birthdays (see the query module)
+        self.surname_index = SortedIndex()
+        self.forename_index = SortedIndex()
+        self.birthday_index = SortedIndex()
+        self.duplicate_index = DuplicateIndex()
+        # Values worked out from each student's details, which are stored here rather
+        # than in the saved JSON
+        self.derived_fields: dict[int, DerivedFields] = {}
+        # The highest ID that has been given to a student who is still in this database
+        self.highest_id = 0
+
+        super().__init__(
+            "students.json",
+            [],
+            Path(".", "students-bootstrap.json"),
+            storage=storage,
+        )
+        # Records every change to the students, so other systems can sync just the
+        # changes
+        self.change_log = ChangeLog("students-changes.jsonl", self.storage)
+        # Students that have left are moved into a seperate file, which is only loaded
+        # when it's needed
+        self._archive: Optional[JSONDatabase] = None
+        self._archived_email_addresses: Optional[set[str]] = None
+
+    def data_replaced(self):
+        # Work out the indexes from scratch, since every student might have changed
+        self.students_by_id = {}
+        self.students_by_email = {}
+        self.students_by_tutor_group = {}
+        self.duplicate_index = DuplicateIndex()
+        self.derived_fields = {}
+        self.highest_id = 0
+        for student in self.data:
+            self.index_student(student, sorted_indexes=False)
+
+        # Sorting everything at once is much quicker than adding students to the sorted
+        # indexes one by one
+        for index, key in self.sorted_index_keys():
+            index.rebuild(
+                (key(self.derived_fields[student["id"]]), student["id"])
+                for student in self.data
+            )
 
+    def sorted_index_keys(
+        self,
+    ) -> list[tuple[SortedIndex, Callable[[DerivedFields], Any]]]:
+        """Returns each of the sorted indexes, along with the function that gets a
+        student's key in that index
+        """
+        return [
+            (
+                self.surname_index,
+                lambda derived_fields: derived_fields.surname_casefolded,
+            ),
+            (
+                self.forename_index,
+                lambda derived_fields: derived_fields.forename_casefolded,
+            ),
+            (
+                self.birthday_index,
+                lambda derived_fields: (
+                    derived_fields.birth_date.month,
+                    derived_fields.birth_date.day,
+                ),
+            ),
+        ]
+
+    def index_student(self, student: dict, sorted_indexes=True):
+        """Adds a student to the indexes (the write lock must be held)"""
+        self.students_by_id[student["id"]] = student
+        self.students_by_email[student["school_email"]] = student
+        self.students_by_tutor_group.setdefault(student["tutor_group"], {})[
+            student["id"]
+        ] = student
+        self.duplicate_index.add(student)
+        derived_fields = self.derived_fields[student["id"]] = DerivedFields(student)
+        self.highest_id = max(self.highest_id, student["id"])
+        if sorted_indexes:
+            for index, key in self.sorted_index_keys():
+                index.add(key(derived_fields), student["id"])
+
+    def unindex_student(self, student: dict):
+        """Removes a student from the indexes (the write lock must be held)"""
+        del self.students_by_id[student["id"]]
+        del self.students_by_email[student["school_email"]]
+        tutor_group = self.students_by_tutor_group[student["tutor_group"]]
+        del tutor_group[student["id"]]
+        if not tutor_group:
+            del self.students_by_tutor_group[student["tutor_group"]]
+        self.duplicate_index.remove(student)
+        derived_fields = self.derived_fields.pop(student["id"])
+        for index, key in self.sorted_index_keys():
+            index.remove(key(derived_fields), student["id"])
+
+    @property
+    def archive(self) -> JSONDatabase:
+        """The database of students that have been archived, e.g. because they've left
+        the school
+        """
+        if self._archive is None:
+            with self.lock.write():
+                if self._archive is None:
+                    self._archive = JSONDatabase(
+                        "students-archive.json", [], storage=self.storage
+                    )
+        return self._archive
+
+    def archived_email_addresses(self) -> set[str]:
+        """The email addresses of archived students, which can't be given to new
+        students
+        """
+        if self._archived_email_addresses is None:
+            with self.archive.lock.read():
+                self._archived_email_addresses = {
+                    student["school_email"] for student in self.archive.data
+                }
+        return self._archived_email_addresses
+
+    @metrics.timed("students.get_student")
     def get_student(
         self, id: Optional[int] = None, email_address: Optional[str] = None
     ) -> Optional[dict]:
@@ -24,40 +234,95 @@ class StudentsDatabase(JSONDatabase):
         - If more than one datapoint is provided, the ID takes precedence
         - Returns a dictionary of the student's data
         """
-        for student in self.data:
-            if id and student["id"] == id:
-                return student
-            if email_address and student["school_email"] == email_address:
-                return student
+        with self.lock.read():
+            if id and id in self.students_by_id:
+                return self.students_by_id[id]
+            if email_address:
+                return self.students_by_email.get(email_address)
         return None
 
     def next_id(self):
-        return len(self.data) + 1
+        """Returns the ID to give to the next student that is registered
+
+        - IDs are never reused, even if the student they were given to has been archived
+          or purged
+        """
+        with self.lock.read():
+            highest_removed_id = self.app.metadata_database.get(
+                "students", "highest_removed_id", 0
+            )
+            return max(self.highest_id, highest_removed_id) + 1
 
     def generate_email_address(self, surname, forename, discriminator: int = 0):
+        """Generates a school email address that isn't used by any other students
+
+        - To make sure that nobody else takes the address before it's used, hold the
+          write lock until it's been added
+        """
         domain = "tree-road.edu"
         surname_part = surname.lower()
         forename_part = forename.lower()[0]
-        # If the discriminator is 0, don't include it at all:
-        discriminator_part = str(discriminator) if discriminator else ""
 
-        possible_email = f"{surname_part}{forename_part}{discriminator_part}@{domain}"
+        while True:
+            # If the discriminator is 0, don't include it at all:
+            discriminator_part = str(discriminator) if discriminator else ""
+
+            possible_email = (
+                f"{surname_part}{forename_part}{discriminator_part}@{domain}"
+            )
+
+            # Check if the addresss is taken (including by students who have left)
+            is_taken = self.get_student(email_address=possible_email) or (
+                possible_email in self.archived_email_addresses()
+            )
+            if not is_taken:
+                return possible_email
 
-        # Check if the addresss is taken
-        if self.get_student(email_address=possible_email):
             # Increment the discriminator
             discriminator = discriminator + 1
-            return self.generate_email_address(surname, forename, discriminator)
 
-        return possible_email
+    @metrics.timed("students.find_possible_duplicates")
+    def find_possible_duplicates(
+        self, surname: str, forename: str, birthday: datetime.date, home_phone: str
+    ) -> list[tuple[dict, list[str]]]:
+        """Returns the students that a new student with these details would likely be a
+        duplicate of
+
+        - Returns a list of (existing student, details that match) tuples
+        """
+        new_student = {
+            "surname": surname,
+            "forename": forename,
+            "birthday": birthday.isoformat(),
+            "home_phone": home_phone,
+        }
+        with self.lock.read():
+            return self.duplicate_index.find_matches(new_student)
+
+    def get_derived_fields(self, student: dict) -> DerivedFields:
+        """Returns the values worked out from a student's details, e.g. their parsed
+        birthday
+        """
+        derived_fields = self.derived_fields.get(student["id"])
+        if derived_fields is None:
+            # The student isn't in the database (any more), so work them out from
+            # scratch
+            return DerivedFields(student)
+        return derived_fields
+
+    def get_students(self, account: Optional[dict] = None) -> list[dict]:
+        """Returns a list of all the students
 
-    def get_students(self) -> list[dict]:
-        """Returns a list of all the students"""
+        - account= is the account that is accessing the data, which defaults to the
+          account signed in to the app. This lets the API server check access for each
+          client rather than for the whole app.
+        """
         # TODO: In the future, we can only return students that are allowed to be accessed by the current user.
-        if not self.app.signed_in():
+        if account is None and not self.app.signed_in():
             # Users that aren't signed in don't get to access student data
             return []
-        return self.data.copy()
+        with self.lock.read():
+            return self.data.copy()
 
     def add_student(
         self,
@@ -71,38 +336,193 @@ class StudentsDatabase(JSONDatabase):
         """Creates a dictionary to repsresnt a new student and adds it to the database.
 
         - A unique numerical ID is generated for the student, as well as a unique school email address
-        - The provided surname and forename are normalised to title case
+        - The provided surname and forename are normalised to title case (as is the full
+          name made from them)
         - The provided tutor group is normalised to uppercase
         - The provided birthday is converted to a ISO-8601 timestamp
         - The other data (home address and phone number) is left as-is
         - Returns the directory of the student's data
         """
 
-        email_address = self.generate_email_address(surname, forename)
-        full_name = " ".join([forename, surname])
+        with self.lock.write():
+            # The ID and email address are generated and used while holding the write
+            # lock, so two students being added at the same time can't be given the same
+            # ones
+            email_address = self.generate_email_address(surname, forename)
+            normalised_surname = surname.strip().title()
+            normalised_forename = forename.strip().title()
 
-        new_student = {
-            "surname": surname.strip().title(),
-            "forename": forename.strip().title(),
-            "birthday": birthday.isoformat(),
-            "tutor_group": tutor_group.strip().upper(),
-            "home_address": home_address,
-            "home_phone": home_phone,
-            "id": self.next_id(),
-            "school_email": email_address,
-            "full_name": full_name,
-        }
-        self.data.append(new_student)
-        self.save()
+            new_student = {
+                "surname": normalised_surname,
+                "forename": normalised_forename,
+                "birthday": birthday.isoformat(),
+                "tutor_group": tutor_group.strip().upper(),
+                "home_address": home_address,
+                "home_phone": home_phone,
+                "id": self.next_id(),
+                "school_email": email_address,
+                "full_name": " ".join([normalised_forename, normalised_surname]),
+            }
+            self.data.append(new_student)
+            self.index_student(new_student)
+            self.save()
+            self.change_log.record("insert", new_student["id"], new_student)
         return new_student
 
+    def update_student(self, id: int, **changes) -> dict:
+        """Changes some of the details of a student, e.g. update_student(42,
+        tutor_group="10B")
+
+        - Only the fields in StudentsDatabase.UPDATABLE_FIELDS can be changed. The ID
+          and school email address stay the same, even if the student's name changes.
+        - The new details are normalised in the same way as add_student()
+        - Returns the dictionary of the student's (updated) data
+        """
+        unknown_fields = set(changes) - set(self.UPDATABLE_FIELDS)
+        if unknown_fields:
+            raise ValueError(
+                f"Can't update these fields: {', '.join(sorted(unknown_fields))}"
+            )
+
+        with self.lock.write():
+            student = self.get_student(id=id)
+            if not student:
+                raise LookupError(f"No student with the ID {id}")
+
+            # Build (and check) the new details before touching the indexes,
+            # so a bad change leaves the student exactly as they were
+            updated_student = dict(student)
+            for field in ("surname", "forename"):
+                if field in changes:
+                    updated_student[field] = changes[field].strip().title()
+            if "birthday" in changes:
+                updated_student["birthday"] = changes["birthday"].isoformat()
+            if "tutor_group" in changes:
+                updated_student["tutor_group"] = changes["tutor_group"].strip().upper()
+            for field in ("home_address", "home_phone"):
+                if field in changes:
+                    updated_student[field] = changes[field]
+            updated_student["full_name"] = " ".join(
+                [updated_student["forename"], updated_student["surname"]]
+            )
+            DerivedFields(updated_student)
+
+            self.unindex_student(student)
+            student.update(updated_student)
+            self.index_student(student)
+
+            self.save()
+            self.change_log.record("update", id, student)
+        return student
+
+    def remember_removed_id(self, id: int):
+        """Makes sure that the ID of a student who's been removed from this database
+        isn't given out again
+        """
+        highest_removed_id = self.app.metadata_database.get(
+            "students", "highest_removed_id", 0
+        )
+        if id > highest_removed_id:
+            self.app.metadata_database.set("students", "highest_removed_id", id)
+
+    def archive_student(self, id: int) -> dict:
+        """Moves a student (e.g. one that has left the school) out of the active
+        database and into the archive
+
+        - Archived students don't show up in lookups or reports, which keeps them fast
+        - Their ID and email address won't be reused
+        - Returns the dictionary of the archived student's data
+        """
+        with self.lock.write():
+            student = self.get_student(id=id)
+            if not student:
+                raise LookupError(f"No student with the ID {id}")
+
+            archived_student = {
+                **student,
+                "archived_on": datetime.date.today().isoformat(),
+            }
+            with self.archive.lock.write():
+                self.archive.data.append(archived_student)
+                self.archive.save()
+            self.archived_email_addresses().add(student["school_email"])
+            self.remember_removed_id(id)
+
+            self.unindex_student(student)
+            self.data.remove(student)
+            self.save()
+            self.change_log.record("archive", id, archived_student)
+        return archived_student
+
+    def get_archived_students(self) -> list[dict]:
+        with self.archive.lock.read():
+            return self.archive.data.copy()
+
+    def purge_student(self, id: int):
+        """Permanently deletes a student, whether they are active or archived
+
+        - This can't be undone, so should only be used when the data must be erased
+          (e.g. for data protection reasons)
+        - The student's details are also removed from their earlier entries in the
+          change log, which keep their sequence numbers (so consumers can still sync)
+          but no longer have a record
+        """
+        with self.lock.write():
+            student = self.get_student(id=id)
+            if student:
+                self.unindex_student(student)
+                self.data.remove(student)
+                self.save()
+            else:
+                with self.archive.lock.write():
+                    archive_position = next(
+                        (
+                            i
+                            for i, archived in enumerate(self.archive.data)
+                            if archived["id"] == id
+                        ),
+                        None,
+                    )
+                    if archive_position is None:
+                        raise LookupError(f"No student with the ID {id}")
+                    student = self.archive.data.pop(archive_position)
+                    self.archive.save()
+                self.archived_email_addresses().discard(student["school_email"])
+
+            self.remember_removed_id(id)
+            self.change_log.redact(id)
+            self.change_log.record("purge", id)
+
+    def changes_since(self, seq: int) -> list[dict]:
+        """Returns the changes made to the students since the change with the provided
+        sequence number
+
+        - See ChangeLog.changes_since() for details
+        """
+        return self.change_log.changes_since(seq)
+
+    def snapshot(self) -> tuple[int, list[dict]]:
+        """Returns every student, along with the sequence number of the latest change
+        that they include
+
+        - Systems that are syncing the students start with a snapshot, then ask for the
+          changes since its sequence number
+        """
+        with self.lock.read():
+            return self.change_log.last_seq(), self.data.copy()
+
     def display_student_info(self, student):
         formatted_id = color(f"(#{student['id']})", Style.DIM)
 
-        print(f"Details for {bold(student['full_name'])} {formatted_id}")
-        info_line("Surname", student["surname"])
-        info_line("Forename", student["forename"])
-        info_line("Birthday", iso_to_locale_string(student["birthday"]))
-        info_line("Tutor group", student["tutor_group"])
-        info_line("Home phone number", student["home_phone"])
-        info_line("School email address", student["school_email"])
+        frame = Frame()
+        frame.line(f"Details for {bold(student['full_name'])} {formatted_id}")
+        frame.info_line("Surname", student["surname"])
+        frame.info_line("Forename", student["forename"])
+        derived_fields = self.get_derived_fields(student)
+        frame.info_line(
+            "Birthday", f"{derived_fields.birthday_string} (age {derived_fields.age()})"
+        )
+        frame.info_line("Tutor group", student["tutor_group"])
+        frame.info_line("Home phone number", student["home_phone"])
+        frame.info_line("School email address", student["school_email"])
+        frame.flush()
@@ -1,14 +1,18 @@
 """The main code for the menu-driven, text-based interface."""
 
-from typing import Callable, Optional
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Optional
 from colorama import Fore, Style
-from colorama import init as init_colorama
+from colorama import just_fix_windows_console
 from app import App
+from background import BackgroundTask, BackgroundWorker
+from metrics import metrics
 
 import inputs
 from menu import (
     Menu,
     Page,
+    Submenu,
     bold,
     clear_screen,
     color,
@@ -20,6 +24,9 @@ from menu import (
 from onboarding import Onboarding
 from reports import ReportsMenu
 
+if TYPE_CHECKING:
+    from profiling import Profiler
+
 
 class Breadcrumbs:
     """Keeps track of the hierarchy of pages being viewed by the user"""
@@ -70,9 +77,33 @@ class Breadcrumbs:
 class TerminalUI:
     """A friendly, cross-platform interface to the pupil management system that runs in the terminal"""
 
-    def __init__(self, app: App) -> None:
+    def __init__(self, app: App, profiler: Optional[Profiler] = None) -> None:
         self.app = app
         self.breadcrumbs = Breadcrumbs()
+        # Slow work (like saving) is done here, while the UI shows a spinner. When
+        # profiling, it's done on this thread instead, since cProfile only sees the
+        # thread it was started on.
+        self.background = BackgroundWorker(inline=profiler is not None)
+        # Set when the program is run in profiling mode
+        self.profiler = profiler
+
+    def audited(
+        self, action: str, change_student: Callable[..., dict], *args, **kwargs
+    ) -> Callable[[], dict]:
+        """Returns a function that changes a student then records the change in the
+        audit log, for a BackgroundTask
+
+        - Both happen in the background task, so the change is still audited if the user
+          presses Ctrl+C meanwhile
+        """
+        account = self.app.current_account
+
+        def change_and_record() -> dict:
+            student = change_student(*args, **kwargs)
+            self.app.audit_log.record(action, student["id"], account)
+            return student
+
+        return change_and_record
 
     def log_in(self):
         target_username = inputs.text("Username: ", "Enter your username")
@@ -84,7 +115,9 @@ class TerminalUI:
             )
             return 1
 
-        is_authenticated = self.app.accounts_database.authenticate_user(target_username)
+        is_authenticated = yield from self.app.accounts_database.authenticate_user(
+            target_username
+        )
         if not is_authenticated:
             return
 
@@ -92,19 +125,19 @@ class TerminalUI:
         self.app.current_account = matching_user
 
     def ask_for_new_username(self, show_tip=True) -> str:
-        username = inputs.new_username("Create a username: ")
+        while True:
+            username = inputs.new_username("Create a username: ")
+
+            matching_user = self.app.accounts_database.get_account(username)
+            if not matching_user:
+                return username
 
-        matching_user = self.app.accounts_database.get_account(username)
-        if matching_user:
             error_incorrect_input(
                 f"There's already an account with the username {bold(username)}"
             )
             if show_tip:
                 print_hint("Tip: Pick another username or try logging in instead.")
-
-            return self.ask_for_new_username(show_tip=False)
-
-        return username
+                show_tip = False
 
     def create_account(self):
         print_hint("Usernames should be easy to type and unique to yourself.")
@@ -115,10 +148,20 @@ class TerminalUI:
         print_hint(
             "Note: You won't be able to see your password while you're typing it."
         )
-        password_hash = inputs.new_password("Set your password: ")
+        password = inputs.password(
+            "Set your password: ", "Enter a password to keep your account secure"
+        )
+        password_hash = yield BackgroundTask(
+            "Securing your password", inputs.password_to_hash, password
+        )
 
         print()
-        self.app.accounts_database.add_account(username, password_hash)
+        yield BackgroundTask(
+            "Creating your account",
+            self.app.accounts_database.add_account,
+            username,
+            password_hash,
+        )
         print(f"Created a new account called {bold(username)}")
 
     def register_student(self):
@@ -133,8 +176,33 @@ class TerminalUI:
         home_address = inputs.multiline("Home address: ")
         home_phone = inputs.phone_number("Home phone number: ")
 
-        student = self.app.students_database.add_student(
-            surname, forename, birthday, home_address, home_phone, tutor_group
+        possible_duplicates = self.app.students_database.find_possible_duplicates(
+            surname, forename, birthday, home_phone
+        )
+        if possible_duplicates:
+            print()
+            print(color("This student might already be registered:", Fore.YELLOW))
+            for existing_student, matching_details in possible_duplicates:
+                print(
+                    f"  {bold(existing_student['full_name'])} (ID "
+                    + f"#{existing_student['id']}) "
+                    + color(f"same {', '.join(matching_details)}", Style.DIM)
+                )
+            if not inputs.yes_no("Register them anyway? (yes/no) "):
+                return print("The student wasn't registered.")
+
+        student = yield BackgroundTask(
+            "Saving",
+            self.audited(
+                "register",
+                self.app.students_database.add_student,
+                surname,
+                forename,
+                birthday,
+                home_address,
+                home_phone,
+                tutor_group,
+            ),
         )
 
         # Print the details that we generated
@@ -152,31 +220,133 @@ class TerminalUI:
         print(f"Logged out of account {bold(old_username)}")
 
     def show_student_info(self):
+        matching_student = self.ask_for_student()
+        if not matching_student:
+            # Restart the page so they can try again
+            return 1
+
+        print()
+        self.app.audit_log.record(
+            "view", matching_student["id"], self.app.current_account
+        )
+        self.app.students_database.display_student_info(matching_student)
+
+    def ask_for_student(self) -> Optional[dict]:
+        """Asks for a student's ID, showing an error if there's no student with it"""
         print_hint(
             "Each student has a numerical ID that is used to uniquely identify them."
         )
         target_id = inputs.integer("Enter unique ID: ")
 
         matching_student = self.app.students_database.get_student(id=target_id)
-
         if not matching_student:
             error_incorrect_input(f"No students with the ID {bold(target_id)}")
-            return self.show_student_info()
+        return matching_student
+
+    def update_student(self):
+        """Asks which of a student's details should be changed, then saves the new
+        details
+        """
+        student = self.ask_for_student()
+        if not student:
+            # Restart the page so they can try again
+            return 1
 
         print()
-        self.app.students_database.display_student_info(matching_student)
+        self.app.audit_log.record("view", student["id"], self.app.current_account)
+        self.app.students_database.display_student_info(student)
+        print()
 
-    def view_reports(self):
-        reports_menu = ReportsMenu(self.app, ui=self)
-        reports_menu.show()
+        changes = {}
+        if inputs.yes_no("Change their name? "):
+            changes["forename"] = inputs.name("Forename: ")
+            changes["surname"] = inputs.name("Surname: ")
+        if inputs.yes_no("Change their birthday? "):
+            changes["birthday"] = inputs.date(
+                f"Birthday: {color('(YYYY-MM-DD)', Style.DIM)} "
+            )
+        if inputs.yes_no("Change their tutor group? "):
+            changes["tutor_group"] = inputs.tutor_group("Tutor group: ")
+        if inputs.yes_no("Change their home address? "):
+            changes["home_address"] = inputs.multiline("Home address: ")
+        if inputs.yes_no("Change their home phone number? "):
+            changes["home_phone"] = inputs.phone_number("Home phone number: ")
+
+        print()
+        if not changes:
+            return print("Nothing was changed.")
+
+        updated_student = yield BackgroundTask(
+            "Saving",
+            self.audited(
+                "update",
+                self.app.students_database.update_student,
+                student["id"],
+                **changes,
+            ),
+        )
+        print(f"Updated the details of {bold(updated_student['full_name'])}")
+        print_hint("Their ID and school email address haven't changed.")
+
+    def archive_student(self):
+        """Moves a student who has left into the archive, after asking to confirm"""
+        student = self.ask_for_student()
+        if not student:
+            # Restart the page so they can try again
+            return 1
+
+        print()
+        self.app.audit_log.record("view", student["id"], self.app.current_account)
+        self.app.students_database.display_student_info(student)
+        print()
+
+        if not inputs.yes_no(f"Archive {bold(student['full_name'])}? "):
+            return print("The student wasn't archived.")
+
+        yield BackgroundTask(
+            "Archiving",
+            self.audited(
+                "archive", self.app.students_database.archive_student, student["id"]
+            ),
+        )
+        print(f"Archived {bold(student['full_name'])}")
+        print_hint(
+            "They won't show up in reports, and their ID and email address "
+            + "won't be reused."
+        )
+
+    def show_metrics(self):
+        """A hidden debug page that shows the timers and counters collected so far"""
+        print_hint(
+            "Times are in milliseconds. "
+            + "Metrics are saved to the data directory on exit."
+        )
+        print()
+
+        collected_metrics = metrics.to_dict()
+        for name, timer in collected_metrics["timers"].items():
+            summary = (
+                f"{timer['calls']} calls, "
+                + f"{timer['mean_seconds'] * 1000:.2f} mean, "
+                + f"{timer['max_seconds'] * 1000:.2f} max, "
+                + f"{timer['total_seconds'] * 1000:.2f} total"
+            )
+            info_line(name, summary)
+        for name, value in collected_metrics["counters"].items():
+            info_line(name, value)
+
+        if not collected_metrics["timers"] and not collected_metrics["counters"]:
+            print("Nothing has been measured yet.")
 
     def trigger_exception(self):
         raise RuntimeError("Manually-triggered exception for debug purposes")
 
     def show(self):
         """The entrypoint for the menu-based UI"""
-        # Initialise the Colorama libary for terminal formatting utils
-        init_colorama()
+        # Make ANSI escape codes work on old Windows terminals. Unlike colorama's
+        # init(), this doesn't wrap stdout, so output isn't slowed down by being
+        # filtered through colorama on other platforms
+        just_fix_windows_console()
 
         self.breadcrumbs.push(self.app.brand.APP_NAME)
 
@@ -211,10 +381,20 @@ class TerminalUI:
                 lambda: self.app.students_database.get_students(),
             ),
             Page(
+                "Update a student's details",
+                self.update_student,
+                lambda: self.app.students_database.get_students(),
+            ),
+            Page(
+                "Archive a student who has left",
+                self.archive_student,
+                lambda: self.app.students_database.get_students(),
+            ),
+            Submenu(
+                "View student reports",
                 "View student reports",
-                self.view_reports,
+                ReportsMenu(self.app, ui=self).options(),
                 lambda: self.app.signed_in(),
-                pause_at_end=False,
             ),
             Page(
                 "Log out",
@@ -222,6 +402,11 @@ class TerminalUI:
                 lambda: self.app.signed_in(),
                 clear_at_start=False,
             ),
+            Page(
+                "Debug: Performance metrics",
+                self.show_metrics,
+                lambda: metrics.enabled,
+            ),
             #Page("Debug: Trigger an exception", self.trigger_exception),
         ]
 
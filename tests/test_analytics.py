@@ -0,0 +1,58 @@
+import json
+from collections import Counter
+from datetime import date
+
+import pytest
+
+from app import App
+from bench.roster import generate_roster
+from students import DerivedFields
+from util import MemoryStorage
+
+pytest.importorskip("numpy")
+from analytics import CohortAnalytics  # noqa: E402
+
+
+def make_analytics(roster: list[dict]) -> CohortAnalytics:
+    storage = MemoryStorage()
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    return CohortAnalytics(App(storage=storage).students_database)
+
+
+def test_statistics_match_counting_each_student():
+    today = date(2026, 3, 1)
+    roster = generate_roster(500, seed=2, today=today)
+    cohort_analytics = make_analytics(roster)
+
+    expected_ages = Counter(
+        (student["tutor_group"], DerivedFields(student).age(today))
+        for student in roster
+    )
+    distribution = cohort_analytics.age_distribution_by_tutor_group(today)
+    assert {
+        (tutor_group, age): count
+        for tutor_group, age_counts in distribution.items()
+        for age, count in age_counts.items()
+    } == dict(expected_ages)
+
+    expected_months = Counter(
+        date.fromisoformat(student["birthday"]).month for student in roster
+    )
+    assert cohort_analytics.birthday_month_histogram() == [
+        expected_months[month] for month in range(1, 13)
+    ]
+
+    expected_sizes = Counter(int(student["tutor_group"][:-1]) for student in roster)
+    assert cohort_analytics.year_group_sizes() == dict(sorted(expected_sizes.items()))
+
+
+def test_columns_are_rebuilt_when_the_database_changes():
+    cohort_analytics = make_analytics(generate_roster(10))
+    columns = cohort_analytics.columns()
+    assert cohort_analytics.columns() is columns
+
+    cohort_analytics.students_database.add_student(
+        "Smith", "John", date(2012, 1, 1), "1 Tree Road", "+44 1234 567890", "9A"
+    )
+    assert cohort_analytics.columns() is not columns
+    assert cohort_analytics.columns().size == 11
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import threading
+from http import HTTPStatus
+
+import pytest
+
+from api_server import ApiServer, HTTPError, Request
+from app import App
+from inputs import password_to_hash
+from util import MemoryStorage
+
+server_app = App(storage=MemoryStorage())
+server_app.accounts_database.add_account("reception", password_to_hash("hunter2"))
+server = ApiServer(server_app)
+
+
+def call(method: str, target: str, body=None, token=None):
+    headers = {"authorization": f"Bearer {token}"} if token else {}
+    encoded_body = json.dumps(body).encode("utf-8") if body is not None else b""
+    request = Request(method, target, headers, encoded_body)
+    return asyncio.run(server.dispatch(request))
+
+
+def log_in() -> str:
+    status, body = call(
+        "POST", "/login", {"username": "reception", "password": "hunter2"}
+    )
+    assert status == HTTPStatus.OK
+    return body["token"]
+
+
+def test_endpoints_require_login():
+    status, _body = call("GET", "/students/1")
+    assert status == HTTPStatus.UNAUTHORIZED
+
+    status, _body = call(
+        "POST", "/login", {"username": "reception", "password": "wrong"}
+    )
+    assert status == HTTPStatus.UNAUTHORIZED
+
+
+def test_register_and_look_up_student():
+    token = log_in()
+    new_student = {
+        "surname": "lovelace",
+        "forename": "ada",
+        "birthday": "2011-12-10",
+        "tutor_group": "9b",
+        "home_address": "1 Tree Road",
+        "home_phone": "01543 424203",
+    }
+    status, student = call("POST", "/students", new_student, token)
+    assert status == HTTPStatus.OK
+    assert student["full_name"] == "Ada Lovelace"
+    assert student["tutor_group"] == "9B"
+
+    status, found_student = call("GET", f"/students/{student['id']}", token=token)
+    assert status == HTTPStatus.OK
+    assert found_student["school_email"] == student["school_email"]
+
+    status, report = call("GET", "/reports/surnames?prefix=love", token=token)
+    assert [match["id"] for match in report["students"]] == [student["id"]]
+
+
+def test_invalid_student_is_rejected():
+    token = log_in()
+    status, body = call("POST", "/students", {"surname": "Smith"}, token)
+    assert status == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert "forename" in body["error"]
+
+
+def read_request(raw_request: bytes) -> Request:
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw_request)
+        reader.feed_eof()
+        return await server.read_request(reader)
+
+    return asyncio.run(read())
+
+
+def test_invalid_content_length_is_rejected():
+    for content_length in (b"lots", b"-5"):
+        with pytest.raises(HTTPError, match="Content-Length") as error:
+            read_request(
+                b"POST /login HTTP/1.1\r\nContent-Length: "
+                + content_length
+                + b"\r\n\r\n"
+            )
+        assert error.value.status == HTTPStatus.BAD_REQUEST
+
+
+def test_unexpected_errors_become_500s(monkeypatch):
+    token = log_in()
+    monkeypatch.setattr(server_app.students_database, "get_student", lambda **_: 1 / 0)
+    status, body = call("GET", "/students/1", token=token)
+    assert status == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert body == {"error": "Internal server error"}
+
+
+def test_lookups_wait_for_the_write_lock_off_the_event_loop():
+    token = log_in()
+    locked = threading.Event()
+    unlock = threading.Event()
+
+    def hold_write_lock():
+        with server_app.students_database.lock.write():
+            locked.set()
+            # Let go eventually, even if the lookup wrongly blocks the event loop
+            unlock.wait(timeout=1)
+
+    thread = threading.Thread(target=hold_write_lock)
+    thread.start()
+    locked.wait()
+
+    async def look_up_while_locked():
+        headers = {"authorization": f"Bearer {token}"}
+        lookup = asyncio.create_task(
+            server.dispatch(Request("GET", "/students/1", headers, b""))
+        )
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        await asyncio.sleep(0.05)
+        # The event loop carried on while the lookup waited for the lock
+        assert loop.time() - started_at < 0.5
+        assert not lookup.done()
+        unlock.set()
+        return await lookup
+
+    status, _body = asyncio.run(look_up_while_locked())
+    thread.join()
+    assert status == HTTPStatus.OK
+
+
+def test_tokens_expire():
+    expiring_server = ApiServer(server_app, session_seconds=0)
+    credentials = json.dumps({"username": "reception", "password": "hunter2"})
+    status, body = asyncio.run(
+        expiring_server.dispatch(
+            Request("POST", "/login", {}, credentials.encode("utf-8"))
+        )
+    )
+    assert status == HTTPStatus.OK
+
+    headers = {"authorization": f"Bearer {body['token']}"}
+    status, _body = asyncio.run(
+        expiring_server.dispatch(Request("GET", "/students/1", headers, b""))
+    )
+    assert status == HTTPStatus.UNAUTHORIZED
+    assert expiring_server.sessions == {}
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+import pytest
+
+from api_server import ApiServer, Request
+from app import AppPool
+from inputs import password_to_hash
+from util import MemoryStorage
+
+
+def make_pool(tenants: list[str], **options):
+    storages = {tenant: MemoryStorage() for tenant in tenants}
+    loads = []
+
+    def storage_for_tenant(tenant: str):
+        if tenant not in storages:
+            raise LookupError(tenant)
+        loads.append(tenant)
+        return storages[tenant]
+
+    return AppPool(storage_for_tenant, **options), loads
+
+
+def test_pool_keeps_recently_used_tenants_loaded():
+    pool, loads = make_pool(["north", "south", "east"], max_loaded=2)
+
+    north_app = pool.get("north")
+    assert pool.get("north") is north_app
+    pool.get("south")
+    pool.get("north")
+    # Loading a third tenant evicts the least recently used one
+    pool.get("east")
+    assert pool.loaded_tenants() == ["north", "east"]
+    assert loads == ["north", "south", "east"]
+
+    with pytest.raises(LookupError):
+        pool.get("west")
+    with pytest.raises(LookupError):
+        pool.get("../north")
+
+
+def test_pool_evicts_idle_tenants():
+    pool, _loads = make_pool(["north", "south"], idle_seconds=60)
+    pool.get("north")
+    pool.get("south")
+    last_used = pool.apps["south"][1]
+    assert pool.evict_idle(now=last_used + 30) == []
+    assert pool.evict_idle(now=last_used + 61) == ["north", "south"]
+
+
+def test_leased_tenants_are_not_evicted():
+    pool, _loads = make_pool(["north", "south", "east"], max_loaded=2, idle_seconds=60)
+    north_app = pool.get("north", lease=True)
+    pool.get("south")
+    pool.get("east")
+    # North is the least recently used, but it's still leased so south is evicted
+    # instead
+    assert pool.loaded_tenants() == ["north", "east"]
+    assert pool.evict_idle(now=pool.apps["east"][1] + 61) == ["east"]
+
+    pool.release("north")
+    pool.get("south")
+    pool.get("east")
+    assert pool.loaded_tenants() == ["south", "east"]
+    assert pool.get("north") is not north_app
+
+
+def test_server_routes_requests_to_each_tenant():
+    pool, _loads = make_pool(["north", "south"])
+    pool.get("north").accounts_database.add_account(
+        "reception", password_to_hash("hunter2")
+    )
+    server = ApiServer(pool=pool)
+
+    def call(method: str, target: str, body=None, token=None):
+        headers = {"authorization": f"Bearer {token}"} if token else {}
+        encoded_body = json.dumps(body).encode("utf-8") if body is not None else b""
+        return asyncio.run(
+            server.dispatch(Request(method, target, headers, encoded_body))
+        )
+
+    status, body = call(
+        "POST", "/schools/north/login", {"username": "reception", "password": "hunter2"}
+    )
+    assert status == HTTPStatus.OK
+    token = body["token"]
+
+    assert call("GET", "/schools/north/students/1", token=token)[0] == HTTPStatus.OK
+    # A token from one school can't be used for another
+    assert (
+        call("GET", "/schools/south/students/1", token=token)[0]
+        == HTTPStatus.UNAUTHORIZED
+    )
+    assert (
+        call("GET", "/schools/west/students/1", token=token)[0] == HTTPStatus.NOT_FOUND
+    )
+    assert call("GET", "/students/1", token=token)[0] == HTTPStatus.NOT_FOUND
+    # Every request hands its tenant back when it's finished
+    assert pool.leases == {}
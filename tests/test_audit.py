@@ -0,0 +1,66 @@
+import pytest
+
+from audit import RECORD, AuditLog
+from util import MemoryStorage
+
+TEACHER = {"username": "teacher"}
+OFFICE = {"username": "office"}
+
+
+def test_events_are_written_in_groups_and_found_by_student():
+    storage = MemoryStorage()
+    audit_log = AuditLog(storage, commit_interval=60)
+    audit_log.record("register", 42, OFFICE, timestamp=1_700_000_000)
+    audit_log.record("view", 7, TEACHER, timestamp=1_700_000_001)
+
+    # Nothing has been written yet, but the events can still be found
+    assert len(storage.read_bytes("audit.log")) == 8
+    assert [event["action"] for event in audit_log.events_for_student(42)] == [
+        "register"
+    ]
+
+    audit_log.flush()
+    audit_log.record("view", 42, TEACHER, timestamp=1_700_000_002)
+    audit_log.record("view", 42, None, timestamp=1_700_000_003)
+    assert len(storage.read_bytes("audit.log")) == 8 + 2 * RECORD.size
+
+    events = audit_log.events_for_student(42)
+    assert [(event["action"], event["username"]) for event in events] == [
+        ("register", "office"),
+        ("view", "teacher"),
+        ("view", None),
+    ]
+    assert events[0]["timestamp"].timestamp() == 1_700_000_000
+
+    audit_log.flush()
+    reopened_log = AuditLog(storage)
+    assert [event["username"] for event in reopened_log.events_for_student(42)] == [
+        "office",
+        "teacher",
+        None,
+    ]
+    assert len(list(reopened_log.events())) == 4
+
+
+def test_half_written_events_are_removed():
+    storage = MemoryStorage()
+    audit_log = AuditLog(storage)
+    audit_log.record("view", 1, TEACHER)
+    audit_log.flush()
+    storage.append_bytes("audit.log", b"\x01\x02\x03")
+
+    reopened_log = AuditLog(storage)
+    assert reopened_log.written_count == 1
+    reopened_log.record("update", 1, TEACHER)
+    reopened_log.flush()
+    assert [event["action"] for event in AuditLog(storage).events_for_student(1)] == [
+        "view",
+        "update",
+    ]
+
+
+def test_other_files_are_not_read_as_audit_logs():
+    storage = MemoryStorage()
+    storage.write_bytes("audit.log", b"[]")
+    with pytest.raises(ValueError):
+        AuditLog(storage)
@@ -0,0 +1,95 @@
+import threading
+from datetime import date
+
+import pytest
+
+from app import App
+from background import BackgroundTask, BackgroundWorker, drive, run_now
+from terminal_ui import TerminalUI
+from util import MemoryStorage
+
+
+def test_tasks_are_run_and_their_results_sent_back_to_the_page():
+    seen_results = []
+
+    def page():
+        seen_results.append((yield BackgroundTask("Adding", lambda a, b: a + b, 1, 2)))
+        seen_results.append((yield BackgroundTask("Joining", "-".join, ["a", "b"])))
+        return 1
+
+    assert BackgroundWorker().run_page(page) == 1
+    assert seen_results == [3, "a-b"]
+
+
+def test_task_exceptions_are_raised_at_the_yield():
+    def fail():
+        raise ValueError("That username is taken")
+
+    def page():
+        try:
+            yield BackgroundTask("Saving", fail)
+        except ValueError as error:
+            return str(error)
+
+    assert run_now(page()) == "That username is taken"
+
+
+def test_pages_without_tasks_work_as_before():
+    assert BackgroundWorker().run_page(lambda: 1) == 1
+    assert drive(None, BackgroundTask.run) is None
+
+
+def test_ctrl_c_stops_the_page():
+    closed = False
+
+    def page():
+        nonlocal closed
+        try:
+            yield BackgroundTask("Waiting", lambda: None)
+        finally:
+            closed = True
+
+    def interrupt(_task):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        drive(page(), interrupt)
+    assert closed
+
+
+def test_inline_worker_runs_tasks_on_the_calling_thread():
+    def page():
+        return (yield BackgroundTask("Checking", threading.current_thread))
+
+    assert BackgroundWorker(inline=True).run_page(page) is threading.current_thread()
+    assert BackgroundWorker().run_page(page) is not threading.current_thread()
+
+
+def test_changes_are_audited_even_if_the_page_is_interrupted():
+    app = App(storage=MemoryStorage())
+    app.current_account = {"username": "office"}
+    register = TerminalUI(app).audited(
+        "register",
+        app.students_database.add_student,
+        "Smith",
+        "Alex",
+        date(2011, 3, 4),
+        "1 Tree Road",
+        "+441234567890",
+        "8C",
+    )
+
+    def page():
+        yield BackgroundTask("Saving", register)
+
+    def run_then_interrupt(task):
+        # The user presses Ctrl+C while the student is being saved
+        task.run()
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        drive(page(), run_then_interrupt)
+    student = app.students_database.data[-1]
+    assert [
+        event["action"] for event in app.audit_log.events_for_student(student["id"])
+    ] == ["register"]
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from backup import BackupStore, SnapshotNotFound, split_into_chunks
+from bench.roster import generate_roster
+from util import MemoryStorage
+
+
+def test_chunks_after_a_change_are_unaffected():
+    roster = generate_roster(2000, seed=5)
+    original_chunks = list(split_into_chunks(json.dumps(roster).encode("utf-8")))
+    assert b"".join(original_chunks) == json.dumps(roster).encode("utf-8")
+
+    # Make a student's details longer, which moves everything after it
+    roster[1000]["home_address"] += ", Somewhere Else"
+    changed_chunks = list(split_into_chunks(json.dumps(roster).encode("utf-8")))
+
+    unchanged = set(original_chunks) & set(changed_chunks)
+    assert len(unchanged) >= len(original_chunks) - 2
+
+
+def test_incremental_backups_and_point_in_time_restore():
+    source = MemoryStorage()
+    roster = generate_roster(1000, seed=5)
+    source.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    source.write_bytes("accounts.json", b"[]")
+    backup_store = BackupStore(MemoryStorage())
+
+    first_snapshot = backup_store.backup(source)
+    original_students = source.read_bytes("students.json")
+
+    roster[500]["surname"] = "Changed"
+    source.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    second_snapshot = backup_store.backup(source)
+    assert 0 < second_snapshot["bytes_written"] < first_snapshot["bytes_written"] / 10
+
+    # Nothing has changed since the last snapshot, so only the snapshot itself is saved
+    assert backup_store.backup(source)["bytes_written"] == 0
+
+    # A new store (e.g. in another process) sees the same chunks and snapshots
+    reopened_store = BackupStore(backup_store.storage)
+    assert [snapshot["id"] for snapshot in reopened_store.snapshots()] == [1, 2, 3]
+    target = MemoryStorage()
+    reopened_store.restore(reopened_store.find_snapshot(snapshot_id=1), target)
+    assert target.read_bytes("students.json") == original_students
+    assert target.read_bytes("accounts.json") == b"[]"
+
+    latest = reopened_store.find_snapshot(
+        at=datetime.fromisoformat(second_snapshot["created"])
+    )
+    assert latest["id"] == 3
+    with pytest.raises(SnapshotNotFound):
+        reopened_store.find_snapshot(at=datetime(2000, 1, 1))
+
+
+def test_restore_refuses_corrupted_chunks():
+    source = MemoryStorage()
+    source.write_bytes(
+        "students.json", json.dumps(generate_roster(100)).encode("utf-8")
+    )
+    backup_store = BackupStore(MemoryStorage())
+    snapshot = backup_store.backup(source)
+
+    chunk_filename = next(
+        name for name in backup_store.storage.files if name.startswith("chunk-")
+    )
+    backup_store.storage.files[chunk_filename][-1] ^= 0xFF
+    target = MemoryStorage()
+    with pytest.raises(ValueError, match="is corrupted"):
+        backup_store.restore(snapshot, target)
+    assert not target.files
+
+
+def test_restore_keeps_the_current_audit_trail():
+    source = MemoryStorage()
+    source.write_bytes("students.json", b"[]")
+    source.write_bytes("audit-accounts.json", b'["reception"]')
+    backup_store = BackupStore(MemoryStorage())
+    snapshot = backup_store.backup(source)
+
+    source.write_bytes("audit-accounts.json", b'["reception", "office"]')
+    restored_files = backup_store.restore(snapshot, source)
+    assert restored_files == ["students.json"]
+    assert source.read_bytes("audit-accounts.json") == b'["reception", "office"]'
+    assert backup_store.read_file(snapshot, "audit-accounts.json") == b'["reception"]'
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import batch
+from bench.roster import generate_roster
+from bench.run import app_with_roster
+
+
+def test_batch_writes_the_same_reports_with_and_without_workers(tmp_path):
+    students_database = app_with_roster(generate_roster(300, seed=3)).students_database
+    jobs = batch.every_tutor_group_jobs(students_database)
+    jobs.append({"report": "surnames", "prefix": "S"})
+
+    in_process_files = batch.run_batch(
+        students_database, jobs, tmp_path / "serial", workers=1
+    )
+    worker_files = batch.run_batch(
+        students_database, jobs, tmp_path / "parallel", workers=2
+    )
+
+    assert [path.name for path in in_process_files] == [
+        path.name for path in worker_files
+    ]
+    assert "surnames-all-S.txt" in [path.name for path in worker_files]
+    for serial_path, parallel_path in zip(in_process_files, worker_files):
+        assert serial_path.read_text(encoding="utf-8") == parallel_path.read_text(
+            encoding="utf-8"
+        )
+
+
+def test_batch_json_output_only_includes_the_tutor_group(tmp_path):
+    students_database = app_with_roster(generate_roster(100, seed=3)).students_database
+    tutor_group = students_database.data[0]["tutor_group"]
+
+    [path] = batch.run_batch(
+        students_database,
+        [{"report": "surnames", "tutor_group": tutor_group}],
+        tmp_path,
+        workers=1,
+        output_format="json",
+    )
+    students = json.loads(path.read_text(encoding="utf-8"))
+    assert students and all(
+        student["tutor_group"] == tutor_group for student in students
+    )
+
+
+def test_batch_rejects_unknown_reports(tmp_path):
+    students_database = app_with_roster(generate_roster(10)).students_database
+    with pytest.raises(ValueError):
+        batch.run_batch(students_database, [{"report": "attendance"}], tmp_path)
+    with pytest.raises(ValueError, match="JSON object"):
+        batch.run_batch(students_database, ["surnames"], tmp_path)
+
+
+def test_batch_keeps_reports_inside_the_output_directory(tmp_path):
+    students_database = app_with_roster(generate_roster(10)).students_database
+    output_directory = tmp_path / "reports"
+    (path,) = batch.run_batch(
+        students_database,
+        [{"report": "surnames", "tutor_group": "../x", "prefix": "/S"}],
+        output_directory,
+        workers=1,
+    )
+    assert path.parent == output_directory
+    assert path.name == "surnames-___x-_S.txt"
+
+
+def test_batch_rejects_bad_parameters_and_clashing_filenames(tmp_path):
+    students_database = app_with_roster(generate_roster(10)).students_database
+    with pytest.raises(ValueError, match="should be a string"):
+        batch.run_batch(
+            students_database, [{"report": "surnames", "prefix": None}], tmp_path
+        )
+    with pytest.raises(ValueError, match="should be a string"):
+        batch.run_batch(
+            students_database, [{"report": "surnames", "tutor_group": 9}], tmp_path
+        )
+    with pytest.raises(ValueError, match="surnames-all-S_.txt"):
+        batch.run_batch(
+            students_database,
+            [
+                {"report": "surnames", "prefix": "S."},
+                {"report": "surnames", "prefix": "S/"},
+            ],
+            tmp_path / "clashing",
+        )
+    assert not (tmp_path / "clashing").exists()
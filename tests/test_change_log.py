@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import App
+from change_log import ChangeLog, ChangesCompacted
+from util import MemoryStorage
+
+
+def add_test_student(app: App, surname: str):
+    return app.students_database.add_student(
+        surname, "Alex", date(2011, 3, 4), "1 Tree Road", "+44 1234 567890", "8C"
+    )
+
+
+def test_changes_since_only_returns_new_changes():
+    app = App(storage=MemoryStorage())
+    seq, students = app.students_database.snapshot()
+    assert seq == 0
+    assert len(students) == len(app.students_database.data)
+
+    first_student = add_test_student(app, "First")
+    second_student = add_test_student(app, "Second")
+
+    changes = app.students_database.changes_since(seq)
+    assert [change["op"] for change in changes] == ["insert", "insert"]
+    assert [change["id"] for change in changes] == [
+        first_student["id"],
+        second_student["id"],
+    ]
+    assert app.students_database.changes_since(changes[0]["seq"]) == changes[1:]
+    assert app.students_database.changes_since(changes[-1]["seq"]) == []
+
+
+def test_change_log_is_reloaded_from_storage():
+    storage = MemoryStorage()
+    add_test_student(App(storage=storage), "First")
+
+    reloaded_app = App(storage=storage)
+    assert reloaded_app.students_database.change_log.last_seq() == 1
+    add_test_student(reloaded_app, "Second")
+    assert reloaded_app.students_database.changes_since(1)[0]["seq"] == 2
+
+
+def test_compaction_removes_old_changes():
+    storage = MemoryStorage()
+    change_log = ChangeLog("changes.jsonl", storage)
+    for record_id in range(1, 6):
+        change_log.record("insert", record_id, {"id": record_id})
+    change_log.entries[-1]["timestamp"] += 1000
+
+    removed_count = change_log.compact(
+        timedelta(seconds=500), now=change_log.entries[-1]["timestamp"]
+    )
+    assert removed_count == 4
+
+    reloaded_log = ChangeLog("changes.jsonl", storage)
+    assert reloaded_log.last_seq() == 5
+    assert [change["seq"] for change in reloaded_log.changes_since(4)] == [5]
+    with pytest.raises(ChangesCompacted):
+        reloaded_log.changes_since(2)
@@ -0,0 +1,89 @@
+import threading
+from datetime import date
+
+from app import App
+from reports import surnames_starting_with_query
+from util import MemoryStorage, ReadWriteLock
+
+WRITER_THREADS = 8
+STUDENTS_PER_WRITER = 50
+READER_THREADS = 8
+
+
+def test_concurrent_registrations_get_unique_ids_and_emails():
+    app = App(storage=MemoryStorage())
+    students_database = app.students_database
+    initial_count = len(students_database.data)
+    start_barrier = threading.Barrier(WRITER_THREADS + READER_THREADS)
+    writers_finished = threading.Event()
+    errors = []
+
+    def register_students():
+        start_barrier.wait()
+        for _ in range(STUDENTS_PER_WRITER):
+            # Everyone has the same name, so they all compete for the same email
+            # addresses
+            students_database.add_student(
+                "Smith",
+                "John",
+                date(2012, 1, 1),
+                "1 Tree Road",
+                "+44 1234 567890",
+                "9A",
+            )
+
+    def read_students():
+        start_barrier.wait()
+        try:
+            while not writers_finished.is_set():
+                students = students_database.get_students(
+                    account={"username": "reader"}
+                )
+                surnames_starting_with_query(
+                    students_database, "Smi", account={"username": "reader"}
+                ).run()
+                students_database.get_student(id=len(students))
+        except Exception as error:
+            errors.append(error)
+
+    writers = [
+        threading.Thread(target=register_students) for _ in range(WRITER_THREADS)
+    ]
+    readers = [threading.Thread(target=read_students) for _ in range(READER_THREADS)]
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writers_finished.set()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    students = students_database.data
+    assert len(students) == initial_count + WRITER_THREADS * STUDENTS_PER_WRITER
+    assert len({student["id"] for student in students}) == len(students)
+    assert len({student["school_email"] for student in students}) == len(students)
+
+    # The saved copy should match what's in memory
+    students_database.load()
+    assert len(students_database.data) == len(students)
+
+
+def test_write_lock_excludes_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def reader():
+        with lock.read():
+            events.append("read")
+
+    with lock.write():
+        thread = threading.Thread(target=reader)
+        thread.start()
+        thread.join(timeout=0.1)
+        # The reader is still waiting for the writer to finish
+        assert events == []
+        events.append("write")
+
+    thread.join()
+    assert events == ["write", "read"]
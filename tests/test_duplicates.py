@@ -0,0 +1,66 @@
+from datetime import date
+
+from app import App
+from bench.roster import generate_roster
+from duplicates import DuplicateIndex, soundex
+from util import MemoryStorage
+
+
+def test_soundex_matches_similar_sounding_names():
+    assert soundex("Robert") == soundex("Rupert") == "R163"
+    assert soundex("Jon") == soundex("John") == "J500"
+    assert soundex("Ashcraft") == "A261"
+    assert soundex("Ó Súilleabháin") == "O241"
+    assert soundex("") == ""
+
+
+def test_registration_warns_about_likely_duplicates():
+    app = App(storage=MemoryStorage())
+    existing_student = app.students_database.add_student(
+        "Smith", "John", date(2012, 1, 1), "1 Tree Road", "+44 1234 567890", "9A"
+    )
+
+    matches = app.students_database.find_possible_duplicates(
+        "Smith", "Jon", date(2012, 1, 1), "+441234567890"
+    )
+    assert matches == [
+        (
+            existing_student,
+            ["birthday", "phone number", "similar surname", "similar forename"],
+        )
+    ]
+    assert not app.students_database.find_possible_duplicates(
+        "Smith", "Emma", date(2012, 1, 1), "+44 9999 999999"
+    )
+
+    # Archived students are no longer checked
+    app.students_database.archive_student(existing_student["id"])
+    assert not app.students_database.find_possible_duplicates(
+        "Smith", "Jon", date(2012, 1, 1), "+441234567890"
+    )
+
+
+def test_find_all_duplicates_matches_comparing_every_pair():
+    roster = generate_roster(300, seed=4)
+    # Register some of the students a second time, with a slightly different forename
+    for student in roster[:5]:
+        roster.append(
+            {**student, "id": len(roster) + 1, "forename": student["forename"] + "e"}
+        )
+
+    index = DuplicateIndex(roster)
+    found_pairs = {
+        (student["id"], other["id"])
+        for student, other, _ in index.find_all_duplicates()
+    }
+
+    expected_pairs = set()
+    for position, student in enumerate(roster):
+        for other in roster[position + 1 :]:
+            if len(DuplicateIndex([student]).find_matches(other)) == 1:
+                expected_pairs.add((student["id"], other["id"]))
+
+    assert found_pairs == expected_pairs
+    assert {
+        (student["id"], len(roster) - 4 + i) for i, student in enumerate(roster[:5])
+    } <= found_pairs
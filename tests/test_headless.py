@@ -0,0 +1,47 @@
+import argparse
+import json
+
+from app import App
+from cli import run_report, run_student_command
+from headless import run_script, strip_ansi
+from inputs import password_to_hash
+from util import MemoryStorage
+
+
+def make_app() -> App:
+    app = App(storage=MemoryStorage())
+    app.settings_database.set("tui", "onboarding", "show", value=False)
+    app.accounts_database.add_account("admin", password_to_hash("hunter2"))
+    return app
+
+
+def test_script_drives_the_terminal_ui():
+    app = make_app()
+    # Log in, then look up student #1 and press Enter at the end of the page
+    output = strip_ansi(run_script(app, ["1", "admin", "hunter2", "2", "1", ""]))
+
+    student = app.students_database.get_student(id=1)
+    assert f"Details for {student['full_name']} (#1)" in output
+    assert f"School email address: {student['school_email']}" in output
+    assert app.signed_in()
+
+
+def test_report_and_student_commands(capsys):
+    app = make_app()
+    student = app.students_database.get_student(id=1)
+
+    run_report(
+        app,
+        argparse.Namespace(
+            report="surnames", prefix=student["surname"], format="json", explain=False
+        ),
+    )
+    report = json.loads(capsys.readouterr().out)
+    assert student["id"] in [match["id"] for match in report]
+
+    run_student_command(
+        app, argparse.Namespace(id=None, email=student["school_email"], format="text")
+    )
+    output = capsys.readouterr().out
+    assert output.startswith(f"{student['full_name']} (#1)\n")
+    assert "\x1b[" not in output
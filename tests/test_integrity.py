@@ -0,0 +1,111 @@
+import argparse
+import json
+
+import pytest
+
+import cli
+import integrity
+from app import App
+from bench.roster import generate_roster
+from metadata import MetadataDatabase
+from util import MemoryStorage
+
+
+def storage_with_students(students: list[dict]) -> MemoryStorage:
+    storage = MemoryStorage()
+    storage.write_bytes("students.json", json.dumps(students).encode("utf-8"))
+    return storage
+
+
+def test_files_are_only_checked_again_once_they_change():
+    storage = storage_with_students(generate_roster(500, seed=8))
+    metadata_database = MetadataDatabase(storage=storage)
+
+    result = integrity.verify(storage, metadata_database)
+    assert result.problems == []
+    assert "students.json" in result.checked
+    assert result.generations["students.json"] == 1
+
+    result = integrity.verify(storage, metadata_database)
+    assert result.checked == []
+    assert "students.json" in result.skipped
+
+    storage.write_bytes(
+        "students.json", json.dumps(generate_roster(10)).encode("utf-8")
+    )
+    result = integrity.verify(storage, metadata_database)
+    assert result.checked == ["students.json", "students-archive.json"]
+    assert result.generations["students.json"] == 2
+
+
+def test_hand_edited_students_are_found():
+    students = generate_roster(20, seed=8)
+    students[3]["birthday"] = "2012-02-30"
+    students[5]["id"] = students[4]["id"]
+    students[7]["school_email"] = students[6]["school_email"]
+    del students[9]["surname"]
+    storage = storage_with_students(students)
+    archived_student = {**generate_roster(1)[0], "id": 500, "archived_on": "2024-07-19"}
+    storage.write_bytes(
+        "students-archive.json", json.dumps([archived_student]).encode("utf-8")
+    )
+
+    problems = integrity.verify(storage, MetadataDatabase(storage=storage)).problems
+    assert problems == [
+        "students.json: record 3 (ID 4) has a birthday that isn't a valid date "
+        + "('2012-02-30')",
+        "students.json: record 5 (ID 5) has the same ID as another student",
+        "students.json: record 7 (ID 8) has the same email address as another student "
+        + f"({students[6]['school_email']})",
+        "students.json: record 9 (ID 10) has an invalid surname (None)",
+        "students-archive.json: record 0 (ID 500) has a higher ID than "
+        + "highest_removed_id in metadata.json",
+    ]
+    # Files with problems are checked again next time
+    assert (
+        integrity.verify(storage, MetadataDatabase(storage=storage)).problems
+        == problems
+    )
+
+
+def test_partly_written_files_and_gaps_in_the_change_log_are_found():
+    storage = MemoryStorage()
+    storage.write_bytes(
+        "students.json", json.dumps(generate_roster(50)).encode("utf-8")[:-300]
+    )
+    storage.write_bytes(
+        "students-changes.jsonl",
+        b'{"compacted_through": 3}\n'
+        + b'{"seq": 4, "op": "insert"}\n'
+        + b'{"seq": 6, "op": "update"}\n',
+    )
+
+    problems = integrity.verify(storage).problems
+    assert len(problems) == 2
+    assert problems[0].startswith("students.json: isn't a valid JSON list")
+    assert problems[1] == "students-changes.jsonl: line 3 should be change #5 (not 6)"
+
+
+def test_app_checks_the_files_when_asked():
+    students = generate_roster(5)
+    students[1]["id"] = students[0]["id"]
+    storage = storage_with_students(students)
+
+    with pytest.raises(integrity.IntegrityError) as error:
+        App(storage=storage, verify_on_load=True)
+    assert error.value.problems == [
+        "students.json: record 1 (ID 1) has the same ID as another student"
+    ]
+    App(storage=storage_with_students(generate_roster(5)), verify_on_load=True)
+
+
+def test_verify_command_does_not_create_files(tmp_path):
+    arguments = argparse.Namespace(data=tmp_path / "data", full=False)
+    with pytest.raises(SystemExit):
+        cli.run_verify_command(None, arguments)
+    assert not arguments.data.exists()
+
+    arguments.data.mkdir()
+    (arguments.data / "students.json").write_text("[]", encoding="utf-8")
+    cli.run_verify_command(None, arguments)
+    assert [path.name for path in arguments.data.iterdir()] == ["students.json"]
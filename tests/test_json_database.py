@@ -1,5 +1,9 @@
 from pathlib import Path
-from util import JSONDatabase
+
+import pytest
+
+from app import App
+from util import FileStorage, JSONDatabase, MemoryStorage
 
 initial_data = {
     "float": 1.5,
@@ -13,17 +17,21 @@ initial_data = {
 }
 
 basic_database_filename = "test_database.json"
-expected_path = Path(".", "data", basic_database_filename)
-expected_path.unlink(missing_ok=True) # Delete the database file from any previous runs
 
-basic_database = JSONDatabase(basic_database_filename, initial_data)
 
-def test_database_path():
+@pytest.fixture
+def basic_database(tmp_path):
+    return JSONDatabase(
+        basic_database_filename, initial_data, storage=FileStorage(tmp_path)
+    )
+
+
+def test_database_path(basic_database, tmp_path):
     """Test that the database is being stored at the expected path"""
-    assert basic_database.get_file_path() == expected_path
+    assert basic_database.get_file_path() == Path(tmp_path, basic_database_filename)
 
 
-def test_intial_data_datatypes():
+def test_intial_data_datatypes(basic_database):
     """Test that the initial data has been loaded into the database with correct datatypes"""
     assert isinstance(basic_database.data["float"], float)
     assert isinstance(basic_database.data["int"], int)
@@ -31,6 +39,29 @@ def test_intial_data_datatypes():
     assert isinstance(basic_database.data["array"], list)
     assert isinstance(basic_database.data["person"], dict)
 
-def test_intial_data_nested_dicts():
+def test_intial_data_nested_dicts(basic_database):
     """Test that nested dictionaries are loaded from the initial data"""
-    assert basic_database.data["person"]["score"] == 20
\ No newline at end of file
+    assert basic_database.data["person"]["score"] == 20
+
+def test_memory_storage_round_trip():
+    """Test that a database kept in memory can be saved and loaded again without
+    touching the filesystem
+    """
+    storage = MemoryStorage()
+    database = JSONDatabase(basic_database_filename, initial_data, storage=storage)
+    database.data["int"] = 21
+    database.save()
+
+    reloaded_database = JSONDatabase(basic_database_filename, {}, storage=storage)
+    assert reloaded_database.get_file_path() is None
+    assert reloaded_database.data["int"] == 21
+
+
+def test_app_instances_have_separate_storage():
+    """Test that changes made by one in-memory App instance aren't visible to another"""
+    first_app = App(storage=MemoryStorage())
+    second_app = App(storage=MemoryStorage())
+    first_app.accounts_database.add_account("alice", "hash")
+
+    assert first_app.accounts_database.get_account("alice")
+    assert not second_app.accounts_database.get_account("alice")
@@ -0,0 +1,86 @@
+import menu
+
+
+def test_frame_is_written_in_one_go(capsys):
+    frame = menu.Frame()
+    frame.line("First line")
+    frame.info_line("Field", "value")
+    assert capsys.readouterr().out == ""
+
+    frame.flush()
+    output = capsys.readouterr().out
+    assert output.startswith("First line\nField: ")
+    assert frame.parts == []
+
+
+def test_show_paginated_stops_when_asked(monkeypatch, capsys):
+    monkeypatch.setattr(menu, "page_size", lambda: 2)
+    answers = iter(["", "q"])
+    monkeypatch.setattr("builtins.input", lambda _prompt: next(answers))
+
+    menu.show_paginated((f"Line {i}" for i in range(10)), total=10)
+
+    printed_lines = capsys.readouterr().out.splitlines()
+    assert printed_lines == ["Line 0", "Line 1", "Line 2", "Line 3"]
+
+
+def test_show_paginated_prints_everything_when_not_a_terminal(monkeypatch, capsys):
+    monkeypatch.setattr(menu, "page_size", lambda: None)
+
+    menu.show_paginated(f"Line {i}" for i in range(100))
+
+    assert len(capsys.readouterr().out.splitlines()) == 100
+
+
+def make_ui():
+    from app import App
+    from terminal_ui import TerminalUI
+    from util import MemoryStorage
+
+    ui = TerminalUI(App(storage=MemoryStorage()))
+    ui.breadcrumbs.push("Home")
+    return ui
+
+
+def test_visible_options_are_cached_until_state_changes():
+    ui = make_ui()
+    calls = []
+
+    def should_show():
+        calls.append(True)
+        return ui.app.signed_in()
+
+    test_menu = menu.Menu([menu.Page("Log out", lambda: None, should_show)], ui)
+    assert test_menu.visible_options() == []
+    assert test_menu.visible_options() == []
+    assert len(calls) == 1
+
+    ui.app.current_account = {"username": "alice"}
+    assert len(test_menu.visible_options()) == 1
+    assert len(calls) == 2
+
+
+def test_get_selection_retries_without_recursion(monkeypatch, capsys):
+    answers = iter(["nope"] * 5000 + ["2"])
+    monkeypatch.setattr("builtins.input", lambda _prompt: next(answers))
+
+    assert menu.get_selection(3) == 1
+    capsys.readouterr()
+
+
+def test_navigator_keeps_breadcrumbs_balanced(monkeypatch, capsys):
+    ui = make_ui()
+    visited_pages = []
+    report_page = menu.Page(
+        "Report", lambda: visited_pages.append("report"), pause_at_end=False
+    )
+    main_menu = menu.Menu([menu.Submenu("Reports", "Reports", [report_page])], ui)
+
+    # Open the submenu and view the report 100 times, then exit the main menu
+    answers = iter(["1", "1"] * 100 + ["0"])
+    monkeypatch.setattr("builtins.input", lambda _prompt: next(answers))
+    main_menu.show(loop=True)
+    capsys.readouterr()
+
+    assert len(visited_pages) == 100
+    assert ui.breadcrumbs.pages == ["Home"]
@@ -0,0 +1,30 @@
+from metrics import Metrics
+from util import MemoryStorage
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+
+    @metrics.timed("square")
+    def square(number):
+        return number * number
+
+    assert square(4) == 16
+    metrics.increment("calls")
+    assert metrics.to_dict() == {"timers": {}, "counters": {}}
+
+
+def test_enabled_metrics_are_dumped():
+    metrics = Metrics()
+    metrics.enable("prometheus")
+
+    with metrics.timer("json_database.save"):
+        metrics.increment("json_database.bytes_written", 100)
+
+    storage = MemoryStorage()
+    filename = metrics.dump(storage)
+    dumped_text = storage.read_bytes(filename).decode("utf-8")
+
+    assert filename == "metrics.prom"
+    assert "pms_json_database_save_seconds_count 1" in dumped_text
+    assert "pms_json_database_bytes_written_total 100" in dumped_text
@@ -0,0 +1,124 @@
+import io
+import json
+from datetime import date
+
+import pytest
+
+import migrations
+from app import App
+from bench.roster import generate_roster
+from metadata import MetadataDatabase
+from util import FileStorage, MemoryStorage
+
+
+def old_format_roster(size: int) -> list[dict]:
+    roster = generate_roster(size, seed=2)
+    for student in roster:
+        student["full_name"] = (
+            f"  {student['forename'].lower()} {student['surname'].upper()}"
+        )
+    return roster
+
+
+def test_iter_json_array_reads_items_split_across_blocks():
+    items = [{"name": "Zoë " * n, "n": n} for n in range(50)]
+    stream = io.BytesIO(json.dumps(items).encode("utf-8"))
+    assert list(migrations.iter_json_array(stream, block_size=7)) == items
+    assert list(migrations.iter_json_array(io.BytesIO(b" [ ] "))) == []
+
+
+def test_app_migrates_full_names_when_it_starts(tmp_path):
+    storage = FileStorage(tmp_path)
+    roster = old_format_roster(2500)
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+
+    app = App(storage=storage)
+    assert [migration.version for migration in app.applied_migrations] == [1]
+    assert app.metadata_database.get("schema_versions", "students.json") == 1
+    for student in app.students_database.data:
+        assert student["full_name"] == f"{student['forename']} {student['surname']}"
+    # The file is written in the same format that the database saves in
+    expected_students = [migrations.normalise_full_name(student) for student in roster]
+    assert storage.read_bytes("students.json") == json.dumps(expected_students).encode(
+        "utf-8"
+    )
+    # The temporary file and saved progress are removed once the migration has finished
+    assert not [path.name for path in tmp_path.iterdir() if "migrat" in path.name]
+
+    assert App(storage=storage).applied_migrations == []
+
+
+def test_interrupted_migrations_carry_on_where_they_left_off(monkeypatch):
+    storage = MemoryStorage()
+    roster = old_format_roster(2500)
+    storage.write_bytes("students.json", json.dumps(roster).encode("utf-8"))
+    metadata_database = MetadataDatabase(storage=storage)
+
+    migrated_count = 0
+
+    def interrupt_after_1500(student):
+        nonlocal migrated_count
+        migrated_count += 1
+        if migrated_count > 1500:
+            raise KeyboardInterrupt
+        return migrations.normalise_full_name(student)
+
+    [full_name_migration] = migrations.pending_migrations(
+        metadata_database, "students.json"
+    )
+    monkeypatch.setattr(full_name_migration, "transform", interrupt_after_1500)
+    with pytest.raises(KeyboardInterrupt):
+        migrations.run_pending(storage, metadata_database)
+    assert migrations.schema_version(metadata_database, "students.json") == 0
+
+    # Only the students after the last saved batch are migrated again
+    migrated_count = 0
+
+    def count_migrated(student):
+        nonlocal migrated_count
+        migrated_count += 1
+        return migrations.normalise_full_name(student)
+
+    monkeypatch.setattr(full_name_migration, "transform", count_migrated)
+    applied_migrations = migrations.run_pending(storage, metadata_database)
+    assert applied_migrations == [full_name_migration]
+    assert migrated_count == 1500
+    assert json.loads(storage.read_bytes("students.json")) == [
+        migrations.normalise_full_name(student) for student in roster
+    ]
+    assert set(storage.files) == {"students.json", "metadata.json"}
+
+
+def test_new_students_get_a_normalised_full_name():
+    app = App(storage=MemoryStorage())
+    student = app.students_database.add_student(
+        "  o'brien ", "mARY", date(2012, 1, 1), "1 Tree Road", "+441234567890", "9a"
+    )
+    assert student["full_name"] == "Mary O'Brien"
+
+
+def test_archived_students_are_migrated_too():
+    storage = MemoryStorage()
+    archived_roster = [
+        {**student, "archived_on": "2020-07-20"} for student in old_format_roster(10)
+    ]
+    storage.write_bytes(
+        "students-archive.json", json.dumps(archived_roster).encode("utf-8")
+    )
+
+    app = App(storage=storage)
+    assert [migration.filename for migration in app.applied_migrations] == [
+        "students-archive.json"
+    ]
+    for student in app.students_database.get_archived_students():
+        assert student["full_name"] == f"{student['forename']} {student['surname']}"
+
+
+def test_new_files_are_created_at_the_latest_schema_version():
+    storage = MemoryStorage()
+    assert App(storage=storage).applied_migrations == []
+    assert (
+        migrations.schema_version(MetadataDatabase(storage=storage), "students.json")
+        == 1
+    )
+    assert App(storage=storage).applied_migrations == []
@@ -0,0 +1,26 @@
+from profiling import Profiler
+from util import MemoryStorage
+
+
+def test_pages_mode_adds_up_the_allocations_for_each_page():
+    storage = MemoryStorage()
+    profiler = Profiler(storage, "pages", top_allocations=3)
+    profiler.start()
+    kept = []
+    for _ in range(5):
+        with profiler.page_context("Search students"):
+            kept.append([str(number) for number in range(1000)])
+    with profiler.page_context("Main menu"):
+        pass
+    written_files = profiler.save()
+
+    assert written_files[0].endswith("-search-students.pstats")
+    assert written_files[1].endswith("-main-menu.pstats")
+    report = storage.read_bytes(written_files[-1]).decode("utf-8")
+    # Each page gets one section however many times it was shown, listing no more
+    # than top_allocations lines of code
+    assert report.count("while on page 'Search students' (shown 5 times)") == 1
+    assert "while on page 'Main menu' (shown 1 times)" in report
+    search_section = report.split("'Search students'")[1].split("\n\n")[0]
+    assert 1 <= len(search_section.splitlines()[1:]) <= 3
+    assert "test_profiling.py" in search_section
@@ -0,0 +1,89 @@
+import argparse
+import io
+
+import pytest
+
+import cli
+import inputs
+import provisioning
+from app import App
+from provisioning import (
+    ProvisioningError,
+    hash_passwords,
+    provision_accounts,
+    read_accounts_csv,
+)
+from util import MemoryStorage, check_password
+
+
+def test_username_problems_match_the_terminal_ui_rules():
+    assert inputs.username_problem("mrs.leeman") is None
+    assert inputs.username_problem("") == "Enter a username made up of 1–64 characters"
+    assert (
+        inputs.username_problem("a" * 65)
+        == "Enter a username made up of 1–64 characters"
+    )
+    assert (
+        inputs.username_problem("bad/name")
+        == "Only use letters, numbers, ., -, _, and spaces"
+    )
+
+
+def test_accounts_are_created_at_once_with_generated_passwords():
+    app = App(storage=MemoryStorage())
+    rows = read_accounts_csv(
+        io.StringIO("username,password\nMrs Leeman,hunter2\nj.smith,\n")
+    )
+
+    created_accounts = provision_accounts(rows, app.accounts_database, workers=2)
+    [(_, generated_password)] = [
+        account for account in created_accounts if account[1] is not None
+    ]
+    assert [username for username, _ in created_accounts] == ["mrs leeman", "j.smith"]
+    assert check_password(
+        "hunter2", app.accounts_database.get_account("mrs leeman")["password_hash"]
+    )
+    assert check_password(
+        generated_password,
+        app.accounts_database.get_account("j.smith")["password_hash"],
+    )
+    assert app.accounts_database.version == 2
+
+
+def test_no_accounts_are_created_if_any_rows_are_invalid():
+    app = App(storage=MemoryStorage())
+    app.accounts_database.add_account("taken", inputs.password_to_hash("hunter2"))
+    rows = read_accounts_csv(
+        io.StringIO("username\nnew.user\nbad/name\nTaken\nnew.user\n")
+    )
+
+    with pytest.raises(ProvisioningError) as error:
+        provision_accounts(rows, app.accounts_database)
+    assert error.value.problems == [
+        "Line 3: Only use letters, numbers, ., -, _, and spaces (got 'bad/name')",
+        "Line 4: There's already an account with the username taken",
+        "Line 5: The username new.user is also on line 2",
+    ]
+    assert app.accounts_database.get_usernames() == ["taken"]
+
+
+def test_import_command_reports_usernames_taken_while_hashing(
+    tmp_path, monkeypatch, capsys
+):
+    app = App(storage=MemoryStorage())
+    csv_path = tmp_path / "accounts.csv"
+    csv_path.write_text("username\nj.smith\n", encoding="utf-8")
+
+    def hash_while_someone_else_signs_up(passwords, workers):
+        app.accounts_database.add_account("j.smith", inputs.password_to_hash("hunter2"))
+        return hash_passwords(passwords, workers)
+
+    monkeypatch.setattr(
+        provisioning, "hash_passwords", hash_while_someone_else_signs_up
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        cli.run_accounts_import_command(
+            app, argparse.Namespace(file=csv_path, workers=1)
+        )
+    assert exit_info.value.code == 2
+    assert "Username j.smith already exists" in capsys.readouterr().err
@@ -0,0 +1,125 @@
+import json
+from datetime import date
+
+import pytest
+
+from app import App
+from bench.roster import generate_roster
+from query import Matches, Query
+from students import next_birthday
+from util import MemoryStorage
+
+TODAY = date(2024, 12, 20)
+ACCOUNT = {"username": "tester"}
+
+
+def app_with_roster(size: int) -> App:
+    storage = MemoryStorage()
+    storage.write_bytes(
+        "students.json",
+        json.dumps(generate_roster(size, seed=7, today=TODAY)).encode("utf-8"),
+    )
+    return App(storage=storage)
+
+
+def test_name_prefix_uses_the_index_and_matches_a_full_scan():
+    app = app_with_roster(500)
+    students = app.students_database.get_students(account=ACCOUNT)
+
+    query = (
+        Query(app.students_database, ACCOUNT)
+        .where_surname_starts_with("s")
+        .order_by("surname")
+    )
+    assert query.explain().startswith("Index lookup: surname starts with")
+    assert "Sort: surname (already in index order)" in query.explain()
+
+    expected = sorted(
+        (
+            student
+            for student in students
+            if student["surname"].casefold().startswith("s")
+        ),
+        key=lambda student: (student["surname"].casefold(), student["id"]),
+    )
+    assert query.run() == expected
+
+
+def test_conditions_without_an_index_use_a_full_scan():
+    app = app_with_roster(50)
+    query = Query(app.students_database, ACCOUNT).where(
+        Matches("has a long name", lambda s: len(s["full_name"]) > 12)
+    )
+    assert query.explain().splitlines()[0] == "Full scan of 50 students"
+    assert query.run() == [
+        student
+        for student in app.students_database.get_students(account=ACCOUNT)
+        if len(student["full_name"]) > 12
+    ]
+
+
+def test_smallest_index_is_chosen_and_other_conditions_filter():
+    app = app_with_roster(500)
+    students = app.students_database.get_students(account=ACCOUNT)
+    tutor_group = students[0]["tutor_group"]
+
+    query = (
+        Query(app.students_database, ACCOUNT)
+        .where_surname_starts_with("")
+        .where_tutor_group(tutor_group)
+        .order_by("birthday")
+    )
+    assert query.explain().startswith(f"Index lookup: tutor group = {tutor_group}")
+
+    expected = sorted(
+        (student for student in students if student["tutor_group"] == tutor_group),
+        key=lambda student: (student["birthday"], student["id"]),
+    )
+    assert query.run() == expected
+
+
+def test_upcoming_birthdays_wrap_around_the_new_year():
+    app = app_with_roster(500)
+    students = app.students_database.get_students(account=ACCOUNT)
+
+    results = (
+        Query(app.students_database, ACCOUNT, today=TODAY)
+        .where_birthday_within_days(30)
+        .order_by("next_birthday")
+        .run()
+    )
+
+    def days_until_birthday(student):
+        return (
+            next_birthday(date.fromisoformat(student["birthday"]), TODAY) - TODAY
+        ).days
+
+    expected = sorted(
+        (student for student in students if days_until_birthday(student) <= 30),
+        key=lambda student: (days_until_birthday(student), student["id"]),
+    )
+    assert results == expected
+    assert any(
+        date.fromisoformat(student["birthday"]).month == 1 for student in results
+    )
+
+
+def test_limit_and_select():
+    app = app_with_roster(100)
+    results = (
+        Query(app.students_database, ACCOUNT)
+        .order_by("id", descending=True)
+        .limit(3)
+        .select("id", "surname")
+        .run()
+    )
+    assert [student["id"] for student in results] == [100, 99, 98]
+    assert set(results[0]) == {"id", "surname"}
+
+    with pytest.raises(ValueError, match="Can't select email .*school_email"):
+        Query(app.students_database, ACCOUNT).select("id", "email")
+
+
+def test_queries_need_an_account():
+    app = app_with_roster(10)
+    assert Query(app.students_database).run() == []
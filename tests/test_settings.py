@@ -0,0 +1,65 @@
+import pytest
+
+from app import App
+from settings import SettingsDatabase
+from util import MemoryStorage
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write_bytes(self, filename, contents):
+        self.writes += 1
+        super().write_bytes(filename, contents)
+
+
+def test_missing_settings_use_defaults_and_are_created_when_set():
+    settings = SettingsDatabase(storage=MemoryStorage())
+    settings.data = {}
+
+    assert settings.get("tui", "onboarding", "show") is True
+    assert settings.get("tui.onboarding.stage") is None
+
+    settings.set("tui", "onboarding", "stage", value="log_in")
+    assert settings.data == {"tui": {"onboarding": {"stage": "log_in"}}}
+
+
+def test_unknown_settings_and_wrong_types_are_rejected():
+    settings = SettingsDatabase(storage=MemoryStorage())
+    with pytest.raises(KeyError):
+        settings.get("tui", "colour")
+    with pytest.raises(TypeError):
+        settings.set("tui", "onboarding", "show", value="no")
+
+
+def test_settings_changed_in_a_batch_are_written_once():
+    storage = CountingStorage()
+    settings = SettingsDatabase(storage=storage)
+    writes_before = storage.writes
+
+    with settings.batch():
+        settings.set("tui", "onboarding", "stage", value="create_account")
+        settings.set("tui", "onboarding", "stage", value="log_in")
+        settings.set("tui", "onboarding", "show", value=False)
+        assert storage.writes == writes_before
+    assert storage.writes == writes_before + 1
+
+    # Setting a value that hasn't changed doesn't write anything
+    settings.set("tui", "onboarding", "show", value=False)
+    assert storage.writes == writes_before + 1
+    assert (
+        SettingsDatabase(storage=storage).get("tui", "onboarding", "stage") == "log_in"
+    )
+
+
+def test_apps_do_not_share_settings():
+    first_app = App(storage=MemoryStorage())
+    second_app = App(storage=MemoryStorage())
+
+    first_app.settings_database.set("tui", "onboarding", "show", value=False)
+    assert second_app.settings_database.get("tui", "onboarding", "show") is True
+    assert SettingsDatabase.DEFAULT_SETTINGS == {
+        "tui": {"onboarding": {"show": True, "stage": None}}
+    }
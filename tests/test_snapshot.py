@@ -0,0 +1,99 @@
+from datetime import date
+
+import pytest
+
+from bench.roster import generate_roster
+from bench.run import app_with_roster
+from query import Query
+from snapshot import SnapshotStudentsDatabase, StudentSnapshot, write_snapshot
+from util import FileStorage, MemoryStorage
+
+ACCOUNT = {"username": "tests"}
+
+
+def test_snapshot_lookups_and_reports_match_the_database(tmp_path):
+    students_database = app_with_roster(generate_roster(1500, seed=6)).students_database
+    write_snapshot(students_database, FileStorage(tmp_path))
+    snapshot_database = SnapshotStudentsDatabase.open(FileStorage(tmp_path))
+
+    assert list(snapshot_database.data) == students_database.data
+    student = students_database.data[123]
+    assert snapshot_database.get_student(id=student["id"]) == student
+    assert (
+        snapshot_database.get_student(email_address=student["school_email"]) == student
+    )
+    assert snapshot_database.get_student(email_address="nobody@tree-road.edu") is None
+
+    queries = [
+        lambda database: (
+            Query(database, ACCOUNT).where_surname_starts_with("s").order_by("surname")
+        ),
+        lambda database: (
+            Query(database, ACCOUNT)
+            .where_birthday_within_days(30)
+            .order_by("next_birthday")
+        ),
+        lambda database: (
+            Query(database, ACCOUNT)
+            .where_tutor_group(student["tutor_group"])
+            .order_by("forename")
+        ),
+        lambda database: Query(database, ACCOUNT).where_forename_starts_with(
+            student["forename"][:2]
+        ),
+    ]
+    for query in queries:
+        expected_students = query(students_database).run()
+        assert expected_students
+        assert query(snapshot_database).run() == expected_students
+        assert query(snapshot_database).explain() == query(students_database).explain()
+    snapshot_database.snapshot_file.close()
+
+
+def test_snapshots_are_read_only():
+    storage = MemoryStorage()
+    students_database = app_with_roster(generate_roster(10)).students_database
+    write_snapshot(students_database, storage)
+    snapshot_database = SnapshotStudentsDatabase.open(storage)
+
+    with pytest.raises(PermissionError):
+        snapshot_database.update_student(1, surname="Smith")
+    with pytest.raises(PermissionError):
+        snapshot_database.archive_student(1)
+    assert snapshot_database.get_student(id=1)["id"] == 1
+
+
+def test_snapshots_find_duplicates_and_keep_other_fields():
+    storage = MemoryStorage()
+    students_database = app_with_roster(generate_roster(50, seed=4)).students_database
+    student = students_database.data[7]
+    student["pronouns"] = "they/them"
+    write_snapshot(students_database, storage)
+    snapshot_database = SnapshotStudentsDatabase.open(storage)
+
+    assert snapshot_database.get_student(id=student["id"]) == student
+    assert (
+        snapshot_database.get_student(id=students_database.data[8]["id"])
+        == students_database.data[8]
+    )
+    details = (
+        student["surname"],
+        student["forename"],
+        date.fromisoformat(student["birthday"]),
+        student["home_phone"],
+    )
+    assert snapshot_database.find_possible_duplicates(
+        *details
+    ) == students_database.find_possible_duplicates(*details)
+    assert snapshot_database.changes_since(0) == []
+
+
+def test_empty_snapshots_and_other_files():
+    storage = MemoryStorage()
+    write_snapshot(app_with_roster([]).students_database, storage)
+    snapshot_database = SnapshotStudentsDatabase.open(storage)
+    assert list(snapshot_database.data) == []
+    assert snapshot_database.get_student(id=1) is None
+
+    with pytest.raises(ValueError):
+        StudentSnapshot(b"[]" * 16)
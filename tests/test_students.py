@@ -0,0 +1,145 @@
+from datetime import date
+
+import pytest
+
+from app import App
+from students import next_birthday
+from util import MemoryStorage
+
+
+def add_test_student(app: App, surname: str = "Smith"):
+    return app.students_database.add_student(
+        surname, "Alex", date(2011, 3, 4), "1 Tree Road", "+44 1234 567890", "8C"
+    )
+
+
+def test_update_student_keeps_indexes_up_to_date():
+    app = App(storage=MemoryStorage())
+    student = add_test_student(app)
+
+    updated = app.students_database.update_student(
+        student["id"], surname=" jones ", tutor_group="9b", birthday=date(2011, 5, 6)
+    )
+    assert updated["full_name"] == "Alex Jones"
+    assert updated["tutor_group"] == "9B"
+    assert updated["birthday"] == "2011-05-06"
+    # The email address stays the same, even though the name has changed
+    assert updated["school_email"] == student["school_email"]
+    assert (
+        app.students_database.get_student(email_address=student["school_email"])
+        is updated
+    )
+    assert app.students_database.changes_since(1)[0]["op"] == "update"
+
+    with pytest.raises(ValueError):
+        app.students_database.update_student(
+            student["id"], school_email="someone@else.edu"
+        )
+    with pytest.raises(LookupError):
+        app.students_database.update_student(999_999, surname="Nobody")
+
+
+def test_invalid_update_leaves_the_student_unchanged():
+    app = App(storage=MemoryStorage())
+    student = add_test_student(app)
+
+    with pytest.raises(AttributeError):
+        app.students_database.update_student(
+            student["id"], surname="Jones", birthday="not a date"
+        )
+    assert student["surname"] == "Smith"
+    assert app.students_database.get_student(id=student["id"]) is student
+    assert student["id"] in app.students_database.surname_index.ids_in_range(
+        "smith", "smith"
+    )
+
+
+def test_archived_students_ids_and_emails_are_not_reused():
+    storage = MemoryStorage()
+    app = App(storage=storage)
+    student = add_test_student(app)
+
+    archived = app.students_database.archive_student(student["id"])
+    assert archived["archived_on"] == date.today().isoformat()
+    assert app.students_database.get_student(id=student["id"]) is None
+    assert student not in app.students_database.data
+    assert app.students_database.get_archived_students() == [archived]
+
+    # A new app loads the archive (and the highest removed ID) from storage
+    reloaded_app = App(storage=storage)
+    new_student = add_test_student(reloaded_app)
+    assert new_student["id"] > student["id"]
+    assert new_student["school_email"] != student["school_email"]
+
+
+def test_purge_student_removes_active_and_archived_students():
+    app = App(storage=MemoryStorage())
+    active_student = add_test_student(app, "Active")
+    archived_student = add_test_student(app, "Archived")
+    app.students_database.archive_student(archived_student["id"])
+
+    app.students_database.purge_student(active_student["id"])
+    app.students_database.purge_student(archived_student["id"])
+
+    assert app.students_database.get_student(id=active_student["id"]) is None
+    assert app.students_database.get_archived_students() == []
+    assert [change["op"] for change in app.students_database.changes_since(0)][-2:] == [
+        "purge",
+        "purge",
+    ]
+    assert add_test_student(app)["id"] > archived_student["id"]
+    with pytest.raises(LookupError):
+        app.students_database.purge_student(archived_student["id"])
+
+
+def test_purge_student_redacts_the_change_log():
+    storage = MemoryStorage()
+    app = App(storage=storage)
+    student = add_test_student(app)
+    other_student = add_test_student(app, "Other")
+    app.students_database.update_student(student["id"], tutor_group="9B")
+
+    app.students_database.purge_student(student["id"])
+
+    for change_log in (
+        app.students_database.change_log,
+        App(storage=storage).students_database.change_log,
+    ):
+        changes = change_log.changes_since(0)
+        assert [change["op"] for change in changes] == [
+            "insert",
+            "insert",
+            "update",
+            "purge",
+        ]
+        assert all(
+            change["record"] is None
+            for change in changes
+            if change["id"] == student["id"]
+        )
+        assert changes[1]["record"] == other_student
+
+
+def test_next_birthday_handles_leap_days_and_new_year():
+    assert next_birthday(date(2012, 2, 29), date(2026, 2, 1)) == date(2026, 2, 28)
+    assert next_birthday(date(2012, 2, 29), date(2028, 2, 1)) == date(2028, 2, 29)
+    assert next_birthday(date(2012, 1, 5), date(2026, 12, 20)) == date(2027, 1, 5)
+    assert next_birthday(date(2012, 12, 20), date(2026, 12, 20)) == date(2026, 12, 20)
+
+
+def test_derived_fields_follow_changes_to_the_student():
+    app = App(storage=MemoryStorage())
+    student = add_test_student(app)
+    derived_fields = app.students_database.get_derived_fields(student)
+    assert derived_fields.birth_date == date(2011, 3, 4)
+    assert derived_fields.age(today=date(2026, 3, 3)) == 14
+    assert derived_fields.age(today=date(2026, 3, 4)) == 15
+
+    app.students_database.update_student(
+        student["id"], surname="Ångström", birthday=date(2012, 6, 7)
+    )
+    derived_fields = app.students_database.get_derived_fields(student)
+    assert derived_fields.birth_date == date(2012, 6, 7)
+    assert derived_fields.surname_casefolded == "ångström"
+    # Derived fields aren't saved with the student
+    assert "birth_date" not in app.students_database.data[-1]
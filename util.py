@@ -1,12 +1,19 @@
 import bcrypt
 import hashlib
+import io
 import json
+import os
+import threading
 from base64 import b64decode, b64encode
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import Any, BinaryIO, Optional, Union
 from datetime import date
 
+from metrics import metrics
 
+
+@metrics.timed("util.check_password")
 def check_password(inputted_password: str, correct_password_hash: str):
     # This is where we add `return true` https://youtu.be/y4GB_NDU43Q?t=97
     correct_hash_bytes = b64decode(correct_password_hash)
@@ -25,21 +32,266 @@ def process_password(raw_password: str) -> bytes:
     return b64encode(hashlib.sha256(raw_password.encode("utf-8")).digest())
 
 
+class FileStorage:
+    """A storage backend that keeps each database in its own file, inside a directory on
+    disk
+    """
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        self.base_path.mkdir(parents=True, exist_ok=True)
+
+    def get_file_path(self, filename: str) -> Optional[Path]:
+        """Get the path to the file that stores the provided database file"""
+        return Path(self.base_path, filename)
+
+    def read_bytes(self, filename: str) -> bytes:
+        """Reads a file's contents, raising FileNotFoundError if it doesn't exist"""
+        with open(Path(self.base_path, filename), "rb") as file:
+            return file.read()
+
+    def write_bytes(self, filename: str, contents: bytes):
+        """Replaces the contents of a file, creating it if it doesn't exist
+
+        - The contents are written to a temporary file first, which then replaces the
+          real file, so anyone reading the file never sees it half-written
+        """
+        file_path = Path(self.base_path, filename)
+        temporary_path = file_path.with_name(f".{filename}.{threading.get_ident()}.tmp")
+        with open(temporary_path, "wb") as file:
+            file.write(contents)
+        os.replace(temporary_path, file_path)
+
+    def append_bytes(self, filename: str, contents: bytes):
+        """Adds to the end of a file, creating it if it doesn't exist"""
+        with open(Path(self.base_path, filename), "ab") as file:
+            file.write(contents)
+
+    def open_for_reading(self, filename: str) -> BinaryIO:
+        """Opens a file so it can be read a bit at a time, raising FileNotFoundError if
+        it doesn't exist
+        """
+        return open(Path(self.base_path, filename), "rb")
+
+    def truncate(self, filename: str, size: int):
+        """Cuts a file down to the provided size, raising FileNotFoundError if it
+        doesn't exist
+        """
+        os.truncate(Path(self.base_path, filename), size)
+
+    def rename(self, filename: str, new_filename: str):
+        """Renames a file, replacing the file that already has the new name (if there is
+        one)
+        """
+        os.replace(Path(self.base_path, filename), Path(self.base_path, new_filename))
+
+    def delete(self, filename: str):
+        """Deletes a file, if it exists"""
+        Path(self.base_path, filename).unlink(missing_ok=True)
+
+
+class MemoryStorage:
+    """A storage backend that keeps the contents of each database in memory, without
+    touching the filesystem
+
+    - Useful for tests and benchmarks, as nothing is shared between instances
+    - All data is lost when the storage object is garbage-collected
+    """
+
+    def __init__(self):
+        # Files are kept as bytearrays, so appending to them doesn't copy the whole file
+        self.files: dict[str, bytearray] = {}
+
+    def get_file_path(self, _filename: str) -> Optional[Path]:
+        """In-memory files don't have a path, so this always returns None"""
+        return None
+
+    def read_bytes(self, filename: str) -> bytes:
+        """Reads a file's contents, raising FileNotFoundError if it doesn't exist"""
+        try:
+            return bytes(self.files[filename])
+        except KeyError:
+            raise FileNotFoundError(f"No such in-memory file: {filename}") from None
+
+    def write_bytes(self, filename: str, contents: bytes):
+        """Replaces the contents of a file, creating it if it doesn't exist"""
+        self.files[filename] = bytearray(contents)
+
+    def append_bytes(self, filename: str, contents: bytes):
+        """Adds to the end of a file, creating it if it doesn't exist"""
+        self.files.setdefault(filename, bytearray()).extend(contents)
+
+    def open_for_reading(self, filename: str) -> BinaryIO:
+        """Opens a file so it can be read a bit at a time, raising FileNotFoundError if
+        it doesn't exist
+        """
+        return io.BytesIO(self.read_bytes(filename))
+
+    def truncate(self, filename: str, size: int):
+        """Cuts a file down to the provided size, raising FileNotFoundError if it
+        doesn't exist
+        """
+        if filename not in self.files:
+            raise FileNotFoundError(f"No such in-memory file: {filename}")
+        del self.files[filename][size:]
+
+    def rename(self, filename: str, new_filename: str):
+        """Renames a file, replacing the file that already has the new name (if there is
+        one)
+        """
+        if filename not in self.files:
+            raise FileNotFoundError(f"No such in-memory file: {filename}")
+        self.files[new_filename] = self.files.pop(filename)
+
+    def delete(self, filename: str):
+        """Deletes a file, if it exists"""
+        self.files.pop(filename, None)
+
+
+class ReadWriteLock:
+    """A lock that lets many threads read at once, while threads that write get
+    exclusive access
+
+    - Writers are given priority over new readers, so a steady stream of reads can't
+      hold up writes forever
+    - Both locks are re-entrant, and the thread holding the write lock can also take the
+      read lock
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._active_readers = 0
+        self._waiting_writers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        # Tracks how many times each thread has taken the read lock, so re-entering it
+        # doesn't wait for writers
+        self._thread_state = threading.local()
+
+    @contextmanager
+    def read(self):
+        """Holds the read lock for the duration of the `with` block"""
+        thread_id = threading.get_ident()
+        read_depth = getattr(self._thread_state, "read_depth", 0)
+        if self._writer == thread_id or read_depth > 0:
+            # This thread already has access
+            self._thread_state.read_depth = read_depth + 1
+            try:
+                yield
+            finally:
+                self._thread_state.read_depth = read_depth
+            return
+
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._active_readers += 1
+        self._thread_state.read_depth = 1
+
+        try:
+            yield
+        finally:
+            self._thread_state.read_depth = 0
+            with self._condition:
+                self._active_readers -= 1
+                if self._active_readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Holds the write lock for the duration of the `with` block"""
+        thread_id = threading.get_ident()
+        with self._condition:
+            if self._writer == thread_id:
+                self._write_depth += 1
+            else:
+                if getattr(self._thread_state, "read_depth", 0):
+                    raise RuntimeError(
+                        "Can't take the write lock while holding the read lock"
+                    )
+                self._waiting_writers += 1
+                while self._writer is not None or self._active_readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = thread_id
+                self._write_depth = 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+# Any of the storage backends that a JSONDatabase can be kept in
+Storage = Union[FileStorage, MemoryStorage]
+
+
 class JSONDatabase:
 
     def get_file_path(self):
-        """Get the path to the database's JSON file"""
-        return self.file_path
+        """Get the path to the database's JSON file (or None if it isn't on disk)"""
+        return self.storage.get_file_path(self.filename)
 
+    @metrics.timed("json_database.save")
     def save(self):
-        """Saves the database to disk, overwriting that the file contents to match the in-memory data."""
-        with open(self.file_path, "w") as file:
-            json.dump(self.data, file)
+        """Saves the database to storage, overwriting the file contents to match the
+        in-memory data.
+
+        - Inside a batch(), the data is only marked as changed, and is saved once at the
+          end of the batch
+        """
+        with self.lock.write():
+            if self._batch_depth:
+                self._unsaved_changes = True
+                # Still count it as a new version, so cached values notice the change
+                # straight away
+                self.version += 1
+                return
+            contents = json.dumps(self.data).encode("utf-8")
+            self.storage.write_bytes(self.filename, contents)
+            self.version += 1
+        metrics.increment("json_database.bytes_written", len(contents))
 
+    @metrics.timed("json_database.load")
     def load(self):
         """Loads the contents of the database file into memory, so that the data can be accessed."""
-        with open(self.file_path, "r") as file:
-            self.data = json.load(file)
+        with self.lock.write():
+            self.data = json.loads(self.storage.read_bytes(self.filename))
+            self.version += 1
+            self.data_replaced()
+
+    @contextmanager
+    def batch(self):
+        """Groups together the changes made inside the `with` block, so the file is
+        written (at most) once at the end
+
+        - Batches can be nested, in which case the file is written at the end of the
+          outermost batch
+        - The changes are still saved if the block raises an exception (e.g. if the user
+          presses Ctrl+C)
+        """
+        with self.lock.write():
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock.write():
+                self._batch_depth -= 1
+                if not self._batch_depth and self._unsaved_changes:
+                    self._unsaved_changes = False
+                    self.save()
+
+    def data_replaced(self):
+        """Called whenever self.data is replaced as a whole (e.g. when it's loaded),
+        with the write lock held
+
+        - Subclasses can override this to rebuild anything that's worked out from the
+          data, e.g. indexes
+        """
 
     def get_initial_data(self, initial_data: Any, initial_data_path: Optional[Path]):
         """Checks the provided file for initial data, otherwise returns the fallback data.
@@ -62,20 +314,37 @@ class JSONDatabase:
         filename: str,
         initial_data: Any,
         initial_data_path: Optional[Path] = None,
+        *,
+        storage: Storage,
     ):
-        if not hasattr(self, "base_path"):
-            raise RuntimeError("JSONDatabase.base_path has not been set!")
+        """A database that is stored as a JSON file
 
-        self.base_path.mkdir(parents=True, exist_ok=True)
-        self.file_path = Path(self.base_path, filename)
+        - storage= is the backend that the file is kept in, e.g. a FileStorage or a
+          MemoryStorage
+        """
+        self.storage = storage
+        self.filename = filename
+        # Incremented every time the data is loaded or saved, so cached values can tell
+        # when they're out of date
+        self.version = 0
+        # Subclasses take the read lock while reading self.data and the write lock while
+        # changing it, so the database can be used from multiple threads (e.g. by the
+        # API server)
+        self.lock = ReadWriteLock()
+        # How many batch() blocks are currently open, and whether save() was called
+        # inside them
+        self._batch_depth = 0
+        self._unsaved_changes = False
 
         # Start off by reading the existing data from the file
         # (and if the file diesn't exist, initialise it with the provided initial data)
         try:
             self.load()
         except FileNotFoundError:
-            self.data = self.get_initial_data(initial_data, initial_data_path)
-            self.save()
+            with self.lock.write():
+                self.data = self.get_initial_data(initial_data, initial_data_path)
+                self.data_replaced()
+                self.save()
 
 
 def get_file(file_path: Path, mode="r"):
@@ -92,12 +361,14 @@ def get_file(file_path: Path, mode="r"):
 
         return open(file_path, mode)
 
+
 def iso_to_locale_string(iso_date: str):
     """Parses an ISO-formatted date, and returns it formatted using the system locale"""
     parsed_date = date.fromisoformat(iso_date)
     locale_formatted_date = parsed_date.strftime("%x")
     return locale_formatted_date
 
+
 def get_path_in_dictionary(dictionary: dict, *path):
     """Given a dictionary of nested dictionaries and values, gets the value at the specified path"""
     # Stores the dictionary we're checking (with the target somewhere inside), or the target item itself